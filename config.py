@@ -22,6 +22,22 @@ _C.MODEL.RESUME = ""
 _C.MODEL.USE_CHECKPOINT = False
 # =====>slowfast
 _C.MODEL.SLOWFAST = CN()
+# temporal stride of the slow and fast pathways on the (skipped) input clip
+_C.MODEL.SLOWFAST.SLOW_STRIDE = 16
+_C.MODEL.SLOWFAST.FAST_STRIDE = 2
+# inference only: fold BatchNorm into convs and merge the stride-sampling convs
+_C.MODEL.SLOWFAST.FUSE_CONV_BN = False
+# inference only: run the 3D convs in channels_last_3d
+_C.MODEL.SLOWFAST.CHANNELS_LAST = False
+# =====>conv3d, input DATA.FRAME_PER_CLIP // DATA.SKIP_FRAME frames of DATA.IMG_SIZE
+_C.MODEL.CONV3D = CN()
+_C.MODEL.CONV3D.HIDDEN = 100
+# =====>conv2d_lstm, input DATA.FRAME_PER_CLIP // DATA.SKIP_FRAME frames of DATA.IMG_SIZE
+_C.MODEL.CONV2D_LSTM = CN()
+# output channels of the 2D convs, read as the steps of the LSTM
+_C.MODEL.CONV2D_LSTM.SEQ_LEN = 32
+_C.MODEL.CONV2D_LSTM.POOL_SIZE = (10, 10)
+_C.MODEL.CONV2D_LSTM.HIDDEN = 128
 # =====>vivit
 _C.MODEL.VIVIT = CN()
 _C.MODEL.VIVIT.INPUT_SIZE = (224, 224)
@@ -37,16 +53,58 @@ _C.MODEL.VIVIT.NUM_LAYER = 12
 # feature dimension
 _C.MODEL.VIVIT.D_MODEL = 512
 _C.MODEL.VIVIT.D_FEATURE = 2048
+# =====>vivit early exit
+_C.MODEL.VIVIT.EARLY_EXIT = CN()
+# layer counts after which an intermediate head (LayerNorm + Linear) is attached, e.g. [4, 8]
+_C.MODEL.VIVIT.EARLY_EXIT.LAYERS = []
+# inference: a sample exits at the first head with softmax confidence >= THRESHOLD, 0 to run all layers
+_C.MODEL.VIVIT.EARLY_EXIT.THRESHOLD = 0.0
+# joint: cross entropy on each head, distill: exit heads learn the final head on detached features
+_C.MODEL.VIVIT.EARLY_EXIT.LOSS = "joint"
+# weight of the loss of each exit head
+_C.MODEL.VIVIT.EARLY_EXIT.WEIGHT = 0.3
+_C.MODEL.VIVIT.EARLY_EXIT.TEMPERATURE = 1.0
+# early-exit mode: thresholds of the accuracy / depth / throughput report
+_C.MODEL.VIVIT.EARLY_EXIT.REPORT_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99]
+# early-exit mode: batches timed for each threshold
+_C.MODEL.VIVIT.EARLY_EXIT.TIMING_BATCH = 20
 
 # data
 _C.DATA = CN()
 _C.DATA.BATCH_SIZE = 8
 _C.DATA.NUM_WORKER = 56
 _C.DATA.PREFETCH = 1
+# one pool of NUM_WORKER decode workers shared by the train, val and test loaders
+_C.DATA.SHARED_WORKERS = False
+# eval batches served before a train batch when both are pending in the shared pool
+_C.DATA.EVAL_PRIORITY = 4
 _C.DATA.IMG_SIZE = (224, 224)
 _C.DATA.FRAME_PER_CLIP = 64
 # drop some frame
 _C.DATA.SKIP_FRAME = 2
+# keep the clip index in flat numpy arrays, worker memory is not copied on write
+_C.DATA.COMPACT_INDEX = False
+# sample the slow and fast pathway inputs in the data layer (slowfast only)
+_C.DATA.DUAL_RATE = False
+# =====>video-locality sampling, needs COMPACT_INDEX
+_C.DATA.LOCALITY = CN()
+# batches are made of shuffled groups of temporally consecutive clips of one video
+_C.DATA.LOCALITY.ENABLE = False
+_C.DATA.LOCALITY.GROUP_SIZE = 4
+# open containers kept by each worker
+_C.DATA.LOCALITY.CONTAINER_CACHE = 8
+# decoded frames kept per container, reused by overlapping clips
+_C.DATA.LOCALITY.FRAME_CACHE = 8
+# =====>shared-memory LRU cache of decoded clips before augmentation (hmdb51), needs COMPACT_INDEX
+_C.DATA.CLIP_CACHE = CN()
+_C.DATA.CLIP_CACHE.ENABLE = False
+# per split, clips beyond it evict the least recently used ones
+_C.DATA.CLIP_CACHE.BUDGET_GB = 16.0
+# (H,W) train clips are resized to before caching, the random resized crop is then taken from the resized clip,
+# empty for the native resolution of the dataset (240x320 for hmdb51) so that the crops match the uncached ones,
+# or IMG_SIZE for a dataset without one, a smaller SIZE fits more clips in the budget but crops upscale an already
+# downsized clip, the cache fails to build when /dev/shm has less free space than it needs
+_C.DATA.CLIP_CACHE.SIZE = []
 # chose a dataset
 _C.DATA.DATASET = "hmdb51"
 # =====>kinetics
@@ -57,6 +115,17 @@ _C.DATA.HMDB51 = CN()
 _C.DATA.HMDB51.VIDEO_FOLDER = None
 # split set
 _C.DATA.HMDB51.ANNOTATION = None
+# =====>synthetic, random clips from a preallocated pool, no video files
+_C.DATA.SYNTHETIC = CN()
+_C.DATA.SYNTHETIC.NUM_SAMPLE = 1024
+# distinct clips held in memory
+_C.DATA.SYNTHETIC.POOL_SIZE = 8
+# simulated decode latency of each sample in ms
+_C.DATA.SYNTHETIC.DECODE_MS = 0.0
+# run the dataset transforms for each sample on raw frames of RAW_SIZE, otherwise the pool is the model input
+_C.DATA.SYNTHETIC.TRANSFORM = False
+# empty to use IMG_SIZE
+_C.DATA.SYNTHETIC.RAW_SIZE = []
 
 # train
 _C.TRAIN = CN()
@@ -72,9 +141,34 @@ _C.TRAIN.AUTO_RESUME = True
 # lr settings
 _C.TRAIN.LR_BASE = 1e-4
 _C.TRAIN.CLIP_GRAD = 5.0
+# multigrid schedule, batch size is scaled to keep per-step compute roughly constant
+_C.TRAIN.MULTIGRID = CN()
+# change clip length and image size every EPOCH_PER_PHASE epochs
+_C.TRAIN.MULTIGRID.LONG_CYCLE = False
+# (frame scale, spatial scale) of each phase
+_C.TRAIN.MULTIGRID.LONG_CYCLE_FACTORS = ((0.25, 0.5 ** 0.5), (0.5, 0.5 ** 0.5), (0.5, 1.0), (1.0, 1.0))
+_C.TRAIN.MULTIGRID.EPOCH_PER_PHASE = 2
+# train the last epochs at the full shape
+_C.TRAIN.MULTIGRID.FINAL_EPOCH = 10
+# change image size every step
+_C.TRAIN.MULTIGRID.SHORT_CYCLE = False
+# spatial scales of the steps of a short cycle, followed by a step at the full size
+_C.TRAIN.MULTIGRID.SHORT_CYCLE_FACTORS = (0.5, 0.5 ** 0.5)
 # optimizer
 _C.TRAIN.OPTIMIZER = CN()
+# adam, adamw or sgd
 _C.TRAIN.OPTIMIZER.NAME = "adam"
+# default, foreach (multi-tensor) or fused (cuda only)
+_C.TRAIN.OPTIMIZER.IMPL = "default"
+# not applied to norm weights, biases and positional embeddings
+_C.TRAIN.OPTIMIZER.WEIGHT_DECAY = 0.0
+_C.TRAIN.OPTIMIZER.BETAS = (0.9, 0.999)
+_C.TRAIN.OPTIMIZER.EPS = 1e-8
+_C.TRAIN.OPTIMIZER.MOMENTUM = 0.9
+_C.TRAIN.OPTIMIZER.NESTEROV = False
+# shard the optimizer state across ranks (ZeRO-1) when torch.distributed is initialized, for callers of
+# utils.optim.build_optimizer that set up the process group, run.py has no distributed launch path yet
+_C.TRAIN.OPTIMIZER.ZERO = False
 # scheduler
 _C.TRAIN.LR_SCHEDULER = CN()
 _C.TRAIN.LR_SCHEDULER.NAME = "step"
@@ -82,6 +176,143 @@ _C.TRAIN.LR_SCHEDULER.WARMUP_EPOCH = 10
 _C.TRAIN.LR_SCHEDULER.DECAY_RATE = 0.1
 _C.TRAIN.LR_SCHEDULER.DECAY_EPOCH = 30
 
+# heatmap export
+_C.HEATMAP = CN()
+# "image" for a tiled overlay image per clip, "video" for an overlay video per clip
+_C.HEATMAP.FORMAT = "image"
+# writer processes for encoding, 0 to encode in the main process
+_C.HEATMAP.NUM_WORKER = 4
+# blending weight of the heatmap
+_C.HEATMAP.ALPHA = 0.5
+_C.HEATMAP.FPS = 8
+
+# frozen-backbone feature cache, train mlp_head from stored features
+_C.PROBE = CN()
+# feature store folder, default to <log dir>/features
+_C.PROBE.FEATURE_DIR = ""
+_C.PROBE.DTYPE = "float16"
+# extract the train features from one random augmentation of each clip instead of the deterministic eval crop
+_C.PROBE.AUGMENT = False
+_C.PROBE.EPOCH = 30
+_C.PROBE.BATCH_SIZE = 256
+_C.PROBE.LR_BASE = 1e-3
+
+# sharded evaluation of the test split in the eval mode
+_C.EVAL = CN()
+# contiguous shards of the split, 0 to evaluate in a single process
+_C.EVAL.NUM_SHARD = 0
+# shards evaluated by this run, empty for all, e.g. to split the evaluation across machines
+_C.EVAL.SHARDS = []
+# evaluation processes, assigned to DEVICES round-robin
+_C.EVAL.NUM_PROCESS = 1
+_C.EVAL.DEVICES = ["cuda:0"]
+# per-clip logits and merged results, default to <log dir>/eval_shards
+_C.EVAL.OUTPUT_DIR = ""
+_C.EVAL.DTYPE = "float32"
+
+# extract mode: pooled backbone features of whole splits
+_C.EXTRACT = CN()
+_C.EXTRACT.SPLITS = ["train", "val"]
+# feature store folder, default to <log dir>/features, shared with the probe mode
+_C.EXTRACT.FEATURE_DIR = ""
+_C.EXTRACT.DTYPE = "float16"
+_C.EXTRACT.BATCH_SIZE = 64
+# batches between flushes, an interrupted run resumes after the last flush
+_C.EXTRACT.FLUSH_FREQ = 50
+# batches waiting to be written
+_C.EXTRACT.QUEUE_SIZE = 4
+
+# distill mode: train the model of this config (student) on soft targets of a teacher
+_C.DISTILL = CN()
+# config file of the teacher model, its data section is replaced by the student's
+_C.DISTILL.TEACHER_CONFIG = ""
+_C.DISTILL.TEACHER_CHECKPOINT = ""
+# precompute teacher logits of the train split once instead of running the teacher every step,
+# cached logits are of a single augmented view per clip
+_C.DISTILL.CACHE = False
+# default to <log dir>/teacher_logits
+_C.DISTILL.CACHE_DIR = ""
+_C.DISTILL.TEMPERATURE = 4.0
+# weight of the soft target loss, 1 - ALPHA for the labels
+_C.DISTILL.ALPHA = 0.9
+# val batches timed in the speed/accuracy report
+_C.DISTILL.REPORT_BATCH = 5
+
+# sweep mode: trials of this config with the overrides of SPACE, fed by one shared decode pipeline
+_C.SWEEP = CN()
+# "grid" over the lists of values, or NUM_TRIAL "random" samples
+_C.SWEEP.SEARCH = "grid"
+# [key, [values]] items, random search also takes [key, "uniform" | "loguniform" | "randint", low, high]
+# DATA keys are shared by all trials, e.g. [["TRAIN.LR_BASE", [1.0e-4, 3.0e-4]], ["TRAIN.ACCUMULATION_STEP", [1, 4]]]
+_C.SWEEP.SPACE = []
+_C.SWEEP.NUM_TRIAL = 8
+# trials running at once, assigned to DEVICES round-robin
+_C.SWEEP.NUM_PARALLEL = 4
+_C.SWEEP.DEVICES = ["cuda:0"]
+# batches waiting for each trial, the slowest trial paces the producer
+_C.SWEEP.QUEUE_SIZE = 4
+# per-trial budget: minutes of training (0 for none), fraction of the device memory (0 for none), cpu threads
+_C.SWEEP.TIME_BUDGET_MIN = 0.0
+_C.SWEEP.MEMORY_FRACTION = 0.0
+_C.SWEEP.NUM_THREAD = 2
+# epochs between evaluations of the val split
+_C.SWEEP.EVAL_FREQ = 1
+# after GRACE_EPOCH, stop the trials below the STOP_QUANTILE of the eval top1 of the running trials
+_C.SWEEP.EARLY_STOP = True
+_C.SWEEP.GRACE_EPOCH = 3
+_C.SWEEP.STOP_QUANTILE = 0.5
+
+# per-module FLOPs, activation memory and latency
+_C.PROFILE = CN()
+_C.PROFILE.DEVICE = "cpu"
+_C.PROFILE.BATCH_SIZE = [1, 2, 4]
+# model input frames, empty to use DATA.FRAME_PER_CLIP // DATA.SKIP_FRAME
+_C.PROFILE.CLIP_LENGTH = []
+_C.PROFILE.WARMUP = 1
+_C.PROFILE.REPEAT = 3
+# module depth in the printed table
+_C.PROFILE.DEPTH = 2
+
+# torch.profiler and stage timers of the train/eval loops
+_C.PROFILER = CN()
+# trace the steps chosen by the schedule below
+_C.PROFILER.ENABLE = False
+# train epochs (0-based) to trace
+_C.PROFILER.EPOCH = [0]
+# also trace the evaluation after these epochs, the eval mode is traced whenever ENABLE is set
+_C.PROFILER.EVAL = False
+# schedule: skip SKIP_FIRST steps, then REPEAT cycles of WAIT idle, WARMUP discarded and ACTIVE traced steps
+_C.PROFILER.SKIP_FIRST = 10
+_C.PROFILER.WAIT = 1
+_C.PROFILER.WARMUP = 1
+_C.PROFILER.ACTIVE = 3
+_C.PROFILER.REPEAT = 1
+_C.PROFILER.RECORD_SHAPES = False
+_C.PROFILER.PROFILE_MEMORY = False
+_C.PROFILER.WITH_STACK = False
+# traces in <log dir>/profiler, for chrome://tracing and for the TensorBoard profiler plugin
+_C.PROFILER.CHROME_TRACE = True
+_C.PROFILER.TENSORBOARD = True
+# rows of the operator table written to the log
+_C.PROFILER.ROW_LIMIT = 20
+# train steps between stage timings, reading the timers waits for the device
+_C.PROFILER.TIMER_FREQ = 1
+
+# post-training quantization
+_C.QUANTIZE = CN()
+_C.QUANTIZE.BACKEND = "fbgemm"
+# batches of the train split used to calibrate static quantization
+_C.QUANTIZE.CALIBRATION_BATCH = 32
+# batches of the val split used to compare float32 and int8
+_C.QUANTIZE.EVAL_BATCH = 32
+# cpu threads, 0 to keep the torch default
+_C.QUANTIZE.NUM_THREAD = 0
+
+# inference artifact export
+_C.EXPORT = CN()
+# the traced graph has a fixed batch size, the runner pads the last batch
+_C.EXPORT.BATCH_SIZE = 8
+
 _C.LOG = CN()
 _C.LOG.LOG_DIR = "./log"
 
@@ -90,11 +321,36 @@ def __check_config(config):
     # check fpc
     if config.MODEL.ARCH == "vivit":
         assert config.DATA.FRAME_PER_CLIP // config.DATA.SKIP_FRAME == config.MODEL.VIVIT.FRAME_PER_CLIP
+    if config.DATA.DUAL_RATE:
+        assert config.MODEL.ARCH == "slowfast", "dual-rate sampling is only supported by slowfast"
+        assert config.MODEL.SLOWFAST.SLOW_STRIDE % config.MODEL.SLOWFAST.FAST_STRIDE == 0
+    if config.DATA.SHARED_WORKERS:
+        # each long-cycle phase would start another pool next to the one of the val split
+        assert not (config.TRAIN.MULTIGRID.LONG_CYCLE or config.TRAIN.MULTIGRID.SHORT_CYCLE), \
+            "multigrid needs dedicated train loaders"
+    if config.MODE == "distill":
+        assert config.DISTILL.TEACHER_CONFIG and config.DISTILL.TEACHER_CHECKPOINT, "distill needs a teacher"
+        # the train batches carry clip indices
+        assert not config.DATA.SHARED_WORKERS, "distill builds indexed train loaders, disable DATA.SHARED_WORKERS"
+        assert not config.TRAIN.MULTIGRID.SHORT_CYCLE, "short cycle batches can not be indexed"
+        assert not (config.DISTILL.CACHE and config.TRAIN.MULTIGRID.LONG_CYCLE), \
+            "cached teacher logits are indexed by the clips of the base clip length"
+    # run.py trains in a single process, build_optimizer would silently fall back to the unsharded optimizer
+    assert not config.TRAIN.OPTIMIZER.ZERO, "TRAIN.OPTIMIZER.ZERO needs a distributed launch, which run.py has not"
+    if config.MODE == "sweep":
+        assert config.SWEEP.SPACE, "sweep needs SWEEP.SPACE"
+    if config.DATA.LOCALITY.ENABLE:
+        assert config.DATA.COMPACT_INDEX, "video-locality sampling needs DATA.COMPACT_INDEX"
+    if config.DATA.CLIP_CACHE.ENABLE:
+        assert config.DATA.COMPACT_INDEX, "the decoded-clip cache needs DATA.COMPACT_INDEX"
+        assert config.DATA.DATASET == "hmdb51", "the decoded-clip cache is only built for hmdb51"
     # check dataset
     if config.DATA.DATASET == "hmdb51":
         assert config.MODEL.NUM_CLASSES == 51, "class number not match"
     elif config.DATA.DATASET == "kinetics":  # kinetics-400
         assert config.MODEL.NUM_CLASSES == 400, "class number not match"
+    elif config.DATA.DATASET == "synthetic":
+        assert not config.DATA.COMPACT_INDEX, "synthetic clips have no clip index"
     else:
         raise NotImplementedError(f"dataset {config.DATA.DATASET} is not supported")
 
@@ -110,6 +366,11 @@ def __parse_args_config(args):
         config_list += ["DATA.HMDB51.ANNOTATION", args.annotation]
     elif args.dataset == "kinetics":
         config_list += ["DATA.KINETICS.VIDEO_FOLDER", args.video]
+    elif args.dataset == "synthetic":
+        if args.num_sample is not None:
+            config_list += ["DATA.SYNTHETIC.NUM_SAMPLE", args.num_sample]
+        if args.decode_ms is not None:
+            config_list += ["DATA.SYNTHETIC.DECODE_MS", args.decode_ms]
     else:
         raise ValueError(f"dataset {args.dataset} is not set in the config")
     return config_list
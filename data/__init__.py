@@ -1,5 +1,10 @@
 from .hmdb51 import build_hmdb51_set
 from .kinetics import build_kinetics_loader
-from .build import build_loader
+from .synthetic import build_synthetic_loader, SyntheticClips
+from .build import build_loader, build_dataset, dataset_classes
+from .clip_index import ClipIndexDataset
+from .manager import LoaderManager
 
-__all__ = ["build_hmdb51_set", "build_kinetics_loader", "build_loader"]
+__all__ = ["build_hmdb51_set", "build_kinetics_loader", "build_synthetic_loader", "SyntheticClips",
+           "build_loader", "build_dataset", "dataset_classes",
+           "ClipIndexDataset", "LoaderManager"]
@@ -1,31 +1,126 @@
 import os
 from yacs.config import CfgNode
 from torch.utils.data import DataLoader
+from torchvision.datasets.folder import find_classes
 from .hmdb51 import build_hmdb51_set
 from .kinetics import build_kinetics_loader
+from .synthetic import build_synthetic_loader
+from .manager import LoaderManager
+from .transforms import build_transforms
 import warnings
 
 warnings.simplefilter("ignore", UserWarning)
 
 
-def build_loader(config: CfgNode) -> (DataLoader, DataLoader, DataLoader):
+SPLITS = ("train", "val", "test")
+# (H,W) train clips are cached at when DATA.CLIP_CACHE.SIZE is empty, the native resolution of most videos
+CACHE_SIZE = {"hmdb51": (240, 320)}
+
+
+def build_loader(config: CfgNode, splits=SPLITS) -> (DataLoader, DataLoader, DataLoader):
+    """
+    :param splits: splits to build, the loaders of the other splits are None
+    """
     dataset = config.DATA.DATASET
     kwargs = {"num_workers": config.DATA.NUM_WORKER,
               "batch_size": config.DATA.BATCH_SIZE,
               "size": config.DATA.IMG_SIZE,
               "frame_per_clip": config.DATA.FRAME_PER_CLIP,
-              "skip": config.DATA.SKIP_FRAME}
+              "skip": config.DATA.SKIP_FRAME,
+              "compact_index": config.DATA.COMPACT_INDEX}
+    if config.DATA.DUAL_RATE:
+        kwargs["dual_rate"] = (config.MODEL.SLOWFAST.SLOW_STRIDE, config.MODEL.SLOWFAST.FAST_STRIDE)
+    if config.DATA.LOCALITY.ENABLE:
+        kwargs["locality"] = (config.DATA.LOCALITY.GROUP_SIZE,
+                              config.DATA.LOCALITY.CONTAINER_CACHE,
+                              config.DATA.LOCALITY.FRAME_CACHE)
 
+    if config.DATA.SHARED_WORKERS:
+        # datasets only, the workers are owned by the LoaderManager
+        kwargs["num_workers"] = 0
+
+    loaders = {}
     if dataset == "hmdb51":
         args = [config.DATA.HMDB51.VIDEO_FOLDER, config.DATA.HMDB51.ANNOTATION]
-        dataloader_train = build_hmdb51_set(*args, **kwargs, train=True)
-        dataloader_test = dataloader_val = build_hmdb51_set(*args, **kwargs, train=False)
+        if config.DATA.CLIP_CACHE.ENABLE:
+            kwargs["clip_cache"] = (int(config.DATA.CLIP_CACHE.BUDGET_GB * 2 ** 30),
+                                    tuple(config.DATA.CLIP_CACHE.SIZE) or CACHE_SIZE.get(dataset))
+        if "train" in splits:
+            loaders["train"] = build_hmdb51_set(*args, **kwargs, train=True)
+        if "val" in splits or "test" in splits:
+            loaders["test"] = loaders["val"] = build_hmdb51_set(*args, **kwargs, train=False)
     elif dataset == "kinetics":
         root = config.DATA.KINETICS.VIDEO_FOLDER
-        dataloader_train = build_kinetics_loader(os.path.join(root, "train"), **kwargs)
-        dataloader_val = build_kinetics_loader(os.path.join(root, "val"), **kwargs)
-        dataloader_test = build_kinetics_loader(os.path.join(root, "test"), **kwargs)
+        for split in splits:
+            loaders[split] = build_kinetics_loader(os.path.join(root, split), **kwargs)
+    elif dataset == "synthetic":
+        cfg = config.DATA.SYNTHETIC
+        for seed, split in enumerate(SPLITS):
+            if split not in splits:
+                continue
+            loaders[split] = build_synthetic_loader(cfg.NUM_SAMPLE, config.MODEL.NUM_CLASSES,
+                                                    num_workers=kwargs["num_workers"],
+                                                    batch_size=kwargs["batch_size"],
+                                                    frame_per_clip=kwargs["frame_per_clip"],
+                                                    skip=kwargs["skip"],
+                                                    size=kwargs["size"],
+                                                    train=split == "train",
+                                                    dual_rate=kwargs.get("dual_rate"),
+                                                    raw_size=tuple(cfg.RAW_SIZE) or None,
+                                                    pool_size=cfg.POOL_SIZE,
+                                                    decode_ms=cfg.DECODE_MS,
+                                                    transform=cfg.TRANSFORM,
+                                                    seed=config.SEED + seed)
     else:
         raise ValueError
 
-    return dataloader_train, dataloader_val, dataloader_test
+    if config.DATA.SHARED_WORKERS and loaders:
+        any_loader = next(iter(loaders.values()))
+        manager = LoaderManager({split: loader.dataset for split, loader in loaders.items()},
+                                collate_fn=any_loader.collate_fn,
+                                num_workers=config.DATA.NUM_WORKER,
+                                prefetch=config.DATA.PREFETCH,
+                                eval_priority=config.DATA.EVAL_PRIORITY)
+        loaders = {split: manager.loader(split, config.DATA.BATCH_SIZE,
+                                         batch_sampler=loader.batch_sampler if config.DATA.LOCALITY.ENABLE else None)
+                   for split, loader in loaders.items()}
+
+    return tuple(loaders[split] if split in splits else None for split in SPLITS)
+
+
+def build_dataset(config: CfgNode, split, augment=True):
+    """
+    dataset of a split, without starting loader workers or a LoaderManager
+    :param augment: keep the random augmentation of the train split, otherwise its clips get the deterministic
+        eval transforms, e.g. to extract features once per clip
+    """
+    config = config.clone()
+    config.defrost()
+    config.DATA.SHARED_WORKERS = False
+    config.DATA.NUM_WORKER = 0
+    if not augment:  # the cache holds clips before augmentation
+        config.DATA.CLIP_CACHE.ENABLE = False
+    config.freeze()
+    dataset = build_loader(config, splits=(split,))[SPLITS.index(split)].dataset
+    if not augment and getattr(dataset, "transform", None) is not None:
+        dual_rate = (config.MODEL.SLOWFAST.SLOW_STRIDE, config.MODEL.SLOWFAST.FAST_STRIDE) \
+            if config.DATA.DUAL_RATE else None
+        dataset.transform = build_transforms(config.DATA.IMG_SIZE, config.DATA.SKIP_FRAME,
+                                             config.DATA.FRAME_PER_CLIP, train=False, dual_rate=dual_rate)
+    return dataset
+
+
+def dataset_classes(config: CfgNode) -> list:
+    """
+    class names in label order, without loading the dataset
+    """
+    dataset = config.DATA.DATASET
+    if dataset == "hmdb51":
+        root = config.DATA.HMDB51.VIDEO_FOLDER
+    elif dataset == "kinetics":
+        root = os.path.join(config.DATA.KINETICS.VIDEO_FOLDER, "train")
+    elif dataset == "synthetic":
+        return [f"class_{i}" for i in range(config.MODEL.NUM_CLASSES)]
+    else:
+        raise ValueError
+    return find_classes(root)[0]
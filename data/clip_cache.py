@@ -0,0 +1,130 @@
+import os
+import math
+import shutil
+import torch
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+# counters
+TICK, HIT, MISS, EVICT = range(4)
+
+
+def check_shm_space(size, shm_dir="/dev/shm"):
+    """
+    fail before allocating a block the shared memory filesystem can not hold, pages are only allocated when a
+    slot is first filled, so an oversized block would crash a worker with SIGBUS in the middle of an epoch
+    """
+    if not os.path.isdir(shm_dir):  # no tmpfs to check, e.g. on macos and windows
+        return
+    free = shutil.disk_usage(shm_dir).free
+    if size > free:
+        raise ValueError(f"the clip cache needs {size / 2 ** 30:.2f} GB but {shm_dir} has "
+                         f"{free / 2 ** 30:.2f} GB free, lower DATA.CLIP_CACHE.BUDGET_GB")
+
+
+class SharedClipCache:
+    """
+    LRU cache of decoded uint8 clips of one shape in shared memory, read and filled by every DataLoader worker
+    the clips are stored in budget // clip bytes slots of a shared memory block, pages are only allocated when
+    a slot is first filled; the clip -> slot table, the last use of each slot and the counters are shared tensors
+    """
+
+    def __init__(self, num_clips, clip_shape, budget_bytes):
+        self.clip_shape = tuple(clip_shape)
+        self.clip_bytes = math.prod(self.clip_shape)
+        self.num_slots = int(min(num_clips, budget_bytes // self.clip_bytes))
+        self.clip_slot = torch.full((num_clips,), -1, dtype=torch.int64).share_memory_()
+        self.slot_clip = torch.full((self.num_slots,), -1, dtype=torch.int64).share_memory_()
+        self.slot_tick = torch.zeros(self.num_slots, dtype=torch.int64).share_memory_()  # 0 for empty slots
+        self.counters = torch.zeros(4, dtype=torch.int64).share_memory_()
+        self.lock = mp.Lock()
+        self.owner = os.getpid()
+        check_shm_space(self.num_slots * self.clip_bytes)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, self.num_slots * self.clip_bytes))
+        self._map()
+
+    def _map(self):
+        if self.num_slots == 0:  # budget below one clip
+            self.data = torch.empty((0, *self.clip_shape), dtype=torch.uint8)
+            return
+        self.data = torch.frombuffer(self.shm.buf, dtype=torch.uint8, count=self.num_slots * self.clip_bytes)
+        self.data = self.data.view(self.num_slots, *self.clip_shape)
+
+    def __getstate__(self):
+        # spawned workers attach to the block by name
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        del state["data"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = None  # only the creating instance unlinks the block
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+        self._map()
+
+    def __len__(self):
+        return int((self.slot_clip >= 0).sum())
+
+    def get(self, idx):
+        """
+        :return: copy of the cached clip, None on a miss
+        """
+        with self.lock:
+            slot = int(self.clip_slot[idx])
+            if slot < 0:
+                self.counters[MISS] += 1
+                return None
+            self.counters[HIT] += 1
+            self.counters[TICK] += 1
+            self.slot_tick[slot] = self.counters[TICK]
+            return self.data[slot].clone()
+
+    def put(self, idx, clip):
+        """
+        store a clip in an empty slot, or in the least recently used one
+        """
+        if self.num_slots == 0:
+            return
+        assert tuple(clip.shape) == self.clip_shape and clip.dtype == torch.uint8, f"{clip.shape} {clip.dtype}"
+        with self.lock:
+            if self.clip_slot[idx] >= 0:  # filled by another worker meanwhile
+                return
+            slot = int(torch.argmin(self.slot_tick))
+            evicted = int(self.slot_clip[slot])
+            if evicted >= 0:
+                self.clip_slot[evicted] = -1
+                self.counters[EVICT] += 1
+            self.data[slot].copy_(clip)
+            self.slot_clip[slot] = idx
+            self.clip_slot[idx] = slot
+            self.counters[TICK] += 1
+            self.slot_tick[slot] = self.counters[TICK]
+
+    def stats(self, reset=False):
+        """
+        :param reset: restart the hit, miss and eviction counts, e.g. to report each epoch
+        """
+        with self.lock:
+            hits, misses, evictions = self.counters[HIT].item(), self.counters[MISS].item(), self.counters[EVICT].item()
+            if reset:
+                self.counters[HIT:] = 0
+        return {"hits": hits, "misses": misses, "evictions": evictions,
+                "hit_rate": hits / max(1, hits + misses),
+                "clips": len(self), "slots": self.num_slots,
+                "bytes": len(self) * self.clip_bytes}
+
+    def close(self):
+        if self.shm is None:
+            return
+        del self.data  # views of the buffer must be released before closing
+        self.shm.close()
+        if os.getpid() == self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:  # already unlinked, e.g. by a forked copy
+                pass
+        self.shm = None
+
+    def __del__(self):
+        self.close()
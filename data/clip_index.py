@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import torch
+from torch.utils import data
+from torchvision.io import read_video
+
+# slots of the per-worker rss table
+MAX_WORKER = 256
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def video_labels(dataset):
+    """
+    label of each video in dataset.video_clips of a torchvision video dataset
+    """
+    if hasattr(dataset, "indices"):  # HMDB51 only keeps the videos of the selected fold
+        return [dataset.samples[i][1] for i in dataset.indices]
+    return [label for _, label in dataset.samples]
+
+
+class ClipIndexDataset(data.Dataset):
+    """
+    clip index of a VideoClips based dataset (Kinetics400, HMDB51) flattened into a few numpy arrays
+    reading a sample does not touch Python objects shared with the parent process,
+    so the pages of forked workers are not copied on write
+    """
+
+    def __init__(self, paths, path_offsets, clip_video, clip_start, clip_end, labels, num_frames, transform=None):
+        self.paths = paths  # uint8, utf-8 video paths concatenated
+        self.path_offsets = path_offsets  # int64, (num_video + 1,)
+        self.clip_video = clip_video  # int32, video index of each clip
+        self.clip_start = clip_start  # int64, first pts of each clip
+        self.clip_end = clip_end  # int64, last pts of each clip
+        self.labels = labels  # int64, label of each clip
+        self.num_frames = num_frames
+        self.transform = transform
+        self.decoder = None  # ContainerCache of data.sampler, decodes with read_video when None
+        # SharedClipCache of data.clip_cache holding the outputs of transform, augment is applied after it
+        self.clip_cache = None
+        self.augment = None
+        # rss of each worker, updated while loading
+        self.worker_rss = torch.zeros(MAX_WORKER, dtype=torch.int64).share_memory_()
+        self.rss_freq = 64
+
+    @classmethod
+    def from_video_dataset(cls, dataset):
+        video_clips = dataset.video_clips
+        assert video_clips.frame_rate is None, "frame rate resampling is not supported"
+
+        encoded = [path.encode("utf-8") for path in video_clips.video_paths]
+        path_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        path_offsets[1:] = np.cumsum([len(path) for path in encoded])
+        paths = np.frombuffer(b"".join(encoded), dtype=np.uint8).copy()
+
+        num_clips = [len(clips) for clips in video_clips.clips]
+        clip_video = np.repeat(np.arange(len(num_clips), dtype=np.int32), num_clips)
+        clips = [clips for clips in video_clips.clips if len(clips) > 0]
+        if clips:
+            clips = torch.cat(clips).numpy()
+            clip_start, clip_end = clips[:, 0].astype(np.int64), clips[:, -1].astype(np.int64)
+        else:
+            clip_start = clip_end = np.zeros(0, dtype=np.int64)
+        labels = np.asarray(video_labels(dataset), dtype=np.int64)[clip_video]
+
+        return cls(paths, path_offsets, clip_video, clip_start, clip_end, labels,
+                   num_frames=video_clips.num_frames, transform=dataset.transform)
+
+    def __len__(self):
+        return len(self.clip_video)
+
+    def video_path(self, video_idx):
+        start, end = self.path_offsets[video_idx], self.path_offsets[video_idx + 1]
+        return self.paths[start:end].tobytes().decode("utf-8")
+
+    def _track_rss(self, idx):
+        worker_info = data.get_worker_info()
+        if worker_info is not None and worker_info.id < MAX_WORKER and idx % self.rss_freq == 0:
+            self.worker_rss[worker_info.id] = rss_bytes()
+
+    def _decode(self, idx):
+        path, start, end = self.video_path(self.clip_video[idx]), int(self.clip_start[idx]), int(self.clip_end[idx])
+        if self.decoder is not None:
+            video, audio = self.decoder.read(path, start, end), torch.zeros(1, 0)
+        else:
+            # same as VideoClips.get_clip with the pyav backend
+            video, audio, _ = read_video(path, start, end, pts_unit="pts")
+        video = video[:self.num_frames]
+        assert len(video) == self.num_frames, f"{video.shape} x {self.num_frames}"
+        if self.transform is not None:
+            video = self.transform(video)
+        return video, audio
+
+    def __getitem__(self, idx):
+        video = self.clip_cache.get(idx) if self.clip_cache is not None else None
+        if video is not None:
+            audio = torch.zeros(1, 0)
+        else:
+            video, audio = self._decode(idx)
+            if self.clip_cache is not None:
+                self.clip_cache.put(idx, video)
+        if self.augment is not None:
+            video = self.augment(video)
+        self._track_rss(idx)
+        return video, audio, int(self.labels[idx])
@@ -1,39 +1,40 @@
 import os
-from torch.utils import data
 from torchvision.datasets import HMDB51
 from torchvision.transforms import *
 import warnings
 from .metadata import save_metadata, load_metadata
-import einops
+from .transforms import build_transforms, build_cache_transforms, collate_clips
+from .clip_index import ClipIndexDataset
+from .clip_cache import SharedClipCache
+from .sampler import build_clip_loader
 
 warnings.simplefilter("ignore", UserWarning)
 
 
 def build_hmdb51_set(root, annotation, num_workers,
-                     batch_size=1, frame_per_clip=64, skip=2, size=(224, 224), train=True):
-    if train:
-        transforms = Compose([
-            lambda x: einops.rearrange(x[::skip, :, :, :], "t h w c->c t h w"),
-            RandomResizedCrop(size, (0.5, 1)),
-        ])
+                     batch_size=1, frame_per_clip=64, skip=2, size=(224, 224), train=True, dual_rate=None,
+                     compact_index=False, locality=None, clip_cache=None):
+    """
+    :param clip_cache: (budget in bytes, (H,W) of the cached train clips or None), keep the decoded clips before
+        augmentation in a shared-memory LRU cache, needs compact_index
+    """
+    if clip_cache is None:
+        transforms = build_transforms(size, skip, frame_per_clip, train=train, dual_rate=dual_rate)
     else:
-        transforms = Compose([
-            lambda x: einops.rearrange(x[::skip, :, :, :], "t h w c->c t h w"),
-            Resize(size),
-            CenterCrop(size),
-        ])
+        assert compact_index, "the decoded-clip cache needs DATA.COMPACT_INDEX"
+        transforms, augment, clip_shape = build_cache_transforms(size, skip, frame_per_clip, train=train,
+                                                                 dual_rate=dual_rate, cache_size=clip_cache[1])
 
     metadata = load_metadata(root)
     hmdb51 = HMDB51(root, annotation, frame_per_clip, step_between_clips=frame_per_clip,
                     _precomputed_metadata=metadata, transform=transforms, train=train,
                     num_workers=os.cpu_count()
                     )
-    save_metadata(root, metadata)
+    save_metadata(root, hmdb51.metadata)
+    if compact_index:
+        hmdb51 = ClipIndexDataset.from_video_dataset(hmdb51)
+    if clip_cache is not None:
+        hmdb51.augment = augment
+        hmdb51.clip_cache = SharedClipCache(len(hmdb51), clip_shape, clip_cache[0])
 
-    return data.DataLoader(hmdb51, batch_size,
-                           shuffle=True, num_workers=num_workers, persistent_workers=True if num_workers > 0 else False,
-                           pin_memory=True,
-                           collate_fn=lambda batch: [
-                               torch.stack([batch[i][0] for i in range(len(batch))], dim=0),
-                               torch.LongTensor([batch[i][2] for i in range(len(batch))]),
-                           ])
+    return build_clip_loader(hmdb51, batch_size, num_workers, collate_clips, locality=locality)
@@ -1,27 +1,19 @@
 import os
-from torch.utils import data
 from torchvision.datasets import Kinetics400
 from torchvision.transforms import *
 from .metadata import save_metadata, load_metadata
+from .transforms import build_transforms, collate_clips
+from .clip_index import ClipIndexDataset
+from .sampler import build_clip_loader
 import warnings
-import einops
 
 warnings.simplefilter("ignore", UserWarning)
 
 
 def build_kinetics_loader(video_root, num_workers,
-                          batch_size=1, frame_per_clip=64, skip=2, size=(224, 224), train=True):
-    if train:
-        transforms = Compose([
-            lambda x: einops.rearrange(x[::skip, :, :, :], "t h w c->c t h w"),
-            RandomResizedCrop(size, (0.5, 1)),
-        ])
-    else:
-        transforms = Compose([
-            lambda x: einops.rearrange(x[::skip, :, :, :], "t h w c->c t h w"),
-            Resize(size),
-            CenterCrop(size),
-        ])
+                          batch_size=1, frame_per_clip=64, skip=2, size=(224, 224), train=True, dual_rate=None,
+                          compact_index=False, locality=None):
+    transforms = build_transforms(size, skip, frame_per_clip, train=train, dual_rate=dual_rate)
 
     metadata = load_metadata(video_root)
     kinetics = Kinetics400(
@@ -31,13 +23,7 @@ def build_kinetics_loader(video_root, num_workers,
         num_workers=os.cpu_count()  # for loading video metadata
     )
     save_metadata(video_root, kinetics.metadata)
+    if compact_index:
+        kinetics = ClipIndexDataset.from_video_dataset(kinetics)
 
-    return data.DataLoader(kinetics, batch_size,
-                           shuffle=True,
-                           num_workers=num_workers,
-                           persistent_workers=True if num_workers > 0 else False,
-                           pin_memory=True,
-                           collate_fn=lambda batch: [
-                               torch.stack([batch[i][0] for i in range(len(batch))], dim=0),
-                               torch.LongTensor([batch[i][2] for i in range(len(batch))]),
-                           ])
+    return build_clip_loader(kinetics, batch_size, num_workers, collate_clips, locality=locality)
@@ -0,0 +1,173 @@
+import math
+import queue
+import random
+import itertools
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+# seconds between liveness checks of the workers while waiting for a batch
+POLL_INTERVAL = 5.0
+
+
+class WorkerError:
+    def __init__(self, message):
+        self.message = message
+
+
+def _worker_loop(worker_id, datasets, collate_fn, eval_queue, train_queue, result_queue, eval_priority, seed):
+    torch.set_num_threads(1)
+    random.seed(seed + worker_id)
+    np.random.seed((seed + worker_id) % 2 ** 32)
+    torch.manual_seed(seed + worker_id)
+
+    served_eval = 0
+    while True:
+        # serve up to eval_priority eval batches before a train batch, when both are pending
+        order = (eval_queue, train_queue) if served_eval < eval_priority else (train_queue, eval_queue)
+        task = None
+        for task_queue in order:
+            try:
+                task = task_queue.get_nowait()
+                break
+            except queue.Empty:
+                pass
+        if task is None:
+            try:
+                task = order[0].get(timeout=0.01)
+            except queue.Empty:
+                continue
+        if task == "stop":
+            break
+
+        split, iteration, batch_idx, indices = task
+        served_eval = served_eval + 1 if split != "train" else 0
+        try:
+            batch = collate_fn([datasets[split][i] for i in indices])
+        except Exception as e:
+            batch = WorkerError(f"{type(e).__name__} in worker {worker_id} ({split}): {e}")
+        result_queue.put((iteration, batch_idx, batch))
+
+
+def pin(batch):
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(pin(b) for b in batch)
+    return batch.pin_memory()
+
+
+class SplitLoader:
+    """
+    DataLoader-like view of one split, batches are produced by the workers of a LoaderManager
+    """
+
+    def __init__(self, manager, split, batch_size, shuffle=True, drop_last=False, batch_sampler=None):
+        self.manager = manager
+        self.split = split
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.batch_sampler = batch_sampler  # replaces batch_size/shuffle/drop_last when given
+
+    @property
+    def dataset(self):
+        return self.manager.datasets[self.split]
+
+    def __len__(self):
+        if self.batch_sampler is not None:
+            return len(self.batch_sampler)
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return math.ceil(len(self.dataset) / self.batch_size)
+
+    def __iter__(self):
+        if self.batch_sampler is not None:
+            return self.manager.iterate(self.split, list(self.batch_sampler))
+        order = torch.randperm(len(self.dataset)) if self.shuffle else torch.arange(len(self.dataset))
+        batches = [indices.tolist() for indices in order.split(self.batch_size)][:len(self)]
+        return self.manager.iterate(self.split, batches)
+
+
+class LoaderManager:
+    """
+    one pool of decode workers shared by the loaders of all splits
+    train batches and eval (val/test) batches are queued separately, a worker serves up to eval_priority
+    eval batches before a train batch when both are pending
+    """
+
+    def __init__(self, datasets, collate_fn, num_workers, prefetch=2, eval_priority=4, pin_memory=True):
+        self.datasets = datasets
+        self.collate_fn = collate_fn
+        self.num_workers = max(1, num_workers)
+        self.prefetch = prefetch
+        self.eval_priority = eval_priority
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.workers = []
+        self.iteration_counter = itertools.count()
+        self.active = set()
+        self.buffer = {}
+
+    def loader(self, split, batch_size, shuffle=True, batch_sampler=None):
+        return SplitLoader(self, split, batch_size, shuffle=shuffle, batch_sampler=batch_sampler)
+
+    def start(self):
+        if self.workers:
+            return
+        self.eval_queue = mp.Queue()
+        self.train_queue = mp.Queue()
+        self.result_queue = mp.Queue()
+        seed = int(torch.empty((), dtype=torch.int64).random_().item()) % 2 ** 31
+        for worker_id in range(self.num_workers):
+            worker = mp.Process(target=_worker_loop,
+                                args=(worker_id, self.datasets, self.collate_fn, self.eval_queue, self.train_queue,
+                                      self.result_queue, self.eval_priority, seed),
+                                daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _receive(self, iteration, batch_idx):
+        while (iteration, batch_idx) not in self.buffer:
+            try:
+                result_iteration, result_idx, batch = self.result_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                dead = [w.pid for w in self.workers if not w.is_alive()]
+                if dead:
+                    raise RuntimeError(f"loader workers {dead} exited unexpectedly")
+                continue
+            if result_iteration in self.active:  # batches of abandoned iterations are dropped
+                self.buffer[(result_iteration, result_idx)] = batch
+        batch = self.buffer.pop((iteration, batch_idx))
+        if isinstance(batch, WorkerError):
+            raise RuntimeError(batch.message)
+        return batch
+
+    def iterate(self, split, batches):
+        self.start()
+        iteration = next(self.iteration_counter)
+        task_queue = self.train_queue if split == "train" else self.eval_queue
+        self.active.add(iteration)
+        try:
+            sent = 0
+            for batch_idx in range(len(batches)):
+                # keep prefetch batches per worker in flight
+                while sent < len(batches) and sent < batch_idx + self.prefetch * self.num_workers:
+                    task_queue.put((split, iteration, sent, batches[sent]))
+                    sent += 1
+                batch = self._receive(iteration, batch_idx)
+                yield pin(batch) if self.pin_memory else batch
+        finally:
+            self.active.discard(iteration)
+            for key in [key for key in self.buffer if key[0] == iteration]:
+                del self.buffer[key]
+
+    def close(self):
+        for _ in self.workers:
+            self.train_queue.put("stop")
+        for worker in self.workers:
+            worker.join(timeout=POLL_INTERVAL)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+
+    def __del__(self):
+        if self.workers:
+            self.close()
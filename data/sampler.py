@@ -0,0 +1,210 @@
+import os
+import math
+from collections import OrderedDict, deque
+import numpy as np
+import torch
+from torch.utils import data
+from .transforms import collate_clips
+
+
+class VideoGroupBatchSampler(data.Sampler):
+    """
+    shuffle at the granularity of groups of at most group_size temporally consecutive clips of the same video
+    a group is kept together in a batch, so the worker loading the batch decodes the clips of a video in order
+    """
+
+    def __init__(self, clip_video, batch_size, group_size=4, drop_last=False):
+        super(VideoGroupBatchSampler, self).__init__(None)
+        self.clip_video = clip_video
+        self.batch_size = batch_size
+        self.group_size = min(group_size, batch_size)
+        self.drop_last = drop_last
+        self.next_batches = None  # batches of the next epoch, drawn by __len__ or __iter__
+
+    def groups(self):
+        # clips of a video are contiguous and in temporal order in the clip index
+        boundaries = np.flatnonzero(np.diff(self.clip_video)) + 1
+        groups = []
+        for clips in np.split(np.arange(len(self.clip_video)), boundaries):
+            # random phase so that groups differ between epochs
+            phase = np.random.randint(self.group_size) if len(clips) > self.group_size else 0
+            split_points = np.arange(phase or self.group_size, len(clips), self.group_size)
+            groups += [group for group in np.split(clips, split_points) if len(group) > 0]
+        return groups
+
+    def pack(self, groups):
+        """
+        whole groups in shuffled order, a new batch is started when the next group does not fit
+        """
+        batches, batch = [], []
+        for i in torch.randperm(len(groups)).tolist():
+            if len(batch) + len(groups[i]) > self.batch_size:
+                batches.append(batch)
+                batch = []
+            batch += groups[i].tolist()
+        if batch and not (self.drop_last and len(batch) < self.batch_size):
+            batches.append(batch)
+        return batches
+
+    def _draw(self):
+        if self.next_batches is None:
+            self.next_batches = self.pack(self.groups())
+        return self.next_batches
+
+    def __iter__(self):
+        batches = self._draw()
+        self.next_batches = None
+        yield from batches
+
+    def __len__(self):
+        # the packing is random, the batches of the next epoch are drawn to count them
+        return len(self._draw())
+
+
+class _Container:
+    def __init__(self, path, frame_cache):
+        import av
+
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.frames = None  # decoding iterator, None after a seek is needed
+        self.recent = deque(maxlen=frame_cache)  # (pts, rgb frame) of the last decoded frames
+
+    def close(self):
+        self.container.close()
+
+
+class ContainerCache:
+    """
+    per-process LRU of open PyAV containers
+    a clip starting shortly after the previously decoded one continues decoding without reopening and seeking,
+    recently decoded frames are reused by overlapping clips
+    """
+
+    def __init__(self, size=8, frame_cache=8, max_gap=2.0):
+        """
+        :param max_gap: seconds between the last decoded frame and the next clip to decode through instead of seeking
+        """
+        self.size = size
+        self.frame_cache = frame_cache
+        self.max_gap = max_gap
+        self.entries = OrderedDict()
+        self.pid = os.getpid()
+        self.hits = self.misses = 0
+
+    def _get(self, path):
+        if os.getpid() != self.pid:  # forked, containers of the parent are not usable
+            self.entries = OrderedDict()
+            self.pid = os.getpid()
+        if path in self.entries:
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return self.entries[path]
+        self.misses += 1
+        while len(self.entries) >= self.size:
+            self.entries.popitem(last=False)[1].close()
+        entry = self.entries[path] = _Container(path, self.frame_cache)
+        return entry
+
+    def read(self, path, start_pts, end_pts):
+        """
+        :return: (T,H,W,C) uint8 frames with start_pts <= pts <= end_pts
+        """
+        entry = self._get(path)
+        recent = entry.recent
+        last_pts = recent[-1][0] if recent else None
+        sequential = (entry.frames is not None and last_pts is not None and recent[0][0] <= start_pts and
+                      (start_pts - last_pts) * entry.stream.time_base <= self.max_gap)
+        if not sequential:
+            entry.container.seek(start_pts, stream=entry.stream, backward=True, any_frame=False)
+            entry.frames = entry.container.decode(entry.stream)
+            recent.clear()
+            last_pts = None
+
+        clip = [frame for pts, frame in recent if start_pts <= pts <= end_pts]
+        if last_pts is None or last_pts < end_pts:
+            for frame in entry.frames:
+                if frame.pts is None or frame.pts < start_pts or (last_pts is not None and frame.pts <= last_pts):
+                    continue
+                array = frame.to_ndarray(format="rgb24")
+                recent.append((frame.pts, array))
+                if frame.pts > end_pts:
+                    break
+                clip.append(array)
+            else:  # end of stream
+                entry.frames = None
+        if not clip:
+            return torch.zeros(0, entry.stream.height, entry.stream.width, 3, dtype=torch.uint8)
+        return torch.from_numpy(np.stack(clip))
+
+    def close(self):
+        for entry in self.entries.values():
+            entry.close()
+        self.entries = OrderedDict()
+
+
+class IndexedSubset(data.Dataset):
+    """
+    samples start..end of a (video, audio, label) dataset in order, the dataset index replaces the audio
+    """
+
+    def __init__(self, dataset, start=0, end=None):
+        self.dataset = dataset
+        self.start = start
+        self.end = len(dataset) if end is None else end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, idx):
+        video, _, label = self.dataset[self.start + idx]
+        return video, self.start + idx, label
+
+
+def collate_indexed(batch):
+    """
+    :return: [video, (2,B) labels and dataset indices]
+    """
+    video, label = collate_clips(batch)
+    return [video, torch.stack([label, torch.LongTensor([sample[1] for sample in batch])])]
+
+
+def indexed_loader(loader):
+    """
+    the batches of a DataLoader with the (2,B) labels and dataset indices of collate_indexed as target
+    """
+    assert isinstance(loader, data.DataLoader), "the loaders of DATA.SHARED_WORKERS can not be indexed"
+    return data.DataLoader(IndexedSubset(loader.dataset), batch_sampler=loader.batch_sampler,
+                           num_workers=loader.num_workers, persistent_workers=loader.persistent_workers,
+                           pin_memory=loader.pin_memory, collate_fn=collate_indexed)
+
+
+def clip_video_ids(dataset):
+    """
+    video index of each clip of a dataset
+    """
+    if hasattr(dataset, "clip_video"):  # ClipIndexDataset
+        return np.asarray(dataset.clip_video, dtype=np.int64)
+    if hasattr(dataset, "video_clips"):  # torchvision VideoClips based datasets
+        num_clips = [len(clips) for clips in dataset.video_clips.clips]
+        return np.repeat(np.arange(len(num_clips), dtype=np.int64), num_clips)
+    return np.arange(len(dataset), dtype=np.int64)  # one clip per video
+
+
+def build_clip_loader(dataset, batch_size, num_workers, collate_fn, locality=None):
+    """
+    :param locality: (group size, container cache size, frame cache size), needs a ClipIndexDataset
+    """
+    kwargs = {"num_workers": num_workers,
+              "persistent_workers": True if num_workers > 0 else False,
+              "pin_memory": True,
+              "collate_fn": collate_fn}
+    if locality is None:
+        return data.DataLoader(dataset, batch_size, shuffle=True, **kwargs)
+
+    group_size, container_cache, frame_cache = locality
+    assert hasattr(dataset, "clip_video"), "video-locality sampling needs DATA.COMPACT_INDEX"
+    dataset.decoder = ContainerCache(container_cache, frame_cache)
+    return data.DataLoader(dataset, batch_sampler=VideoGroupBatchSampler(dataset.clip_video, batch_size, group_size),
+                           **kwargs)
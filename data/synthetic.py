@@ -0,0 +1,52 @@
+import time
+import torch
+from torch.utils import data
+from .transforms import build_transforms, collate_clips
+from .sampler import build_clip_loader
+
+
+class SyntheticClips(data.Dataset):
+    """
+    uint8 clips drawn from a pool allocated once, to measure the training speed without decoding
+    with transform, raw (T,H,W,C) clips of the pool go through the dataset transforms for each sample,
+    otherwise the pool holds clips already transformed to the model input
+    """
+
+    def __init__(self, num_samples, num_classes, frame_per_clip, size, pool_size=8, decode_ms=0.0,
+                 transform=None, per_sample_transform=False, seed=0):
+        """
+        :param size: (H,W) of the raw frames
+        :param decode_ms: simulated decode latency of each sample
+        """
+        generator = torch.Generator().manual_seed(seed)
+        pool = torch.randint(0, 256, (pool_size, frame_per_clip, *size, 3), dtype=torch.uint8, generator=generator)
+        if transform is not None and not per_sample_transform:
+            pool = [transform(clip) for clip in pool]
+        self.pool = pool
+        self.labels = torch.randint(num_classes, (num_samples,), generator=generator)
+        self.decode_ms = decode_ms
+        self.transform = transform if per_sample_transform else None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        if self.decode_ms > 0:
+            time.sleep(self.decode_ms / 1000)
+        video = self.pool[idx % len(self.pool)]
+        if self.transform is not None:
+            video = self.transform(video)
+        return video, torch.zeros(1, 0), int(self.labels[idx])
+
+
+def build_synthetic_loader(num_samples, num_classes, num_workers,
+                           batch_size=1, frame_per_clip=64, skip=2, size=(224, 224), train=True, dual_rate=None,
+                           raw_size=None, pool_size=8, decode_ms=0.0, transform=False, seed=0):
+    """
+    :param raw_size: size of the raw frames when transform is set, default to size
+    :param transform: apply the dataset transforms to each sample, otherwise only once to the pool
+    """
+    transforms = build_transforms(size, skip, frame_per_clip, train=train and transform, dual_rate=dual_rate)
+    dataset = SyntheticClips(num_samples, num_classes, frame_per_clip, raw_size or size, pool_size=pool_size,
+                             decode_ms=decode_ms, transform=transforms, per_sample_transform=transform, seed=seed)
+    return build_clip_loader(dataset, batch_size, num_workers, collate_clips)
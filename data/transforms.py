@@ -0,0 +1,105 @@
+import einops
+import torch
+from torchvision.transforms import *
+
+
+class SelectFrames:
+    """
+    (T,H,W,C) -> (C,T',H,W), keep the frames in index
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __call__(self, x):
+        return einops.rearrange(x[self.index], "t h w c->c t h w")
+
+
+class SplitPathways:
+    """
+    (C,T,H,W) -> ((C,T_slow,H,W), (C,T_fast,H,W))
+    """
+
+    def __init__(self, slow_index, fast_index):
+        self.slow_index = slow_index
+        self.fast_index = fast_index
+
+    def __call__(self, x):
+        return x[:, self.slow_index], x[:, self.fast_index]
+
+
+def dual_rate_index(frame_per_clip, skip, slow_stride, fast_stride):
+    """
+    frames needed by the slow and fast pathways, strides are relative to the skipped clip
+    :return: index of the decoded frames to keep, position of the slow and fast frames in the kept frames
+    """
+    slow = torch.arange(0, frame_per_clip, skip * slow_stride)
+    fast = torch.arange(0, frame_per_clip, skip * fast_stride)
+    union = torch.unique(torch.cat([slow, fast]))  # sorted
+    slow_pos = torch.searchsorted(union, slow)
+    fast_pos = torch.searchsorted(union, fast)
+    return union, slow_pos, fast_pos
+
+
+def build_transforms(size, skip, frame_per_clip, train=True, dual_rate=None):
+    """
+    :param dual_rate: (slow_stride, fast_stride), output a (slow, fast) pair instead of a single clip,
+        spatial augmentation is shared by both pathways
+    """
+    if dual_rate is None:
+        transforms = [SelectFrames(slice(None, None, skip))]
+    else:
+        index, slow_pos, fast_pos = dual_rate_index(frame_per_clip, skip, *dual_rate)
+        transforms = [SelectFrames(index)]
+
+    if train:
+        transforms += [RandomResizedCrop(size, (0.5, 1))]
+    else:
+        transforms += [Resize(size), CenterCrop(size)]
+
+    if dual_rate is not None:
+        transforms += [SplitPathways(slow_pos, fast_pos)]
+    return Compose(transforms)
+
+
+def build_cache_transforms(size, skip, frame_per_clip, train=True, dual_rate=None, cache_size=None):
+    """
+    build_transforms split around a decoded-clip cache
+    :param cache_size: (H,W) the train clips are resized to before caching, default to size,
+        the random resized crop is taken from the resized clip, so keep it at least the decoded resolution to
+        get the augmentation of build_transforms; eval clips are cached after the center crop
+    :return: deterministic transform whose uint8 output is cached, random augmentation or None, cached clip shape
+    """
+    if dual_rate is None:
+        index = slice(None, None, skip)
+        num_frames = len(range(0, frame_per_clip, skip))
+    else:
+        index, slow_pos, fast_pos = dual_rate_index(frame_per_clip, skip, *dual_rate)
+        num_frames = len(index)
+
+    cached = [SelectFrames(index)]
+    augment = []
+    if train:
+        cache_size = tuple(cache_size or size)
+        cached += [Resize(cache_size)]
+        augment += [RandomResizedCrop(size, (0.5, 1))]
+    else:
+        cache_size = tuple(size)
+        cached += [Resize(size), CenterCrop(size)]
+
+    if dual_rate is not None:
+        augment += [SplitPathways(slow_pos, fast_pos)]
+    return Compose(cached), Compose(augment) if augment else None, (3, num_frames, *cache_size)
+
+
+def collate_clips(batch):
+    """
+    collate (video, audio, label) samples into [video, label], video can be a (slow, fast) pair
+    """
+    video = batch[0][0]
+    if isinstance(video, (tuple, list)):
+        video = tuple(torch.stack([sample[0][i] for sample in batch], dim=0) for i in range(len(video)))
+    else:
+        video = torch.stack([sample[0] for sample in batch], dim=0)
+    label = torch.LongTensor([sample[2] for sample in batch])
+    return [video, label]
@@ -0,0 +1,154 @@
+"""
+standalone batched inference with an artifact written by `run.py export`
+only depends on torch, torchvision and av, not on the training code
+
+    python infer.py log/vivit/preprocess.json video1.mp4 video2.mp4 --output predictions.jsonl
+"""
+import os
+import json
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import av
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torchvision.transforms.functional import resize
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+parser = argparse.ArgumentParser(description="Batched inference")
+
+parser.add_argument("preprocess", type=str, help="preprocess.json written by the export mode")
+parser.add_argument("videos", type=str, nargs="*", help="video files")
+parser.add_argument("--list", type=str, default=None, help="text file with one video path per line")
+parser.add_argument("--output", type=str, default="predictions.jsonl")
+parser.add_argument("--topk", type=int, default=5)
+parser.add_argument("--num-worker", type=int, default=4, help="decoding threads")
+parser.add_argument("--num-thread", type=int, default=0, help="torch cpu threads, 0 to keep the default")
+parser.add_argument("--device", type=str, default="cpu")
+
+
+def decode_clip(path, num_frames):
+    """
+    decode num_frames frames from the middle of the video, the last frame is repeated for short videos
+    :return: (T,H,W,C) uint8 tensor
+    """
+    frames = []
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        start = max(0, (stream.frames - num_frames) // 2)
+        for i, frame in enumerate(container.decode(stream)):
+            if i < start:
+                continue
+            frames.append(frame.to_ndarray(format="rgb24"))
+            if len(frames) == num_frames:
+                break
+    if len(frames) == 0:
+        raise RuntimeError(f"no frame is decoded from {path}")
+    frames += [frames[-1]] * (num_frames - len(frames))
+    return torch.from_numpy(np.stack(frames))
+
+
+def preprocess_clip(clip, cfg):
+    """
+    same as the eval transforms of the data layer
+    """
+    def sample(stride):
+        x = clip[::stride].permute(3, 0, 1, 2)  # (C,T,H,W)
+        return resize(x, cfg["size"]).float() / cfg["scale"]
+
+    if cfg["dual_rate"] is None:
+        return sample(cfg["skip"])
+    slow_stride, fast_stride = cfg["dual_rate"]
+    return sample(cfg["skip"] * slow_stride), sample(cfg["skip"] * fast_stride)
+
+
+def load_clip(path, cfg):
+    try:
+        return path, preprocess_clip(decode_clip(path, cfg["frame_per_clip"]), cfg), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def make_batch(clips, batch_size):
+    # pad to the traced batch size
+    clips = clips + [clips[-1]] * (batch_size - len(clips))
+    if isinstance(clips[0], tuple):
+        return tuple(torch.stack([clip[i] for clip in clips]) for i in range(len(clips[0])))
+    return torch.stack(clips)
+
+
+def to_device(video, device):
+    if isinstance(video, tuple):
+        return tuple(v.to(device) for v in video)
+    return video.to(device)
+
+
+def iter_clips(paths, cfg, num_worker):
+    # decode in a thread pool, at most 2 * num_worker clips are in flight
+    with ThreadPoolExecutor(num_worker) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(load_clip, path, cfg))
+            if len(pending) >= 2 * num_worker:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+@torch.no_grad()
+def predict(model, batch, cfg, topk, device):
+    paths, clips = zip(*batch)
+    output = model(to_device(make_batch(list(clips), cfg["batch_size"]), device))[:len(paths)]
+    prob = F.softmax(output, dim=-1) if cfg["softmax"] else output
+    scores, indices = prob.topk(min(topk, prob.size(-1)), dim=-1)
+    results = []
+    for path, score, index in zip(paths, scores.tolist(), indices.tolist()):
+        results.append({"file": path,
+                        "topk": [{"label": cfg["classes"][i], "index": i, "score": s} for s, i in zip(score, index)]})
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    with open(args.preprocess) as f:
+        cfg = json.load(f)
+    if args.num_thread > 0:
+        torch.set_num_threads(args.num_thread)
+
+    model = torch.jit.load(os.path.join(os.path.dirname(args.preprocess), cfg["model"]), map_location=args.device)
+    model.eval()
+
+    paths = list(args.videos)
+    if args.list is not None:
+        with open(args.list) as f:
+            paths += [line.strip() for line in f if line.strip()]
+    logger.info("%s videos, batch size %s", len(paths), cfg["batch_size"])
+
+    num_done = 0
+    with open(args.output, "w") as f:
+        batch = []
+        for path, clip, error in iter_clips(paths, cfg, args.num_worker):
+            if error is not None:
+                logger.warning("fail to load %s: %s", path, error)
+                f.write(json.dumps({"file": path, "error": error}) + "\n")
+                continue
+            batch.append((path, clip))
+            if len(batch) == cfg["batch_size"]:
+                for result in predict(model, batch, cfg, args.topk, args.device):
+                    f.write(json.dumps(result) + "\n")
+                num_done += len(batch)
+                batch = []
+        if batch:
+            for result in predict(model, batch, cfg, args.topk, args.device):
+                f.write(json.dumps(result) + "\n")
+            num_done += len(batch)
+    logger.info("%s predictions are written to %s", num_done, args.output)
+
+
+if __name__ == '__main__':
+    main()
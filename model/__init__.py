@@ -1,7 +1,23 @@
-from .conv3d import Conv3D
-from .conv2d_lstm import Conv2DLSTM
-from .slowfast import SlowFast
-from .vivit import ViViT
-from .build import build_model
+import importlib
 
-__all__ = ["Conv3D", "Conv2DLSTM", "SlowFast", "ViViT", "build_model"]
+# architectures are imported on first use
+_exports = {
+    "Conv3D": ".conv3d",
+    "Conv2DLSTM": ".conv2d_lstm",
+    "SlowFast": ".slowfast",
+    "ViViT": ".vivit",
+    "StreamingViViT": ".vivit",
+    "EarlyExitLoss": ".vivit",
+    "build_model": ".build",
+    "build_criterion": ".build",
+    "optimize_model": ".build",
+    "optimize_slowfast": ".fuse",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        return getattr(importlib.import_module(_exports[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,17 @@
-from .slowfast import SlowFast
-from .vivit import ViViT
+import torch
 
 
 def build_model(config):
     model_arch = config.MODEL.ARCH
 
+    # only the selected architecture is imported
     if model_arch == "slowfast":
-        model = SlowFast(config.MODEL.NUM_CLASSES)
+        from .slowfast import SlowFast
+        model = SlowFast(config.MODEL.NUM_CLASSES,
+                         slow_stride=config.MODEL.SLOWFAST.SLOW_STRIDE,
+                         fast_stride=config.MODEL.SLOWFAST.FAST_STRIDE)
     elif model_arch == "vivit":
+        from .vivit import ViViT
         model = ViViT(num_classes=config.MODEL.NUM_CLASSES,
                       size=config.MODEL.VIVIT.INPUT_SIZE,
                       frame_per_clip=config.MODEL.VIVIT.FRAME_PER_CLIP,
@@ -18,8 +22,47 @@ def build_model(config):
                       n_layer=config.MODEL.VIVIT.NUM_LAYER,
                       d_model=config.MODEL.VIVIT.D_MODEL,
                       d_feature=config.MODEL.VIVIT.D_FEATURE,
-                      use_checkpoint=config.MODEL.USE_CHECKPOINT)
+                      use_checkpoint=config.MODEL.USE_CHECKPOINT,
+                      exit_layers=config.MODEL.VIVIT.EARLY_EXIT.LAYERS,
+                      exit_threshold=config.MODEL.VIVIT.EARLY_EXIT.THRESHOLD or None,
+                      exit_detach=config.MODEL.VIVIT.EARLY_EXIT.LOSS == "distill")
+    elif model_arch == "conv3d":
+        from .conv3d import Conv3D
+        model = Conv3D(config.MODEL.NUM_CLASSES,
+                       size=config.DATA.IMG_SIZE,
+                       frame_per_clip=config.DATA.FRAME_PER_CLIP // config.DATA.SKIP_FRAME,
+                       hidden=config.MODEL.CONV3D.HIDDEN)
+    elif model_arch == "conv2d_lstm":
+        from .conv2d_lstm import Conv2DLSTM
+        model = Conv2DLSTM(config.MODEL.NUM_CLASSES,
+                           frame_per_clip=config.DATA.FRAME_PER_CLIP // config.DATA.SKIP_FRAME,
+                           seq_len=config.MODEL.CONV2D_LSTM.SEQ_LEN,
+                           pool_size=config.MODEL.CONV2D_LSTM.POOL_SIZE,
+                           hidden=config.MODEL.CONV2D_LSTM.HIDDEN)
     else:
         raise NotImplementedError(f"{model_arch}")
 
     return model
+
+
+def build_criterion(config):
+    criterion = torch.nn.CrossEntropyLoss()
+    if config.MODEL.ARCH == "vivit" and config.MODEL.VIVIT.EARLY_EXIT.LAYERS:
+        from .vivit import EarlyExitLoss
+        criterion = EarlyExitLoss(criterion,
+                                  weight=config.MODEL.VIVIT.EARLY_EXIT.WEIGHT,
+                                  mode=config.MODEL.VIVIT.EARLY_EXIT.LOSS,
+                                  temperature=config.MODEL.VIVIT.EARLY_EXIT.TEMPERATURE)
+    return criterion
+
+
+def optimize_model(model, config):
+    """
+    inference-only rewrites selected in the config, apply after loading the weights
+    """
+    if config.MODEL.ARCH == "slowfast" and (config.MODEL.SLOWFAST.FUSE_CONV_BN or config.MODEL.SLOWFAST.CHANNELS_LAST):
+        from .fuse import optimize_slowfast
+        model = optimize_slowfast(model,
+                                  fuse=config.MODEL.SLOWFAST.FUSE_CONV_BN,
+                                  channels_last=config.MODEL.SLOWFAST.CHANNELS_LAST)
+    return model
@@ -4,11 +4,16 @@ import torch.nn as nn
 
 class Conv2DLSTM(nn.Module):
 
-    def __init__(self):
+    def __init__(self, num_classes=51, frame_per_clip=32, seq_len=32, pool_size=(10, 10), hidden=128):
+        """
+        frames are stacked as channels of 2D convs, the seq_len output channels are the steps of the LSTM
+        :param pool_size: feature maps are average pooled to this size, (10, 10) is the native size at 112x112
+        """
         super(Conv2DLSTM, self).__init__()
+        self.seq_len = seq_len
 
         self.feature_extractor = nn.Sequential(
-            nn.Conv2d(96, 128, (3, 3)),
+            nn.Conv2d(3 * frame_per_clip, 128, (3, 3)),
             nn.BatchNorm2d(128),
             nn.ReLU(),
             nn.Conv2d(128, 128, (3, 3)),
@@ -29,13 +34,15 @@ class Conv2DLSTM(nn.Module):
             nn.BatchNorm2d(512),
             nn.ReLU(),
             nn.AvgPool2d(2),
-            nn.Conv2d(512, 32, (1, 1)),
-            nn.BatchNorm2d(32),
-            nn.ReLU()
+            nn.Conv2d(512, seq_len, (1, 1)),
+            nn.BatchNorm2d(seq_len),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d(pool_size)
         )
 
-        self.rnn = nn.LSTM(10 * 10, 128//2, bidirectional=True, batch_first=True)
-        self.mlp = nn.Sequential(nn.Linear(128, 51), nn.Softmax())
+        self.rnn = nn.LSTM(pool_size[0] * pool_size[1], hidden // 2, bidirectional=True, batch_first=True)
+        # logits, as the other architectures in training
+        self.mlp = nn.Sequential(nn.Linear(hidden, num_classes))
 
     def forward(self, x):
         # (B,C,N,H,W) -> (B,N,C,H,W)
@@ -43,7 +50,7 @@ class Conv2DLSTM(nn.Module):
         x = x.permute(0, 2, 1, 3, 4).reshape(b, -1, h, w)
 
         x = self.feature_extractor(x)
-        x = x.reshape(b, n, -1)
+        x = x.reshape(b, self.seq_len, -1)
         x, (hidden, cell) = self.rnn(x)
         x = self.mlp(x[:, -1, :])
         return x
@@ -1,11 +1,17 @@
-import torch.autograd
 import torch.nn as nn
 
 
+def _feature_length(length):
+    # two valid 3x3x3 convs and a 3x average pooling, twice
+    return ((length - 4) // 3 - 4) // 3
+
+
 class Conv3D(nn.Module):
 
-    def __init__(self):
+    def __init__(self, num_classes=51, size=(224, 224), frame_per_clip=32, hidden=100):
         super(Conv3D, self).__init__()
+        feature_dim = 16 * _feature_length(frame_per_clip) * _feature_length(size[0]) * _feature_length(size[1])
+        assert feature_dim > 0, f"input {frame_per_clip}x{size} is too small"
 
         self.net = nn.Sequential(
             nn.Conv3d(3, 8, (3, 3, 3)),
@@ -23,11 +29,10 @@ class Conv3D(nn.Module):
             nn.ReLU(),
             nn.AvgPool3d(3),
             nn.Flatten(),
-            nn.LazyLinear(100),
+            nn.Linear(feature_dim, hidden),
             nn.ReLU(),
-            nn.Linear(100, 51),
+            nn.Linear(hidden, num_classes),
         )
 
     def forward(self, x):
-        torch.autograd.set_detect_anomaly(True)
         return self.net(x)
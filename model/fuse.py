@@ -0,0 +1,104 @@
+import copy
+import torch
+import torch.nn as nn
+from .slowfast import SlowFast, ResBlock3d
+
+
+class TemporalSample(nn.Module):
+    """
+    temporal striding plus a per-channel offset, replaces a 1x1x1 stride conv folded into its successor
+    """
+
+    def __init__(self, stride, offset):
+        super(TemporalSample, self).__init__()
+        self.stride = stride
+        self.register_buffer("offset", offset.view(1, -1, 1, 1, 1))
+
+    def forward(self, x):
+        return x[:, :, ::self.stride] + self.offset
+
+
+@torch.no_grad()
+def fuse_conv_bn(conv: nn.Conv3d, bn: nn.BatchNorm3d) -> nn.Conv3d:
+    fused = nn.Conv3d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                      stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                      groups=conv.groups, bias=True, padding_mode=conv.padding_mode,
+                      device=conv.weight.device, dtype=conv.weight.dtype)
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    if bn.weight is not None:
+        scale = scale * bn.weight
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    shift = bn.bias if bn.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1, 1))
+    fused.bias.copy_((bias - bn.running_mean) * scale + shift)
+    return fused
+
+
+@torch.no_grad()
+def merge_sample_conv(sample: nn.Conv3d, conv: nn.Conv3d, max_cond=1e4):
+    """
+    merge a 1x1x1 temporal stride conv into the following conv
+    conv(pad(A x + b)) == conv'(pad(x + A^-1 b)) with conv' = conv * A, so the merge is exact when A is invertible
+    :return: (TemporalSample, merged conv), or None if the two convs can not be merged
+    """
+    if sample.kernel_size != (1, 1, 1) or sample.stride[1:] != (1, 1) or sample.groups != 1 or conv.groups != 1:
+        return None
+    a = sample.weight.flatten(1)  # (c_mid, c_in)
+    if a.size(0) != a.size(1) or torch.linalg.cond(a) > max_cond:
+        return None
+    bias = sample.bias if sample.bias is not None else torch.zeros_like(sample.weight[:, 0, 0, 0, 0])
+    offset = torch.linalg.solve(a, bias)
+
+    merged = nn.Conv3d(a.size(1), conv.out_channels, conv.kernel_size,
+                       stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                       bias=conv.bias is not None, padding_mode=conv.padding_mode,
+                       device=conv.weight.device, dtype=conv.weight.dtype)
+    merged.weight.copy_(torch.einsum("omthw,mi->oithw", conv.weight, a))
+    if conv.bias is not None:
+        merged.bias.copy_(conv.bias)
+    return TemporalSample(sample.stride[0], offset), merged
+
+
+def _fuse_res_block(block: ResBlock3d):
+    block.conv1 = fuse_conv_bn(block.conv1, block.bn1)
+    block.conv2 = fuse_conv_bn(block.conv2, block.bn2)
+    block.conv3 = fuse_conv_bn(block.conv3, block.bn3)
+    block.bn1 = block.bn2 = block.bn3 = nn.Identity()
+    block.bottle = nn.Sequential(
+        block.conv1, block.relu,
+        block.conv2, block.relu,
+        block.conv3
+    )
+    if block.shortcut is not None:
+        block.shortcut = fuse_conv_bn(block.shortcut, block.bns)
+        block.bns = nn.Identity()
+
+
+def _merge_stem(stem: nn.Sequential):
+    merged = merge_sample_conv(stem[0], stem[1])
+    if merged is None:
+        return stem
+    return nn.Sequential(*merged, *stem[2:])
+
+
+def optimize_slowfast(model: SlowFast, fuse=True, channels_last=True, inplace=False) -> SlowFast:
+    """
+    inference-only rewrite of SlowFast, apply after loading the weights
+    :param fuse: fold BatchNorm into the preceding convs and merge the stride-sampling convs of the stems
+    :param channels_last: convert the weights to channels_last_3d
+    """
+    if not inplace:
+        model = copy.deepcopy(model)
+    model.eval()
+
+    if fuse:
+        for module in model.modules():
+            if isinstance(module, ResBlock3d):
+                _fuse_res_block(module)
+        model.slow_data = _merge_stem(model.slow_data)
+        model.fast_data = _merge_stem(model.fast_data)
+
+    if channels_last:
+        model.memory_format = torch.channels_last_3d
+        model.to(memory_format=torch.channels_last_3d)
+    return model
@@ -0,0 +1,74 @@
+import copy
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from .vivit import ViViT
+from .slowfast import SlowFast
+
+
+class DualRateInput(nn.Module):
+    """
+    expose the (slow, fast) pair input of SlowFast as two arguments, for tracing
+    """
+
+    def __init__(self, model):
+        super(DualRateInput, self).__init__()
+        self.model = model
+
+    def forward(self, slow, fast):
+        return self.model((slow, fast))
+
+
+def as_inputs(video):
+    # positional inputs of a (possibly wrapped) model
+    return tuple(video) if isinstance(video, (tuple, list)) else (video,)
+
+
+def quantize_vivit(model: ViViT) -> nn.Module:
+    """
+    dynamic int8 quantization of every Linear layer
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    model.use_checkpoint = False
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_slowfast(model: SlowFast, calibration_data, backend="fbgemm") -> nn.Module:
+    """
+    static int8 quantization (fx graph mode), Conv3d+BatchNorm3d(+ReLU) are fused before observing
+    :param calibration_data: iterable of cpu inputs of the model, a clip or a (slow, fast) pair
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    calibration_data = iter(calibration_data)
+    video = next(calibration_data)
+    if isinstance(video, (tuple, list)):
+        model = DualRateInput(model)
+
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs=as_inputs(video))
+    prepared(*as_inputs(video))
+    for video in calibration_data:
+        prepared(*as_inputs(video))
+    return convert_fx(prepared)
+
+
+def quantize_model(model, calibration_data=None, backend="fbgemm"):
+    if isinstance(model, ViViT):
+        return quantize_vivit(model)
+    elif isinstance(model, SlowFast):
+        assert calibration_data is not None, "static quantization needs calibration data"
+        return quantize_slowfast(model, calibration_data, backend=backend)
+    else:
+        raise NotImplementedError(f"quantization of {type(model).__name__}")
+
+
+@torch.no_grad()
+def save_quantized(model, example, path):
+    """
+    save a quantized model as a TorchScript artifact
+    """
+    traced = torch.jit.trace(model, as_inputs(example), check_trace=False)
+    torch.jit.save(traced, path)
+    return path
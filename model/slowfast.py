@@ -53,13 +53,14 @@ class ResBlock3d(nn.Module):
 
 class SlowFast(nn.Module):
 
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, slow_stride=16, fast_stride=2):
         super(SlowFast, self).__init__()
+        assert slow_stride % fast_stride == 0
         self.dropout = nn.Dropout3d()
-        self.slow_data = nn.Sequential(nn.Conv3d(3, 3, (1, 1, 1), stride=(16, 1, 1)),
+        self.slow_data = nn.Sequential(nn.Conv3d(3, 3, (1, 1, 1), stride=(slow_stride, 1, 1)),
                                        nn.Conv3d(3, 64, (1, 7, 7), stride=(1, 1, 1), padding=(0, 3, 3)),
                                        nn.MaxPool3d((1, 3, 3), (1, 2, 2), padding=(0, 1, 1)))
-        self.fast_data = nn.Sequential(nn.Conv3d(3, 3, (1, 1, 1), stride=(2, 1, 1)),
+        self.fast_data = nn.Sequential(nn.Conv3d(3, 3, (1, 1, 1), stride=(fast_stride, 1, 1)),
                                        nn.Conv3d(3, 8, (5, 7, 7), stride=(1, 1, 1), padding=(2, 3, 3)),
                                        nn.MaxPool3d((1, 3, 3), (1, 2, 2), padding=(0, 1, 1)))
         self.slow_res = [{
@@ -99,9 +100,12 @@ class SlowFast(nn.Module):
 
         self.relu = nn.ReLU()
         self.fast_pathway_stages = self.make_fast_pathway(8, self.fast_res)
-        self.lateral_conv, self.slow_pathway_stages = self.make_slow_pathway(64, self.fast_res, self.slow_res)
+        self.lateral_conv, self.slow_pathway_stages = self.make_slow_pathway(64, self.fast_res, self.slow_res,
+                                                                             alpha=slow_stride // fast_stride)
         self.flat = nn.Flatten()
         self.fc = nn.Linear(self.slow_res[-1]["channel"][-1] + self.fast_res[-1]["channel"][-1], num_classes)
+        # set to torch.channels_last_3d by model.fuse.optimize_slowfast
+        self.memory_format = torch.contiguous_format
 
     @staticmethod
     def make_layer(c_in, cfg):
@@ -125,7 +129,7 @@ class SlowFast(nn.Module):
         return torch.nn.ModuleList(stage)
 
     @staticmethod
-    def make_slow_pathway(c_in, fast_cfg, slow_cfg):
+    def make_slow_pathway(c_in, fast_cfg, slow_cfg, alpha=8):
         lateral_conv = []
         stage = []
 
@@ -135,16 +139,38 @@ class SlowFast(nn.Module):
         c_slow_in = [c_in, ] + [seq_in + lateral_in for seq_in, lateral_in in zip(c_slow_in, c_lateral_out)]
 
         for c_in, c_out in zip(c_lateral_in, c_lateral_out):
-            lateral_conv.append(nn.Conv3d(c_in, c_out, (5, 1, 1), stride=(8, 1, 1), padding=(2, 0, 0)))
+            lateral_conv.append(nn.Conv3d(c_in, c_out, (5, 1, 1), stride=(alpha, 1, 1), padding=(2, 0, 0)))
 
         for c, stage_cfg in zip(c_slow_in, slow_cfg):
             stage.append(SlowFast.make_layer(c, stage_cfg))
         return nn.ModuleList(lateral_conv), nn.ModuleList(stage)
 
-    def forward(self, x):
-        # (B,C,N,H,W)
-        slow = self.slow_data(x)
-        fast = self.fast_data(x)
+    def stem(self, stem, x, presampled=False):
+        x = x.contiguous(memory_format=self.memory_format)
+        if not presampled:
+            return stem(x)
+        # the input is already strided in time, only apply the channel mixing of the sampling layer
+        sample = stem[0]
+        if isinstance(sample, nn.Conv3d):
+            x = F.conv3d(x, sample.weight, sample.bias)
+        else:  # folded by model.fuse
+            x = x + sample.offset
+        for layer in list(stem)[1:]:
+            x = layer(x)
+        return x
+
+    def forward_features(self, x):
+        """
+        :return: (B,C_slow+C_fast) concatenated pooled slow and fast features, the input of fc
+        """
+        if isinstance(x, (tuple, list)):
+            # (B,C,N_slow,H,W), (B,C,N_fast,H,W) sampled by the data layer
+            slow = self.stem(self.slow_data, x[0], presampled=True)
+            fast = self.stem(self.fast_data, x[1], presampled=True)
+        else:
+            # (B,C,N,H,W)
+            slow = self.stem(self.slow_data, x)
+            fast = self.stem(self.fast_data, x)
 
         fast_stage = []
         for stage in self.fast_pathway_stages:
@@ -157,9 +183,12 @@ class SlowFast(nn.Module):
                 fast_lateral = self.lateral_conv[i](fast_lateral)
                 slow = torch.cat([slow, fast_lateral], dim=1)
 
-        slow = self.flat(F.avg_pool3d(slow, slow.shape[-3:]))  # global average pooling
-        fast = self.flat(F.avg_pool3d(fast, fast.shape[-3:]))
-        x = torch.cat((slow, fast), -1)
+        slow = self.flat(F.adaptive_avg_pool3d(slow, 1))  # global average pooling
+        fast = self.flat(F.adaptive_avg_pool3d(fast, 1))
+        return torch.cat((slow, fast), -1)
+
+    def forward(self, x):
+        x = self.forward_features(x)
         x = self.dropout(x)
         x = self.fc(x)
 
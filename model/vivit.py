@@ -5,11 +5,26 @@ import torch.nn.functional as F
 from torch.utils import checkpoint
 
 
+def resample_positional_embedding(pe, grid):
+    """
+    trilinear interpolation of a (1,n_t,n_h,n_w,d_model) positional embedding to another token grid
+    """
+    pe = einops.rearrange(pe, "b n_t n_h n_w d -> b d n_t n_h n_w")
+    pe = F.interpolate(pe, size=tuple(grid), mode="trilinear", align_corners=False)
+    return einops.rearrange(pe, "b d n_t n_h n_w -> b n_t n_h n_w d")
+
+
 class ViViT(nn.Module):
     def __init__(self, num_classes,
                  size=(224, 224), frame_per_clip=32,
                  t=2, h=16, w=16, n_head=12, n_layer=12, d_model=512, d_feature=2048,
-                 use_checkpoint=False):
+                 use_checkpoint=False, exit_layers=(), exit_threshold=None, exit_detach=False):
+        """
+        :param exit_layers: number of encoder layers after which an intermediate classifier head is attached
+        :param exit_threshold: at inference, a sample exits at the first head whose softmax confidence reaches it,
+            None to always run all layers
+        :param exit_detach: the exit heads do not back-propagate into the encoder during training
+        """
         super(ViViT, self).__init__()
 
         # size of tubelets
@@ -39,17 +54,107 @@ class ViViT(nn.Module):
             nn.Linear(d_model, num_classes)
         )
 
+        # early exit
+        assert all(0 < layer < n_layer for layer in exit_layers), "exit layers must be before the last layer"
+        self.exit_layers = sorted(set(exit_layers))
+        self.exit_heads = nn.ModuleDict({str(layer): nn.Sequential(nn.LayerNorm(d_model),
+                                                                   nn.Linear(d_model, num_classes))
+                                         for layer in self.exit_layers})
+        self.exit_threshold = exit_threshold
+        self.exit_detach = exit_detach
+
+    def tubelets(self, x):
+        # (B,C,N,H,W) -> (B,n_t,n_h,n_w,t*h*w*C)
+        return einops.rearrange(x, "b c (n_t t) (n_h h) (n_w w) -> b n_t n_h n_w (t h w c)",
+                                t=self.t, h=self.h, w=self.w)
+
+    def grid_positional_embedding(self, grid):
+        # positional embedding of a n_t*n_h*n_w token grid, resampled if the input shape differs from the model's
+        if tuple(grid) == tuple(self.positional_embedding.shape[1:4]):
+            return self.positional_embedding
+        return resample_positional_embedding(self.positional_embedding, grid)
+
+    def adapt_state_dict(self, state_dict):
+        """
+        resample the positional embedding of a checkpoint trained with another clip length or resolution
+        """
+        pe = state_dict.get("positional_embedding")
+        target = self.positional_embedding
+        if pe is not None and pe.shape != target.shape and pe.size(-1) == target.size(-1):
+            state_dict["positional_embedding"] = resample_positional_embedding(pe, target.shape[1:4])
+        return state_dict
+
+    def classify(self, token):
+        # (B,n_t,n_h,n_w,d_model) encoded tokens -> (B,num_classes)
+        return self.mlp_head(torch.mean(token, dim=(1, 2, 3)))
+
+    def forward_features(self, x):
+        # x: (B,C,N,H,W) -> (B,d_model) pooled token, the input of mlp_head
+        token = self.embed_projection(self.tubelets(x))
+        token = token + self.grid_positional_embedding(token.shape[1:4])
+        token = self.encoder_layer(token)
+        return torch.mean(token, dim=(1, 2, 3))
+
+    def forward_early_exit(self, x, detach_exit=False):
+        """
+        :param detach_exit: the exit heads do not back-propagate into the encoder
+        :return: [logits of each exit head..., logits of mlp_head]
+        """
+        token = self.embed_projection(self.tubelets(x))
+        token = token + self.grid_positional_embedding(token.shape[1:4])
+        outputs = []
+        for i, layer in enumerate(self.encoder_layer):
+            token = checkpoint.checkpoint(layer, token) if self.use_checkpoint and self.training else layer(token)
+            if str(i + 1) in self.exit_heads:
+                pooled = torch.mean(token, dim=(1, 2, 3))
+                outputs.append(self.exit_heads[str(i + 1)](pooled.detach() if detach_exit else pooled))
+        outputs.append(self.classify(token))
+        return outputs
+
+    @torch.no_grad()
+    def forward_adaptive(self, x, threshold):
+        """
+        batched early-exit inference, samples leave the batch at the first head with confidence >= threshold
+        :return: (B,num_classes) logits, (B,) number of encoder layers run for each sample
+        """
+        token = self.embed_projection(self.tubelets(x))
+        token = token + self.grid_positional_embedding(token.shape[1:4])
+        active = torch.arange(token.size(0), device=token.device)  # batch index of the remaining samples
+        logits, depth = None, torch.full((token.size(0),), self.n_layer, dtype=torch.long, device=token.device)
+        for i, layer in enumerate(self.encoder_layer):
+            token = layer(token)
+            if str(i + 1) not in self.exit_heads:
+                continue
+            exit_logits = self.exit_heads[str(i + 1)](torch.mean(token, dim=(1, 2, 3)))
+            if logits is None:
+                logits = exit_logits.new_zeros(x.size(0), exit_logits.size(1))
+            done = F.softmax(exit_logits.float(), dim=-1).max(dim=-1)[0] >= threshold
+            logits[active[done]] = exit_logits[done]
+            depth[active[done]] = i + 1
+            active, token = active[~done], token[~done]
+            if active.numel() == 0:
+                return logits, depth
+        final = self.classify(token)
+        if logits is None:
+            return final, depth
+        logits[active] = final
+        return logits, depth
+
     def forward(self, x):
         # x: (B,C,N,H,W)
-        x = einops.rearrange(x, "b c (n_t t) (n_h h) (n_w w) -> b n_t n_h n_w (t h w c)",
-                             t=self.t, h=self.h, w=self.w)
+        if self.exit_heads:
+            if self.training:  # all exits, for EarlyExitLoss
+                return self.forward_early_exit(x, detach_exit=self.exit_detach)
+            if self.exit_threshold is not None:
+                return self.forward_adaptive(x, self.exit_threshold)[0]
+        x = self.tubelets(x)
         if self.use_checkpoint:
             token = checkpoint.checkpoint(self.embed_projection, x)
-            token = token + self.positional_embedding
+            token = token + self.grid_positional_embedding(token.shape[1:4])
             token = checkpoint.checkpoint_sequential(self.encoder_layer, self.n_layer, token)
         else:
             token = self.embed_projection(x)
-            token = token + self.positional_embedding
+            token = token + self.grid_positional_embedding(token.shape[1:4])
             token = self.encoder_layer(token)
         # mlp head
         token = einops.rearrange(token, "n n_t n_h n_w d_model->n (n_t n_h n_w) d_model")
@@ -62,25 +167,116 @@ class ViViT(nn.Module):
 
     @torch.no_grad()
     def heatmap(self, x):
-        x = einops.rearrange(x, "b c (n_t t) (n_h h) (n_w w) -> b n_t n_h n_w (t h w c)",
-                             t=self.t, h=self.h, w=self.w)
-        token = self.embed_projection(x)
-        token = token + self.positional_embedding
-        cam = token = self.encoder_layer(token)
+        """
+        class activation mapping of the predicted class
+        :param x: (B,C,N,H,W)
+        :return: (B,N,H,W) activation maps on the input device, (B,) predicted classes
+        """
+        token = self.embed_projection(self.tubelets(x))
+        token = token + self.grid_positional_embedding(token.shape[1:4])
+        cam = self.encoder_layer(token)
 
-        token = einops.rearrange(token, "n n_t n_h n_w d_model->n (n_t n_h n_w) d_model")
-        token = torch.mean(token, dim=1)
-        logits = self.mlp_head(token)
+        logits = self.classify(cam)
         index = torch.argmax(logits, dim=-1)
 
-        # class activation mapping
-        cam = self.mlp_head(cam)
-        cam = torch.stack([cam_i[:, :, :, cls] for cam_i, cls in zip(cam, index)])
+        # class activation mapping, only the weight of the predicted class is applied to each token
+        layer_norm, fc = self.mlp_head
+        cam = torch.einsum("bthwd,bd->bthw", layer_norm(cam), fc.weight[index]) + fc.bias[index].view(-1, 1, 1, 1)
+
+        # upsample tubelets to the input resolution
+        cam = F.interpolate(cam.unsqueeze(1), scale_factor=(self.t, self.h, self.w), mode="nearest").squeeze(1)
+        return cam, index
+
+
+class EarlyExitLoss(nn.Module):
+    """
+    loss of the outputs of ViViT.forward_early_exit
+    joint: criterion on the final head + weight * criterion on each exit head
+    distill: criterion on the final head + weight * KL divergence from the (detached) final head to each exit head
+    """
+
+    def __init__(self, criterion, weight=0.3, mode="joint", temperature=1.0):
+        super(EarlyExitLoss, self).__init__()
+        assert mode in ("joint", "distill"), f"early exit loss {mode}"
+        self.criterion = criterion
+        self.weight = weight
+        self.mode = mode
+        self.temperature = temperature
+
+    def forward(self, outputs, target):
+        if not isinstance(outputs, (tuple, list)):
+            return self.criterion(outputs, target)
+        *exits, final = outputs
+        loss = self.criterion(final, target)
+        for logits in exits:
+            if self.mode == "joint":
+                loss = loss + self.weight * self.criterion(logits, target)
+            else:
+                t = self.temperature
+                teacher = F.softmax(final.detach() / t, dim=-1)
+                loss = loss + self.weight * t * t * F.kl_div(F.log_softmax(logits / t, dim=-1), teacher,
+                                                             reduction="batchmean")
+        return loss
+
+
+class StreamingViViT:
+    """
+    sliding-window inference over a stream of frames
+    embedded tubelets are kept in a ring buffer of one window, so each new window only embeds the new time slices,
+    the encoder still runs over the whole window
+    """
+
+    def __init__(self, model: ViViT, stride):
+        """
+        :param stride: window stride in frames, a multiple of the tubelet length
+        """
+        assert stride % model.t == 0 and 0 < stride <= model.n_t * model.t, "invalid stride"
+        self.model = model
+        self.stride = stride // model.t  # in tubelets
+        self.reset()
+
+    def reset(self):
+        self.pending = None  # (B,C,<t,H,W) frames not yet forming a tubelet
+        self.ring = None  # (B,n_t,n_h,n_w,d_model)
+        self.head = 0  # ring slot of the oldest tubelet
+        self.num_tubelet = 0
+
+    @property
+    def num_frame(self):
+        return self.num_tubelet * self.model.t + (self.pending.size(2) if self.pending is not None else 0)
+
+    @torch.no_grad()
+    def window(self):
+        # oldest tubelet first
+        order = (torch.arange(self.model.n_t, device=self.ring.device) + self.head) % self.model.n_t
+        token = self.ring[:, order] + self.model.positional_embedding
+        return self.model.classify(self.model.encoder_layer(token))
+
+    @torch.no_grad()
+    def push(self, frames):
+        """
+        :param frames: (B,C,N,H,W) next frames of the stream (already frame-skipped and scaled), any N
+        :return: list of (end frame, logits) of the windows completed by these frames
+        """
+        if self.pending is not None:
+            frames = torch.cat([self.pending, frames], dim=2)
+        n = frames.size(2) // self.model.t * self.model.t
+        self.pending = frames[:, :, n:] if n < frames.size(2) else None
+        if n == 0:
+            return []
 
-        cam = einops.repeat(cam, "n n_t n_h n_w->n (n_t t) (n_h h) (n_w w)",
-                            t=self.t, h=self.h, w=self.w).detach().cpu().numpy()
+        token = self.model.embed_projection(self.model.tubelets(frames[:, :, :n]))
+        if self.ring is None:
+            self.ring = token.new_zeros(token.size(0), self.model.n_t, *token.shape[2:])
 
-        return cam
+        outputs = []
+        for i in range(token.size(1)):
+            self.ring[:, self.head] = token[:, i]
+            self.head = (self.head + 1) % self.model.n_t
+            self.num_tubelet += 1
+            if self.num_tubelet >= self.model.n_t and (self.num_tubelet - self.model.n_t) % self.stride == 0:
+                outputs.append((self.num_tubelet * self.model.t, self.window()))
+        return outputs
 
 
 class FactorisedTransformerLayer(nn.Module):
@@ -1,31 +1,34 @@
-import os
+import time
+
+# measure startup from before the heavy imports
+start_time = time.perf_counter()
 
-import einops
-import numpy as np
+import os
+import json
 import torch
 import argparse
-import tqdm
 import logging
 from config import get_config, default_cfg
 from collections import OrderedDict
 from datetime import datetime
-from data import build_loader
-from model import build_model
+from model import build_model, build_criterion, optimize_model
 from torch.utils import data
-from torchsummary import summary
 from utils.train_utils import *
-from torch.utils.tensorboard import SummaryWriter
+from utils.optim import build_optimizer
+from utils.profiling import build_profiler, StageTimer, DataWaitMeter, profiler_context, profiler_step
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 parser = argparse.ArgumentParser(description="Performance test")
 
-parser.add_argument("mode", type=str, choices=["train", "eval", "summary", "fine-tune", "heatmap"])
+parser.add_argument("mode", type=str, choices=["train", "eval", "summary", "fine-tune", "heatmap", "quantize",
+                                                  "export", "probe", "profile", "extract", "early-exit",
+                                                  "distill", "sweep"])
 parser.add_argument("config", type=str, help="config file", default=None)
 dataset_parser = parser.add_subparsers(title="dataset",
                                        dest="dataset",
                                        metavar="dataset",
-                                       help="chose a dataset to load {hmdb51,kinetics}", )
+                                       help="chose a dataset to load {hmdb51,kinetics,synthetic}", )
 hmdb_parser = dataset_parser.add_parser("hmdb51")
 hmdb_parser.set_defaults(dataset="hmdb51")
 hmdb_parser.add_argument("--video", type=str, help="hmdb51 video file", required=True)
@@ -33,6 +36,10 @@ hmdb_parser.add_argument("--annotation", type=str, help="hmdb51 split file", req
 kinetics_parser = dataset_parser.add_parser("kinetics")
 kinetics_parser.set_defaults(dataset="kinetics")
 kinetics_parser.add_argument("--video", type=str, help="kinetics dataset video folder", required=True)
+synthetic_parser = dataset_parser.add_parser("synthetic")
+synthetic_parser.set_defaults(dataset="synthetic")
+synthetic_parser.add_argument("--num-sample", type=int, help="clips per split", default=None)
+synthetic_parser.add_argument("--decode-ms", type=float, help="simulated decode latency per clip", default=None)
 
 
 def main():
@@ -42,6 +49,10 @@ def main():
     log_dir = os.path.join(config.LOG.LOG_DIR, config.EXPERIMENT_NAME)
     if config.MODE == "fine-tune":
         ckpt_folder_prefix = "fine-tune_"
+    elif config.MODE == "probe":
+        ckpt_folder_prefix = "probe_"
+    elif config.MODE == "distill":
+        ckpt_folder_prefix = "distill_"
     else:
         ckpt_folder_prefix = ""
     ckpt_folder = os.path.join(log_dir, f"{ckpt_folder_prefix}checkpoint")
@@ -49,13 +60,24 @@ def main():
     os.makedirs(log_dir, exist_ok=True)
     logger.info("log dir: %s", log_dir)
 
+    # mode-specific dependencies are imported where they are used
+    if config.MODE == "sweep":  # the models are built in the trial processes
+        from data import build_loader
+        from utils.sweep import sweep
+        sweep(lambda split: build_loader(config, splits=(split,))[("train", "val", "test").index(split)],
+              os.path.join(log_dir, "sweep"), config)
+        return
+
     # net
     logger.info(f"building model ({config.MODEL.ARCH})...")
     net = build_model(config)
-    net.cuda()
-    criterion = torch.nn.CrossEntropyLoss()
+    if config.MODE not in ("quantize", "export", "profile"):  # run on cpu
+        net.cuda()
+    criterion = build_criterion(config)
 
     if config.MODE == "summary":
+        from torchsummary import summary
+        from torch.utils.tensorboard import SummaryWriter
         writer = SummaryWriter(log_dir=log_dir)
         summary(
             model=net,
@@ -70,10 +92,12 @@ def main():
             net=net,
             summary_writer=writer
         )
-
+    elif config.MODE == "profile":
+        writer = None
+        profile(log_dir, config)
     else:
         # optimizer
-        optimizer = torch.optim.Adam(net.parameters(), lr=config.TRAIN.LR_BASE)
+        optimizer = build_optimizer(net, config)
         scheduler = torch.optim.lr_scheduler.StepLR(optimizer,
                                                     step_size=config.TRAIN.LR_SCHEDULER.DECAY_EPOCH,
                                                     gamma=config.TRAIN.LR_SCHEDULER.DECAY_RATE)
@@ -96,30 +120,68 @@ def main():
         # resume
         if config.MODEL.RESUME:
             logger.info(f"resume from given checkpoint: {config.MODEL.RESUME}")
-            epoch_start = load_checkpoint(ckpt_file=config.MODEL.RESUME,
-                                          model=net,
-                                          optimizer=optimizer,
-                                          scheduler=scheduler,
-                                          restart_train=restart_train)
+            epoch_start, global_step = load_checkpoint(ckpt_file=config.MODEL.RESUME,
+                                                       model=net,
+                                                       optimizer=optimizer,
+                                                       scheduler=scheduler,
+                                                       restart_train=restart_train,
+                                                       with_step=True)
         else:
-            epoch_start = 0  # train from scratch
+            epoch_start = global_step = 0  # train from scratch
 
-        # load train, eval and test data
-        logger.info(f"creating data loader ({config.DATA.DATASET})...")
-        dataloader_train, dataloader_val, dataloader_test = build_loader(config)
+        if config.MODE == "export":
+            export(net, log_dir, config)
+            return
+
+        # load the data splits used by this mode
+        from data import build_loader
+        splits = mode_splits(config)
+        logger.info(f"creating data loader ({config.DATA.DATASET}: {', '.join(splits) or 'none'})...")
+        dataloader_train, dataloader_val, dataloader_test = build_loader(config, splits=splits)
+        if global_step is None:  # checkpoint without a recorded step
+            global_step = epoch_start * len(dataloader_train) if dataloader_train is not None else 0
         # create tensorboard summary writer
-        writer = SummaryWriter(log_dir=log_dir, purge_step=epoch_start * len(dataloader_train))
+        from torch.utils.tensorboard import SummaryWriter
+        writer = SummaryWriter(log_dir=log_dir, purge_step=global_step if epoch_start > 0 else None)
 
-        if config.MODE == "train" or config.MODE == "fine-tune":
+        if config.MODE in ("train", "fine-tune", "distill"):
             logger.info("Training...")
+            # the student is trained on soft targets of a teacher in the distill mode, the targets are indexed
+            distill = config.MODE == "distill"
+            train_net, train_criterion, train_metric = net, criterion, accuracy_metric
+            if distill:
+                from data.sampler import indexed_loader
+                from utils.distill import indexed_accuracy
+                teacher, train_net, train_criterion = distill_setup(net, dataloader_train, log_dir, config)
+                train_metric = indexed_accuracy
+                if dataloader_train is not None:
+                    dataloader_train = indexed_loader(dataloader_train)
+            schedule = train_shape = None
+            if config.TRAIN.MULTIGRID.LONG_CYCLE or config.TRAIN.MULTIGRID.SHORT_CYCLE:
+                from utils.multigrid import MultigridSchedule
+                schedule = MultigridSchedule(config)
             for epoch in range(epoch_start, config.TRAIN.EPOCH):
+                profiled = epoch in config.PROFILER.EPOCH
+                if schedule is not None and schedule.shape(epoch) != train_shape:
+                    train_shape = schedule.shape(epoch)
+                    logger.info("multigrid: frame per clip %s, image size %s, batch size %s", *train_shape)
+                    del dataloader_train  # shut down the workers of the previous shape
+                    dataloader_train = schedule.build_train_loader(epoch)
+                    if distill:
+                        dataloader_train = indexed_loader(dataloader_train)
                 with TrainErrorHelper(ckpt_folder=log_dir, model=net, optimizer=optimizer, scheduler=scheduler,
                                       config=config, logger=logger, epoch=epoch):
                     # train one epoch
                     logger.info("train epoch {}/{}:".format(epoch + 1, config.TRAIN.EPOCH))
-                    train(dataloader_train, net, optimizer, criterion, accuracy_metric, epoch,
-                          writer=writer, split=config.TRAIN.ACCUMULATION_STEP, mode=config.MODE)
+                    global_step = train(dataloader_train, train_net, optimizer, train_criterion, train_metric, epoch,
+                                        writer=writer, split=config.TRAIN.ACCUMULATION_STEP, mode=config.MODE,
+                                        profiler=build_profiler(config, log_dir, f"train_epoch{epoch + 1}")
+                                        if profiled else None,
+                                        timer_freq=config.PROFILER.TIMER_FREQ,
+                                        global_step=global_step)
                     scheduler.step()
+                    log_worker_rss(dataloader_train, writer, epoch + 1)
+                    log_clip_cache(dataloader_train, writer, epoch + 1)
                     # save
                     if (epoch + 1) % config.TRAIN.SAVE_FREQ == 0:
                         ckpt_path = save_checkpoint(ckpt_folder=ckpt_folder,
@@ -127,103 +189,578 @@ def main():
                                                     model=net,
                                                     optimizer=optimizer,
                                                     scheduler=scheduler,
-                                                    config=config)
+                                                    config=config,
+                                                    step=global_step)
                         logger.info("Checkpoint is saved to %s", ckpt_path)
                     # eval
                     if config.TRAIN.EVAL_FREQ != -1 and (epoch + 1) % config.TRAIN.EVAL_FREQ == 0:
                         logger.info("Evaluating...")
-                        loss, top1, top5 = eval(dataloader_val, net, criterion, accuracy_metric)
+                        loss, top1, top5 = eval(dataloader_val, net, criterion, accuracy_metric,
+                                                profiler=build_profiler(config, log_dir, f"eval_epoch{epoch + 1}")
+                                                if profiled and config.PROFILER.EVAL else None)
                         writer.add_scalars("eval/acc", {"top1": top1, "top5": top5}, global_step=epoch + 1)
                         writer.add_scalar("eval/loss", loss, global_step=epoch + 1)
+            if distill:
+                distill_report(dataloader_val, net, teacher, criterion, log_dir, config)
         elif config.MODE == "heatmap":
-            with torch.no_grad():
-                data_loader_train, _, _ = build_loader(config)
-                for video, label in data_loader_train:
-                    video = video / 255
-                    video = video.cuda()
-                    net.cuda()
-                    heatmap = net.heatmap(video)
-                    video = einops.rearrange(video, "batch c t h w->batch t h w c")
-                    heatmap = einops.repeat(heatmap, "batch t h w->batch t h w c", c=3)
-                    heatmap = heatmap - np.min(heatmap)
-                    heatmap = heatmap / np.max(heatmap)
-                    import matplotlib.pyplot as plt
-
-                    video = video.detach().cpu().numpy()
-                    vis = np.stack([video, heatmap])
-                    vis = einops.rearrange(vis, "two batch (t1 t2) h w c->batch (t1 h) (t2 two w) c", t2=4)
-                    for vis_img in vis:
-                        plt.imshow(vis_img,)
-                        plt.show()
-                    pass
+            heatmap(dataloader_val, net, os.path.join(log_dir, "heatmap"), config)
+        elif config.MODE == "probe":
+            from data import build_dataset
+            probe(lambda split: build_dataset(config, split, augment=config.PROBE.AUGMENT),
+                  net, criterion, accuracy_metric, writer, log_dir, ckpt_folder, config)
+        elif config.MODE == "early-exit":
+            early_exit_report(dataloader_val, net, log_dir, config)
+        elif config.MODE == "extract":
+            from data import build_dataset
+            net = optimize_model(net, config)
+            # one deterministic clip per sample, the random train augmentation is not frozen into the store
+            extract(lambda split: build_dataset(config, split, augment=False), net, log_dir, config)
+        elif config.MODE == "quantize":
+            quantize(dataloader_train, dataloader_val, net, log_dir, config)
+        elif config.MODE == "eval" and config.EVAL.NUM_SHARD > 0:
+            from data import build_dataset
+            from utils.sharded_eval import sharded_eval
+            sharded_eval(net, build_dataset(config, "test"),
+                         config.EVAL.OUTPUT_DIR or os.path.join(log_dir, "eval_shards"), config)
         elif config.MODE == "eval":
-            eval(dataloader_test, net, criterion, accuracy_metric)
+            net = optimize_model(net, config)
+            eval(dataloader_test, net, criterion, accuracy_metric, profiler=build_profiler(config, log_dir, "eval"))
         else:
             raise ValueError
-    writer.close()
+    if writer is not None:
+        writer.close()
+
+
+def mode_splits(config):
+    """
+    dataset splits needed by the mode
+    """
+    if config.MODE in ("train", "fine-tune", "distill"):
+        # the multigrid schedule builds the train loader of each phase, distill reports on the val split
+        multigrid = config.TRAIN.MULTIGRID.LONG_CYCLE or config.TRAIN.MULTIGRID.SHORT_CYCLE
+        evaluated = config.TRAIN.EVAL_FREQ != -1 or config.MODE == "distill"
+        return (() if multigrid else ("train",)) + (("val",) if evaluated else ())
+    elif config.MODE == "eval":
+        # the sharded evaluation builds the test dataset without a loader
+        return ("test",) if config.EVAL.NUM_SHARD == 0 else ()
+    elif config.MODE in ("heatmap", "early-exit"):
+        return ("val",)
+    elif config.MODE == "quantize":
+        return "train", "val"
+    else:  # probe and extract build datasets only for missing features
+        return ()
+
+
+def loader_dataset(data_loader):
+    # the dataset under the IndexedSubset or ShortCycleDataset wrapper of a loader
+    return getattr(data_loader.dataset, "dataset", data_loader.dataset)
+
+
+def log_worker_rss(data_loader, writer, epoch):
+    # reported by datasets with a compact clip index
+    worker_rss = getattr(loader_dataset(data_loader), "worker_rss", None)
+    if worker_rss is None:
+        return
+    rss = {f"worker_{i}": v / 2 ** 20 for i, v in enumerate(worker_rss.tolist()) if v > 0}
+    if rss:
+        writer.add_scalars("data/worker_rss_mb", rss, global_step=epoch)
+        logger.info("worker rss: max %.1f MB, mean %.1f MB", max(rss.values()), sum(rss.values()) / len(rss))
+
+
+def log_clip_cache(data_loader, writer, epoch):
+    # hit rate of the decoded-clip cache during the epoch
+    clip_cache = getattr(loader_dataset(data_loader), "clip_cache", None)
+    if clip_cache is None:
+        return
+    stats = clip_cache.stats(reset=True)
+    writer.add_scalar("data/clip_cache_hit_rate", stats["hit_rate"], global_step=epoch)
+    writer.add_scalar("data/clip_cache_gb", stats["bytes"] / 2 ** 30, global_step=epoch)
+    logger.info("clip cache: hit rate %.1f%%, %s/%s clips cached (%.2f GB), %s evictions", stats["hit_rate"] * 100,
+                stats["clips"], len(loader_dataset(data_loader)), stats["bytes"] / 2 ** 30, stats["evictions"])
+
+
+first_batch_logged = False
+
+
+def log_first_batch(mode):
+    global first_batch_logged
+    if not first_batch_logged:
+        first_batch_logged = True
+        logger.info("startup: time to first batch (%s) %.3f s", mode, time.perf_counter() - start_time)
 
 
 def train(data_loader: data.DataLoader, net: torch.nn.Module, optimizer: torch.optim.Optimizer,
-          criterion: torch.nn.Module, acc_metric, epoch, writer=None, split=1, mode="train"):
+          criterion: torch.nn.Module, acc_metric, epoch, writer=None, split=1, mode="train", profiler=None,
+          timer_freq=1, global_step=0):
+    """
+    :param profiler: torch.profiler context from utils.profiling.build_profiler
+    :param timer_freq: steps between stage timings, reading the timers waits for the device
+    :param global_step: train steps before this epoch, the loader length may change between epochs (multigrid)
+    :return: train steps after this epoch
+    """
+    import tqdm
+
     net.cuda()
     net.train()
     optimizer.zero_grad()
     data_loader = tqdm.tqdm(data_loader)
     data_loader.set_description(f"{mode}")
-    timer = ResetTimer()
-    time_log = {}
-    for step, (video, label) in enumerate(PreFetcher(data_loader, device="cuda:0")):
-        video = video / 225
-        video.cuda()
-        time_log["load_data"] = timer()
-
-        logits = net(video)
-        loss = criterion(logits, label)
-        time_log["forward"] = timer()
-        loss.backward()
-        time_log["backward"] = timer()
-
-        if step % split == 0:
-            optimizer.step()
+    timer = StageTimer(device="cuda")
+    data_wait = DataWaitMeter()
+    timer.start()
+    step = -1
+    with profiler_context(profiler):
+        for step, (video, label) in enumerate(PreFetcher(data_loader, device="cuda:0")):
+            data_wait.batch_ready()
+            video = apply_video(lambda v: v / 225, video)
+            timed = step % timer_freq == 0
+            if timed:
+                timer("load_data")
+            log_first_batch(mode)
+
+            outputs = net(video)
+            loss = criterion(outputs, label)
+            # outputs of all heads of an early-exit model
+            logits = outputs[-1] if isinstance(outputs, (tuple, list)) else outputs
+            if timed:
+                timer("forward")
+            loss.backward()
+            if timed:
+                timer("backward")
+
+            if step % split == 0:
+                optimizer.step()
+                optimizer.zero_grad()
+            if timed:
+                timer("optimize")
+
+            acc1, acc5 = acc_metric(logits, label, topk=(1, 5))
+            if timed:
+                timer("acc")
+
+            if writer is not None:
+                total_step = global_step + step
+                writer.add_scalars(f"{mode}/acc", {"top1": acc1, "top5": acc5}, total_step)
+                writer.add_scalar(f"{mode}/loss", loss, total_step)
+                writer.add_scalar(f"{mode}/lr", optimizer.state_dict()['param_groups'][0]['lr'], total_step)
+                if timed:
+                    time_log = timer.elapsed()
+                    writer.add_scalars(f"{mode}/time", time_log, total_step)
+                    writer.add_scalar(f"{mode}/data_wait_ratio_device", time_log["load_data"] / time_log["total"],
+                                      total_step)
+            profiler_step(profiler)
+            data_wait.step_done()
+            # the next load_data stage starts here
+            timer.start()
+
+    logger.info("%s epoch %s: %.1f%% of the time waiting for data", mode, epoch + 1, data_wait.ratio * 100)
+    if writer is not None:
+        writer.add_scalar(f"{mode}/data_wait_ratio", data_wait.ratio, epoch + 1)
+    return global_step + step + 1
+
+
+def profile(output_dir, config):
+    """
+    per-module FLOPs and activation memory, forward/backward time over a sweep of batch sizes and clip lengths
+    """
+    from utils.complexity import ModuleProfiler, time_forward_backward, format_table
+
+    device = config.PROFILE.DEVICE
+    clip_lengths = list(config.PROFILE.CLIP_LENGTH) or [config.DATA.FRAME_PER_CLIP // config.DATA.SKIP_FRAME]
+    results = []
+    for clip_length in clip_lengths:
+        cfg = config.clone()
+        cfg.defrost()
+        cfg.DATA.FRAME_PER_CLIP = clip_length * config.DATA.SKIP_FRAME
+        cfg.MODEL.VIVIT.FRAME_PER_CLIP = clip_length
+        cfg.freeze()
+        net = build_model(cfg).to(device)
+        net.train()
+        for batch_size in config.PROFILE.BATCH_SIZE:
+            video = torch.rand(batch_size, 3, clip_length, *config.DATA.IMG_SIZE, device=device)
+            if config.DATA.DUAL_RATE:
+                video = (video[:, :, ::config.MODEL.SLOWFAST.SLOW_STRIDE],
+                         video[:, :, ::config.MODEL.SLOWFAST.FAST_STRIDE])
+            profiler = ModuleProfiler(net, device=device)
+            profiler(video)
+            timing = time_forward_backward(net, (video,), device=device,
+                                           warmup=config.PROFILE.WARMUP, repeat=config.PROFILE.REPEAT)
+            logger.info("%s, batch size %s, clip length %s, %s\n%s", config.MODEL.ARCH, batch_size, clip_length,
+                        ", ".join(f"{k} {v:.1f}" for k, v in timing.items()),
+                        format_table(profiler.stats, depth=config.PROFILE.DEPTH))
+            results.append({"batch_size": batch_size, "clip_length": clip_length,
+                            "img_size": list(config.DATA.IMG_SIZE), **timing, "modules": profiler.stats})
+        del net
+
+    sweep = [("batch", "clip", "GFLOPs", "fwd ms", "fwd+bwd ms", "saved MB")]
+    for result in results:
+        total = result["modules"][""]
+        sweep.append((str(result["batch_size"]), str(result["clip_length"]), f"{total['flops'] / 1e9:.2f}",
+                      f"{result['forward_ms']:.1f}", f"{result['forward_backward_ms']:.1f}",
+                      f"{sum(m['saved_bytes'] for m in result['modules'].values()) / 2 ** 20:.1f}"))
+    logger.info("sweep:\n%s", "\n".join("  ".join(cell.rjust(10) for cell in row) for row in sweep))
+
+    profile_path = os.path.join(output_dir, f"profile_{config.MODEL.ARCH}.json")
+    with open(profile_path, "w") as f:
+        json.dump({"arch": config.MODEL.ARCH, "device": device, "results": results}, f, indent=2)
+    logger.info("profile is saved to %s", profile_path)
+
+
+def probe(build_split_dataset, net: torch.nn.Module, criterion: torch.nn.Module, acc_metric, writer, log_dir,
+          ckpt_folder, config):
+    """
+    extract backbone features of the train and val split once, then train mlp_head from the feature store
+    the train features are of one clip per sample, in the eval transforms unless PROBE.AUGMENT
+    :param build_split_dataset: split name -> dataset, only called for splits without stored features
+    """
+    from utils.feature_store import FeatureStore, extract_features
+
+    feature_dir = config.PROBE.FEATURE_DIR or os.path.join(log_dir, "features")
+    stores = {}
+    for split in ("train", "val"):
+        root = os.path.join(feature_dir, split)
+        if not FeatureStore.is_complete(root):
+            logger.info("extracting %s features to %s", split, root)
+            extract_features(build_split_dataset(split), net, root, batch_size=config.DATA.BATCH_SIZE,
+                             num_workers=config.DATA.NUM_WORKER, dtype=config.PROBE.DTYPE)
+        stores[split] = FeatureStore(root)
+        logger.info("%s features: %s", split, stores[split].features.shape)
+
+    head = net.mlp_head
+    optimizer = torch.optim.Adam(head.parameters(), lr=config.PROBE.LR_BASE)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer,
+                                                step_size=config.TRAIN.LR_SCHEDULER.DECAY_EPOCH,
+                                                gamma=config.TRAIN.LR_SCHEDULER.DECAY_RATE)
+    total_step = 0
+    for epoch in range(config.PROBE.EPOCH):
+        head.train()
+        for feature, label in stores["train"].batches(config.PROBE.BATCH_SIZE, shuffle=True, device="cuda:0"):
+            logits = head(feature)
+            loss = criterion(logits, label)
             optimizer.zero_grad()
-        time_log["optimize"] = timer()
+            loss.backward()
+            optimizer.step()
+            acc1, acc5 = acc_metric(logits, label, topk=(1, 5))
+            writer.add_scalars("probe/acc", {"top1": acc1, "top5": acc5}, total_step)
+            writer.add_scalar("probe/loss", loss, total_step)
+            total_step += 1
+        scheduler.step()
+
+        head.eval()
+        top1 = AvgMeter("Acc@1", ":4.2f")
+        top5 = AvgMeter("Acc@5", ":4.2f")
+        avg_loss = AvgMeter("Loss", ":3.4f")
+        with torch.no_grad():
+            for feature, label in stores["val"].batches(config.PROBE.BATCH_SIZE, shuffle=False, device="cuda:0"):
+                logits = head(feature)
+                acc1, acc5 = acc_metric(logits, label, topk=(1, 5))
+                avg_loss.update(criterion(logits, label), label.size(0))
+                top1.update(acc1, label.size(0))
+                top5.update(acc5, label.size(0))
+        logger.info("probe epoch %s/%s: %s %s", epoch + 1, config.PROBE.EPOCH, top1, top5)
+        writer.add_scalars("probe_eval/acc", {"top1": top1.avg, "top5": top5.avg}, global_step=epoch + 1)
+        writer.add_scalar("probe_eval/loss", avg_loss.avg, global_step=epoch + 1)
+
+    ckpt_path = save_checkpoint(ckpt_folder=ckpt_folder, epoch=config.PROBE.EPOCH, model=net, optimizer=optimizer,
+                                scheduler=scheduler, config=config)
+    logger.info("Checkpoint is saved to %s", ckpt_path)
+
+
+def extract(build_split_dataset, net: torch.nn.Module, log_dir, config):
+    """
+    write the pooled backbone features, labels and clip ids of EXTRACT.SPLITS to memory-mapped feature stores,
+    incomplete stores are resumed
+    :param build_split_dataset: split name -> dataset, only called for splits without complete features
+    """
+    from utils.feature_store import FeatureStore, extract_features
 
-        acc1, acc5 = acc_metric(logits, label, topk=(1, 5))
-        time_log["acc"] = timer()
+    feature_dir = config.EXTRACT.FEATURE_DIR or os.path.join(log_dir, "features")
+    for split in config.EXTRACT.SPLITS:
+        root = os.path.join(feature_dir, split)
+        if FeatureStore.is_complete(root):
+            logger.info("%s features are already extracted to %s", split, root)
+            continue
+        logger.info("extracting %s features to %s", split, root)
+        store = extract_features(build_split_dataset(split), net, root,
+                                 batch_size=config.EXTRACT.BATCH_SIZE,
+                                 num_workers=config.DATA.NUM_WORKER,
+                                 dtype=config.EXTRACT.DTYPE,
+                                 flush_freq=config.EXTRACT.FLUSH_FREQ,
+                                 queue_size=config.EXTRACT.QUEUE_SIZE)
+        logger.info("%s features: %s", split, store.features.shape)
 
-        if writer is not None:
-            total_step = step + epoch * len(data_loader)
-            writer.add_scalars(f"{mode}/acc", {"top1": acc1, "top5": acc5}, total_step)
-            writer.add_scalar(f"{mode}/loss", loss, total_step)
-            writer.add_scalars(f"{mode}/time", time_log, total_step, )
-            writer.add_scalar(f"{mode}/lr", optimizer.state_dict()['param_groups'][0]['lr'], total_step)
-            time_log["summary"] = timer()
-            time_log["total"] = sum([v if k != "total" else 0 for k, v in time_log.items()])
 
+def early_exit_report(data_loader: data.DataLoader, net: torch.nn.Module, log_dir, config):
+    """
+    accuracy, average depth and throughput of early-exit inference for each threshold of REPORT_THRESHOLDS
+    exits are computed once per batch for the accuracy and depth, throughput is timed on the first batches
+    """
+    import tqdm
 
-def eval(data_loader: data.DataLoader, net: torch.nn.Module, criterion, acc_metric):
+    if not getattr(net, "exit_heads", None):
+        raise NotImplementedError("early exit needs MODEL.VIVIT.EARLY_EXIT.LAYERS")
+    cfg = config.MODEL.VIVIT.EARLY_EXIT
+    thresholds = list(cfg.REPORT_THRESHOLDS)
+    exit_depth = torch.tensor(net.exit_layers + [net.n_layer], device="cuda:0")
+    correct = torch.zeros(len(thresholds), device="cuda:0")
+    depth = torch.zeros(len(thresholds), device="cuda:0")
+    seconds = torch.zeros(len(thresholds) + 1, dtype=torch.float64)
+    num_sample = timed_sample = 0
+
+    net.eval()
+    data_loader = tqdm.tqdm(data_loader)
+    data_loader.set_description("Early exit")
+    with torch.no_grad():
+        for step, (video, label) in enumerate(PreFetcher(data_loader, device="cuda:0")):
+            video = apply_video(lambda v: v / 225, video)
+            # (heads,B,num_classes)
+            probabilities = torch.softmax(torch.stack(net.forward_early_exit(video)).float(), dim=-1)
+            confidence, prediction = probabilities.max(dim=-1)
+            for i, threshold in enumerate(thresholds):
+                passed = confidence >= threshold
+                passed[-1] = True  # the final head always answers
+                head = passed.float().argmax(dim=0)  # first head passing the threshold
+                chosen = prediction.gather(0, head.unsqueeze(0)).squeeze(0)
+                correct[i] += (chosen == label).sum()
+                depth[i] += exit_depth[head].sum()
+            num_sample += label.size(0)
+
+            if step < cfg.TIMING_BATCH:
+                for i, threshold in enumerate(thresholds + [None]):
+                    torch.cuda.synchronize()
+                    start = time.perf_counter()
+                    if threshold is None:  # reference: all layers without the exit heads
+                        net.mlp_head(net.forward_features(video))
+                    else:
+                        net.forward_adaptive(video, threshold)
+                    torch.cuda.synchronize()
+                    seconds[i] += time.perf_counter() - start
+                timed_sample += label.size(0)
+
+    full_throughput = timed_sample / seconds[-1].item()
+    rows = []
+    for i, threshold in enumerate(thresholds):
+        throughput = timed_sample / seconds[i].item()
+        rows.append({"threshold": threshold,
+                     "top1": (correct[i] / num_sample * 100).item(),
+                     "avg_depth": (depth[i] / num_sample).item(),
+                     "throughput": throughput,
+                     "speedup": throughput / full_throughput})
+    logger.info("early exit (full depth %s layers, %.1f clips/s):\n%s", net.n_layer, full_throughput,
+                "\n".join("threshold {threshold:.2f}  top1 {top1:.2f}  depth {avg_depth:.2f}  "
+                          "{throughput:.1f} clips/s  x{speedup:.2f}".format(**row) for row in rows))
+    with open(os.path.join(log_dir, "early_exit.json"), "w") as f:
+        json.dump({"full_throughput": full_throughput, "thresholds": rows}, f, indent=2)
+
+
+def distill_setup(net: torch.nn.Module, train_loader, log_dir, config):
+    """
+    teacher of the distill mode and the model and criterion given to train, the train loader targets are indexed
+    with DISTILL.CACHE the teacher logits of the train split are extracted once to a feature store
+    :return: teacher, model and criterion of train
+    """
+    from utils.distill import DistillLoss, DistillCriterion, DistillModel, build_teacher
+
+    cfg = config.DISTILL
+    teacher = build_teacher(config).cuda()
+    cached_logits = None
+    if cfg.CACHE:
+        from utils.feature_store import extract_features
+
+        root = cfg.CACHE_DIR or os.path.join(log_dir, "teacher_logits")
+        logger.info("teacher logits of the train split: %s", root)
+        store = extract_features(train_loader.dataset, teacher, root, batch_size=config.EXTRACT.BATCH_SIZE,
+                                 num_workers=config.DATA.NUM_WORKER, dtype="float32",
+                                 flush_freq=config.EXTRACT.FLUSH_FREQ, queue_size=config.EXTRACT.QUEUE_SIZE)
+        cached_logits = torch.tensor(store.features, device="cuda:0")  # rows are in clip order
+    criterion = DistillCriterion(DistillLoss(cfg.TEMPERATURE, cfg.ALPHA), cached_logits)
+    return teacher, DistillModel(net, None if cfg.CACHE else teacher), criterion
+
+
+def distill_report(data_loader: data.DataLoader, net: torch.nn.Module, teacher: torch.nn.Module, criterion,
+                   log_dir, config):
+    """
+    speed/accuracy trade-off of student and teacher on the val split, written to distill_report.json
+    """
+    from utils.distill import clip_latency, num_parameters, format_report
+
+    timing = []
+    for step, (video, _) in enumerate(data_loader):
+        if step >= config.DISTILL.REPORT_BATCH:
+            break
+        timing.append(apply_video(lambda v: v.cuda() / 225, video))
+    rows = []
+    for name, model in (("teacher", teacher), ("student", net)):
+        _, top1, top5 = eval(data_loader, model, criterion, accuracy_metric)
+        rows.append({"model": name, "arch": config.MODEL.ARCH if name == "student" else teacher.arch,
+                     "params": num_parameters(model), "top1": float(top1), "top5": float(top5),
+                     "latency_b1": sum(clip_latency(model, apply_video(lambda v: v[:1], video))
+                                       for video in timing) / len(timing),
+                     "latency_batch": sum(clip_latency(model, video) for video in timing) / len(timing)})
+    for row in rows:
+        row["speedup"] = rows[0]["latency_batch"] / row["latency_batch"]
+        row["throughput"] = 1000 / row["latency_batch"]
+    logger.info("distillation report:\n%s", format_report(rows))
+    with open(os.path.join(log_dir, "distill_report.json"), "w") as f:
+        json.dump(rows, f, indent=2)
+
+
+def heatmap(data_loader: data.DataLoader, net: torch.nn.Module, output_dir, config):
+    if not hasattr(net, "heatmap"):
+        raise NotImplementedError(f"heatmap is not supported by {config.MODEL.ARCH}")
+    import tqdm
+    from utils.heatmap import HeatmapWriter, overlay_heatmap
+
+    net.cuda()
+    net.eval()
+    data_loader = tqdm.tqdm(data_loader)
+    data_loader.set_description("Heatmap")
+    sample_idx = 0
+    with torch.no_grad(), HeatmapWriter(output_dir, fmt=config.HEATMAP.FORMAT, num_workers=config.HEATMAP.NUM_WORKER,
+                                        fps=config.HEATMAP.FPS) as writer:
+        for video, label in PreFetcher(data_loader, device="cuda:0"):
+            video = video / 255
+            log_first_batch("heatmap")
+            cam, pred = net.heatmap(video)
+            vis = overlay_heatmap(video, cam, alpha=config.HEATMAP.ALPHA)
+            for frames, l, p in zip(vis, label.tolist(), pred.tolist()):
+                writer.submit(frames, f"{sample_idx:06d}_label{l}_pred{p}")
+                sample_idx += 1
+    logger.info("%s heatmaps are saved to %s", sample_idx, output_dir)
+
+
+def quantize(calibration_loader: data.DataLoader, eval_loader: data.DataLoader, net: torch.nn.Module, output_dir,
+             config):
+    import tqdm
+    from model.quantize import quantize_model, save_quantized, as_inputs
+
+    if config.QUANTIZE.NUM_THREAD > 0:
+        torch.set_num_threads(config.QUANTIZE.NUM_THREAD)
+
+    def cpu_batches(data_loader, num_batch):
+        for step, (video, label) in enumerate(data_loader):
+            if step >= num_batch:
+                break
+            log_first_batch("quantize")
+            yield apply_video(lambda v: v / 225, video), label
+
+    net.cpu()
+    net.eval()
+    logger.info("quantizing (%s)...", config.MODEL.ARCH)
+    calibration = (video for video, _ in tqdm.tqdm(cpu_batches(calibration_loader, config.QUANTIZE.CALIBRATION_BATCH),
+                                                   total=config.QUANTIZE.CALIBRATION_BATCH, desc="Calibrate"))
+    q_net = quantize_model(net, calibration, backend=config.QUANTIZE.BACKEND)
+
+    models = {"float32": lambda v: net(v), "int8": lambda v: q_net(*as_inputs(v))}
+    meters = {name: {"top1": AvgMeter("Acc@1", ":4.2f"), "top5": AvgMeter("Acc@5", ":4.2f")} for name in models}
+    elapsed = {name: 0.0 for name in models}
+    num_clip = 0
+    example = None
+    with torch.no_grad():
+        for step, (video, label) in enumerate(tqdm.tqdm(cpu_batches(eval_loader, config.QUANTIZE.EVAL_BATCH),
+                                                        total=config.QUANTIZE.EVAL_BATCH, desc="Compare")):
+            example = video
+            for name, model in models.items():
+                start = time.perf_counter()
+                logits = model(video)
+                if step > 0:  # first batch is warm up
+                    elapsed[name] += time.perf_counter() - start
+                acc1, acc5 = accuracy_metric(logits, label, (1, 5))
+                meters[name]["top1"].update(acc1, label.size(0))
+                meters[name]["top5"].update(acc5, label.size(0))
+            if step > 0:
+                num_clip += label.size(0)
+
+    report = {"arch": config.MODEL.ARCH, "num_thread": torch.get_num_threads()}
+    for name in models:
+        report[name] = {"top1": float(meters[name]["top1"].avg),
+                        "top5": float(meters[name]["top5"].avg),
+                        "clips_per_second": num_clip / elapsed[name] if elapsed[name] > 0 else None}
+    report["top1_delta"] = report["int8"]["top1"] - report["float32"]["top1"]
+    report["top5_delta"] = report["int8"]["top5"] - report["float32"]["top5"]
+    report["artifact"] = save_quantized(q_net, example, os.path.join(output_dir, f"{config.MODEL.ARCH}_int8.pt"))
+
+    with open(os.path.join(output_dir, "quantize_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("quantize report: %s", json.dumps(report, indent=2))
+    return report
+
+
+def export(net: torch.nn.Module, output_dir, config):
+    """
+    write a TorchScript graph and the preprocessing parameters used by infer.py
+    """
+    from data import dataset_classes
+    from data.transforms import build_transforms
+
+    net = optimize_model(net, config)
+    net.cpu()
+    net.eval()
+    if hasattr(net, "use_checkpoint"):
+        net.use_checkpoint = False
+
+    dual_rate = None
+    if config.DATA.DUAL_RATE:
+        dual_rate = [config.MODEL.SLOWFAST.SLOW_STRIDE, config.MODEL.SLOWFAST.FAST_STRIDE]
+    transforms = build_transforms(config.DATA.IMG_SIZE, config.DATA.SKIP_FRAME, config.DATA.FRAME_PER_CLIP,
+                                  train=False, dual_rate=dual_rate)
+    clip = transforms(torch.zeros(config.DATA.FRAME_PER_CLIP, *config.DATA.IMG_SIZE, 3, dtype=torch.uint8))
+    example = apply_video(lambda v: v.unsqueeze(0).repeat(config.EXPORT.BATCH_SIZE, 1, 1, 1, 1).float() / 225, clip)
+
+    model_path = os.path.join(output_dir, f"{config.MODEL.ARCH}_ts.pt")
+    with torch.no_grad():
+        traced = torch.jit.trace(net, (example,), check_trace=False)
+    torch.jit.save(traced, model_path)
+
+    preprocess = {
+        "model": os.path.basename(model_path),
+        "arch": config.MODEL.ARCH,
+        "batch_size": config.EXPORT.BATCH_SIZE,
+        "frame_per_clip": config.DATA.FRAME_PER_CLIP,
+        "skip": config.DATA.SKIP_FRAME,
+        "size": list(config.DATA.IMG_SIZE),
+        "scale": 225,
+        "dual_rate": dual_rate,
+        # slowfast returns probabilities in eval mode
+        "softmax": config.MODEL.ARCH != "slowfast",
+        "classes": dataset_classes(config),
+    }
+    preprocess_path = os.path.join(output_dir, "preprocess.json")
+    with open(preprocess_path, "w") as f:
+        json.dump(preprocess, f, indent=2)
+    logger.info("model is exported to %s, preprocessing to %s", model_path, preprocess_path)
+
+
+def eval(data_loader: data.DataLoader, net: torch.nn.Module, criterion, acc_metric, profiler=None):
     top1 = AvgMeter("Acc@1", ":4.2f")
     top5 = AvgMeter("Acc@5", ":4.2f")
     avg_loss = AvgMeter("Loss", ":3.4f")
 
+    import tqdm
+
     net.cuda()
     net.eval()
     data_loader = tqdm.tqdm(data_loader)
     data_loader.set_description("Eval")
-    with torch.no_grad():
+    data_wait = DataWaitMeter()
+    with torch.no_grad(), profiler_context(profiler):
         for step, (video, label) in enumerate(PreFetcher(data_loader, device="cuda:0")):
-            video = video / 225
-            video.cuda()
+            data_wait.batch_ready()
+            video = apply_video(lambda v: v / 225, video)
+            log_first_batch("eval")
 
             logits = net(video)
 
             loss = criterion(logits, label)
             acc1, acc5 = acc_metric(logits, label, (1, 5))
 
-            avg_loss.update(loss, video.size(0))
-            top1.update(acc1, video.size(0))
-            top5.update(acc5, video.size(0))
+            avg_loss.update(loss, label.size(0))
+            top1.update(acc1, label.size(0))
+            top5.update(acc5, label.size(0))
             data_loader.set_postfix_str(str(top1) + " " + str(top5))
+            profiler_step(profiler)
+            data_wait.step_done()
+    logger.info("eval: %.1f%% of the time waiting for data", data_wait.ratio * 100)
     return avg_loss.avg, top1.avg, top5.avg
 
 
@@ -0,0 +1,52 @@
+"""
+CPU latency of the inference rewrites of SlowFast against the unfused model
+
+    python -m test.benchmark.fuse
+"""
+import os
+import time
+import unittest
+import torch
+from model.slowfast import SlowFast
+from model.fuse import optimize_slowfast
+
+# relative slowdown of the fused model accepted before the case fails
+TIME_TOLERANCE = float(os.environ.get("BENCHMARK_TIME_TOLERANCE", 0.25))
+NUM_THREAD = int(os.environ.get("BENCHMARK_NUM_THREAD", 4))
+WARMUP, REPEAT = 1, 5
+
+
+def run_benchmark(shape=(1, 3, 32, 112, 112)):
+    """
+    :return: name -> best ms/clip of the baseline, fused and fused + channels_last models
+    """
+    torch.set_num_threads(NUM_THREAD)
+    torch.manual_seed(0)
+    net = SlowFast(51).eval()
+    x = torch.rand(*shape)
+    latency = {}
+    for name, model in (("baseline", net),
+                        ("fused", optimize_slowfast(net, channels_last=False)),
+                        ("fused+channels_last", optimize_slowfast(net))):
+        with torch.no_grad():
+            for _ in range(WARMUP):
+                model(x)
+            times = []
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                model(x)
+                times.append(time.perf_counter() - start)
+        latency[name] = min(times) / shape[0] * 1000  # best of REPEAT, less sensitive to noise
+    return latency
+
+
+class TestFuseBenchmark(unittest.TestCase):
+    def test_fuse_latency(self):
+        latency = run_benchmark()
+        print(", ".join(f"{name} {ms:.1f} ms/clip" for name, ms in latency.items()))
+        # folding removes the BatchNorm ops, channels_last_3d pays off on cuda only and is not asserted
+        self.assertLessEqual(latency["fused"], latency["baseline"] * (1 + TIME_TOLERANCE))
+
+
+if __name__ == '__main__':
+    print(run_benchmark())
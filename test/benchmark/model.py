@@ -0,0 +1,143 @@
+"""
+CPU compute regression benchmark of the models built by build_model
+each case runs in its own process so that the peak rss is not shared between cases
+
+    python -m unittest test.benchmark.model
+    BENCHMARK_UPDATE=1 python -m unittest test.benchmark.model  # write the baseline, on the reference machine only
+
+a single case can be run with `python -m test.benchmark.model <case>`, which prints its result as json
+"""
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+OUTPUT = os.environ.get("BENCHMARK_OUTPUT", os.path.join(ROOT, "log", "benchmark", "results.json"))
+# relative slowdown / memory growth accepted before a case fails
+TIME_TOLERANCE = float(os.environ.get("BENCHMARK_TIME_TOLERANCE", 0.25))
+MEMORY_TOLERANCE = float(os.environ.get("BENCHMARK_MEMORY_TOLERANCE", 0.10))
+NUM_THREAD = int(os.environ.get("BENCHMARK_NUM_THREAD", 4))
+WARMUP, REPEAT = 1, 3
+SEED = 0
+
+# config overrides of each case, on top of the default config
+CASES = {
+    "vivit_small": ["MODEL.ARCH", "vivit", "MODEL.VIVIT.INPUT_SIZE", (64, 64), "MODEL.VIVIT.FRAME_PER_CLIP", 8,
+                    "MODEL.VIVIT.NUM_HEAD", 4, "MODEL.VIVIT.NUM_LAYER", 2,
+                    "MODEL.VIVIT.D_MODEL", 64, "MODEL.VIVIT.D_FEATURE", 128, "DATA.BATCH_SIZE", 2],
+    "vivit_default": ["MODEL.ARCH", "vivit", "DATA.BATCH_SIZE", 1],
+    "slowfast_small": ["MODEL.ARCH", "slowfast", "DATA.IMG_SIZE", (64, 64), "DATA.FRAME_PER_CLIP", 32,
+                       "MODEL.SLOWFAST.SLOW_STRIDE", 8, "DATA.BATCH_SIZE", 2],
+    "slowfast_default": ["MODEL.ARCH", "slowfast", "DATA.BATCH_SIZE", 1],
+}
+TIME_METRICS = ("forward_ms", "forward_backward_ms", "optimizer_step_ms")
+MEMORY_METRICS = ("peak_rss_mb",)
+
+
+def max_rss_mb():
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(name):
+    import torch
+    from config import default_cfg
+    from model import build_model
+
+    torch.set_num_threads(NUM_THREAD)
+    torch.manual_seed(SEED)
+    config = default_cfg.clone()
+    config.defrost()
+    config.merge_from_list(CASES[name])
+    config.freeze()
+
+    net = build_model(config)
+    net.train()
+    optimizer = torch.optim.Adam(net.parameters(), lr=1e-4)
+    if config.MODEL.ARCH == "vivit":
+        shape = (config.MODEL.VIVIT.FRAME_PER_CLIP, *config.MODEL.VIVIT.INPUT_SIZE)
+    else:
+        shape = (config.DATA.FRAME_PER_CLIP // config.DATA.SKIP_FRAME, *config.DATA.IMG_SIZE)
+    video = torch.rand(config.DATA.BATCH_SIZE, 3, *shape)
+    label = torch.randint(config.MODEL.NUM_CLASSES, (config.DATA.BATCH_SIZE,))
+    criterion = torch.nn.CrossEntropyLoss()
+    rss_before = max_rss_mb()
+
+    def forward():
+        with torch.no_grad():
+            net(video)
+
+    def forward_backward():
+        criterion(net(video), label).backward()
+
+    def timed(fn):
+        for _ in range(WARMUP):
+            fn()
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            fn()
+        return (time.perf_counter() - start) / REPEAT * 1000
+
+    result = {"forward_ms": timed(forward), "forward_backward_ms": timed(forward_backward)}
+    # gradients of the last backward are kept, so every step updates the same state
+    result["optimizer_step_ms"] = timed(optimizer.step)
+    result["peak_rss_mb"] = max_rss_mb() - rss_before
+    result["num_parameters"] = sum(p.numel() for p in net.parameters())
+    return result
+
+
+def environment():
+    import torch
+
+    return {"torch": torch.__version__, "python": platform.python_version(), "machine": platform.machine(),
+            "processor": platform.processor(), "num_thread": NUM_THREAD}
+
+
+class TestModelBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        results = {}
+        for name in CASES:
+            output = subprocess.run([sys.executable, "-m", "test.benchmark.model", name],
+                                    cwd=ROOT, capture_output=True, text=True, check=True)
+            results[name] = json.loads(output.stdout.strip().splitlines()[-1])
+            print(name, ", ".join(f"{k} {v:.1f}" for k, v in results[name].items()))
+        report = {"environment": environment(), "cases": results}
+        os.makedirs(os.path.dirname(OUTPUT), exist_ok=True)
+        with open(OUTPUT, "w") as f:
+            json.dump(report, f, indent=2)
+
+        if os.environ.get("BENCHMARK_UPDATE"):
+            with open(BASELINE, "w") as f:
+                json.dump(report, f, indent=2)
+            self.skipTest(f"baseline written to {BASELINE}")
+        if not os.path.exists(BASELINE):
+            self.skipTest(f"no baseline at {BASELINE}, "
+                          "write it with BENCHMARK_UPDATE=1 on the reference machine and check it in")
+
+        with open(BASELINE, "r") as f:
+            baseline = json.load(f)
+        if baseline["environment"] != report["environment"]:
+            print(f"baseline environment {baseline['environment']} differs from {report['environment']}")
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline["cases"]:
+                continue
+            expected = baseline["cases"][name]
+            self.assertEqual(result["num_parameters"], expected["num_parameters"], f"{name}: model changed")
+            for metric, tolerance in [(m, TIME_TOLERANCE) for m in TIME_METRICS] + \
+                                     [(m, MEMORY_TOLERANCE) for m in MEMORY_METRICS]:
+                if result[metric] > expected[metric] * (1 + tolerance):
+                    regressions.append(f"{name} {metric}: {result[metric]:.1f} > "
+                                       f"{expected[metric]:.1f} * {1 + tolerance:.2f}")
+        self.assertFalse(regressions, "performance regression\n" + "\n".join(regressions))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, ROOT)
+    print(json.dumps(run_case(sys.argv[1])))
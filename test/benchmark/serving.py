@@ -0,0 +1,72 @@
+"""
+local load test of the dynamic batching server against one forward per request, on CPU
+
+    python -m test.benchmark.serving
+"""
+import asyncio
+import unittest
+import torch
+from config import default_cfg
+from model import build_model
+from utils.serving import DynamicBatcher, generate_load
+
+NUM_REQUEST = 64
+CONCURRENCY = 16
+# (max batch size, max delay ms)
+SETTINGS = ((1, 0.0), (8, 5.0), (16, 20.0))
+
+
+def small_config():
+    config = default_cfg.clone()
+    config.defrost()
+    config.merge_from_list(["MODEL.ARCH", "vivit", "MODEL.VIVIT.INPUT_SIZE", (64, 64),
+                            "MODEL.VIVIT.FRAME_PER_CLIP", 8, "MODEL.VIVIT.NUM_LAYER", 2,
+                            "MODEL.VIVIT.D_MODEL", 64, "MODEL.VIVIT.D_FEATURE", 128, "MODEL.VIVIT.NUM_HEAD", 4])
+    config.freeze()
+    return config
+
+
+def run_benchmark(config, settings=SETTINGS, num_requests=NUM_REQUEST, concurrency=CONCURRENCY):
+    torch.manual_seed(0)
+    net = build_model(config)
+    shape = (3, config.MODEL.VIVIT.FRAME_PER_CLIP, *config.MODEL.VIVIT.INPUT_SIZE)
+    clip = torch.randint(0, 255, shape, dtype=torch.uint8)
+
+    async def run(max_batch_size, max_delay_ms):
+        batcher = DynamicBatcher(net, max_batch_size=max_batch_size, max_delay_ms=max_delay_ms)
+        await batcher.start()
+        try:
+            await generate_load(batcher, lambda i: clip, CONCURRENCY, concurrency=concurrency)  # warmup
+            result = await generate_load(batcher, lambda i: clip, num_requests, concurrency=concurrency)
+            result["mean_batch_size"] = batcher.stats()["mean_batch_size"]
+            return result
+        finally:
+            await batcher.close()
+
+    results = {}
+    for max_batch_size, max_delay_ms in settings:
+        results[(max_batch_size, max_delay_ms)] = asyncio.run(run(max_batch_size, max_delay_ms))
+    return results
+
+
+def format_results(results):
+    rows = [("batch", "delay ms", "req/s", "mean batch", "p50 ms", "p90 ms", "p99 ms")]
+    for (max_batch_size, max_delay_ms), result in results.items():
+        latency = result["latency_ms"]
+        rows.append((str(max_batch_size), f"{max_delay_ms:.1f}", f"{result['throughput']:.1f}",
+                     f"{result['mean_batch_size']:.1f}", f"{latency['p50']:.1f}", f"{latency['p90']:.1f}",
+                     f"{latency['p99']:.1f}"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.rjust(w) for cell, w in zip(row, widths)) for row in rows)
+
+
+class TestServingBenchmark(unittest.TestCase):
+    def test_dynamic_batching_throughput(self):
+        results = run_benchmark(small_config())
+        print(format_results(results))
+        batched = max(result["throughput"] for key, result in results.items() if key[0] > 1)
+        self.assertGreater(batched, results[SETTINGS[0]]["throughput"])
+
+
+if __name__ == '__main__':
+    print(format_results(run_benchmark(small_config())))
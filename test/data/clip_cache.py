@@ -0,0 +1,44 @@
+import unittest
+from data.clip_cache import *
+
+
+class TestClipCache(unittest.TestCase):
+    def test_lru(self):
+        shape = (3, 2, 4, 4)
+        clip_bytes = 3 * 2 * 4 * 4
+        cache = SharedClipCache(num_clips=10, clip_shape=shape, budget_bytes=2 * clip_bytes + 1)
+        clips = [torch.full(shape, i, dtype=torch.uint8) for i in range(10)]
+        self.assertEqual(cache.num_slots, 2)
+
+        self.assertIsNone(cache.get(0))
+        cache.put(0, clips[0])
+        cache.put(1, clips[1])
+        self.assertTrue(torch.equal(cache.get(0), clips[0]))  # 1 is now the least recently used
+        cache.put(2, clips[2])
+        self.assertIsNone(cache.get(1))
+        self.assertTrue(torch.equal(cache.get(2), clips[2]))
+        self.assertTrue(torch.equal(cache.get(0), clips[0]))
+
+        stats = cache.stats(reset=True)
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"], stats["clips"]), (3, 2, 1, 2))
+        self.assertEqual(cache.stats()["hits"], 0)
+        cache.close()
+
+    def test_attach(self):
+        # spawned workers attach to the same shared memory
+        shape = (3, 1, 2, 2)
+        cache = SharedClipCache(num_clips=4, clip_shape=shape, budget_bytes=1 << 20)
+        worker = SharedClipCache.__new__(SharedClipCache)
+        worker.__setstate__(cache.__getstate__())
+        worker.put(3, torch.ones(shape, dtype=torch.uint8))
+        self.assertTrue(torch.equal(cache.get(3), torch.ones(shape, dtype=torch.uint8)))
+        worker.close()
+        cache.close()
+
+    def test_shm_space(self):
+        with self.assertRaises(ValueError):
+            check_shm_space(1 << 60, shm_dir=os.path.dirname(os.path.abspath(__file__)))
+
+
+if __name__ == '__main__':
+    unittest.main()
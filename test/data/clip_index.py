@@ -0,0 +1,21 @@
+import unittest
+from types import SimpleNamespace
+from data.clip_index import *
+
+
+class TestClipIndex(unittest.TestCase):
+    def test_from_video_dataset(self):
+        video_clips = SimpleNamespace(
+            frame_rate=None, num_frames=2,
+            video_paths=["/videos/a.mp4", "/videos/类别/b.avi", "/videos/c.mp4"],
+            clips=[torch.tensor([[0, 1], [2, 3]]), torch.zeros(0, 2, dtype=torch.int64), torch.tensor([[10, 20]])],
+        )
+        dataset = SimpleNamespace(video_clips=video_clips, transform=None,
+                                  samples=[("a", 3), ("b", 1), ("c", 5)])
+        index = ClipIndexDataset.from_video_dataset(dataset)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.video_path(1), "/videos/类别/b.avi")
+        self.assertEqual(index.clip_video.tolist(), [0, 0, 2])
+        self.assertEqual(index.clip_start.tolist(), [0, 2, 10])
+        self.assertEqual(index.clip_end.tolist(), [1, 3, 20])
+        self.assertEqual(index.labels.tolist(), [3, 3, 5])
@@ -0,0 +1,26 @@
+import unittest
+from data.manager import *
+
+
+def collate(batch):
+    return [torch.stack([sample[0] for sample in batch]), torch.LongTensor([sample[1] for sample in batch])]
+
+
+class TestLoaderManager(unittest.TestCase):
+    def test_shared_workers(self):
+        datasets = {"train": [(torch.full((2,), i), i) for i in range(37)],
+                    "val": [(torch.full((2,), i), -i) for i in range(11)]}
+        manager = LoaderManager(datasets, collate, num_workers=3, pin_memory=False)
+        train = manager.loader("train", batch_size=4)
+        val = manager.loader("val", batch_size=4, shuffle=False)
+        try:
+            self.assertEqual(len(train), 10)
+            labels = sorted(label for _, batch in train for label in batch.tolist())
+            self.assertEqual(labels, list(range(37)))
+            # interleaved iterations of two splits
+            val_iter = iter(val)
+            next(iter(train))
+            self.assertEqual(next(val_iter)[1].tolist(), [0, -1, -2, -3])
+            self.assertEqual(len(manager.workers), 3)
+        finally:
+            manager.close()
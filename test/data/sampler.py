@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from data.sampler import *
+
+
+class TestSampler(unittest.TestCase):
+    def test_video_groups(self):
+        clip_video = np.repeat(np.arange(5, dtype=np.int32), [7, 1, 0, 12, 3])
+        sampler = VideoGroupBatchSampler(clip_video, batch_size=4, group_size=4)
+        num_batches = len(sampler)
+        batches = list(sampler)
+        self.assertEqual(len(batches), num_batches)
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(len(clip_video))))
+
+        for group in sampler.groups():
+            self.assertLessEqual(len(group), 4)
+            self.assertEqual(len(set(clip_video[group].tolist())), 1)
+            self.assertEqual(group.tolist(), list(range(group[0], group[0] + len(group))))
+
+    def test_groups_in_one_batch(self):
+        clip_video = np.repeat(np.arange(6, dtype=np.int32), [7, 1, 5, 12, 3, 9])
+        sampler = VideoGroupBatchSampler(clip_video, batch_size=6, group_size=4)
+        for _ in range(5):
+            groups = sampler.groups()
+            batches = sampler.pack(groups)
+            self.assertEqual(sorted(i for batch in batches for i in batch), list(range(len(clip_video))))
+            self.assertTrue(all(len(batch) <= 6 for batch in batches))
+            batch_of_clip = {i: b for b, batch in enumerate(batches) for i in batch}
+            for group in groups:
+                self.assertEqual(len({batch_of_clip[i] for i in group.tolist()}), 1)
+
+    def test_container_cache(self):
+        from torchvision.io import write_video, read_video, read_video_timestamps
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "video.mp4")
+            frames = torch.randint(0, 255, (48, 64, 64, 3), dtype=torch.uint8)
+            write_video(path, frames, fps=24)
+            pts, _ = read_video_timestamps(path, pts_unit="pts")
+
+            cache = ContainerCache(size=1, frame_cache=4)
+            # sequential clips, an overlapping clip and a clip before the cached frames
+            for start, end in ((0, 7), (8, 15), (12, 23), (2, 5), (40, 47)):
+                expected, _, _ = read_video(path, pts[start], pts[end], pts_unit="pts")
+                video = cache.read(path, pts[start], pts[end])
+                self.assertTrue(torch.equal(video, expected), f"clip {start}-{end}")
+            self.assertEqual(cache.misses, 1)
+            cache.close()
@@ -0,0 +1,19 @@
+import unittest
+from data.synthetic import *
+
+
+class TestSynthetic(unittest.TestCase):
+    def test_loader(self):
+        loader = build_synthetic_loader(10, 51, num_workers=0, batch_size=4, frame_per_clip=16, skip=2, size=(32, 32))
+        video, label = next(iter(loader))
+        self.assertEqual(tuple(video.shape), (4, 3, 8, 32, 32))
+        self.assertEqual(video.dtype, torch.uint8)
+        self.assertEqual(len(loader), 3)
+        self.assertTrue(((label >= 0) & (label < 51)).all())
+
+    def test_per_sample_transform(self):
+        loader = build_synthetic_loader(4, 10, num_workers=0, batch_size=2, frame_per_clip=32, skip=2, size=(32, 32),
+                                        dual_rate=(8, 2), raw_size=(48, 64), transform=True, decode_ms=1)
+        slow, fast = next(iter(loader))[0]
+        self.assertEqual(tuple(slow.shape), (2, 3, 2, 32, 32))
+        self.assertEqual(tuple(fast.shape), (2, 3, 8, 32, 32))
@@ -0,0 +1,25 @@
+import torch
+import unittest
+from model.conv3d import Conv3D
+from model.conv2d_lstm import Conv2DLSTM
+from utils.distill import DistillLoss
+
+
+class TestDistill(unittest.TestCase):
+    def test_student_shape(self):
+        x = torch.rand(2, 3, 32, 64, 48)
+        self.assertEqual(Conv3D(10, size=(64, 48), frame_per_clip=32, hidden=8)(x).shape, (2, 10))
+        self.assertEqual(Conv2DLSTM(10, frame_per_clip=32, seq_len=4, pool_size=(2, 2), hidden=8)(x).shape, (2, 10))
+
+    def test_loss(self):
+        torch.manual_seed(0)
+        logits, teacher_logits = torch.randn(4, 5), torch.randn(4, 5)
+        target = torch.randint(0, 5, (4,))
+        # soft targets equal to the student predictions leave only the label term
+        self.assertAlmostEqual(DistillLoss(alpha=1.0)(logits, logits, target).item(), 0.0, places=5)
+        torch.testing.assert_close(DistillLoss(alpha=0.0)(logits, teacher_logits, target),
+                                   torch.nn.functional.cross_entropy(logits, target))
+
+
+if __name__ == '__main__':
+    unittest.main()
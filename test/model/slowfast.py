@@ -0,0 +1,35 @@
+import torch
+import unittest
+from model.slowfast import *
+from model.fuse import optimize_slowfast
+
+
+def random_bn_stats(net):
+    # default running statistics make folding trivial
+    with torch.no_grad():
+        for module in net.modules():
+            if isinstance(module, nn.BatchNorm3d):
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2)
+                module.weight.uniform_(0.5, 1.5)
+                module.bias.uniform_(-0.5, 0.5)
+    return net
+
+
+class TestSlowFast(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.net = random_bn_stats(SlowFast(51)).eval()
+        self.x = torch.rand(2, 3, 32, 64, 64)
+
+    def test_fuse_parity(self):
+        for fuse, channels_last in ((True, False), (False, True), (True, True)):
+            optimized = optimize_slowfast(self.net, fuse=fuse, channels_last=channels_last)
+            with torch.no_grad():
+                torch.testing.assert_close(optimized(self.x), self.net(self.x), rtol=1e-4, atol=1e-5)
+
+    def test_dual_rate_input(self):
+        pair = (self.x[:, :, ::16], self.x[:, :, ::2])
+        for net in (self.net, optimize_slowfast(self.net)):
+            with torch.no_grad():
+                torch.testing.assert_close(net(pair), net(self.x), rtol=1e-4, atol=1e-5)
@@ -17,3 +17,58 @@ class TestViViT(unittest.TestCase):
         sample = einops.rearrange(sample, "(n_h h) (n_w w) -> (n_h n_w h) w", n_h=3, n_w=3)
         plt.imshow(sample)
         plt.show()
+
+    def test_streaming(self):
+        torch.manual_seed(0)
+        net = ViViT(10, size=(32, 32), frame_per_clip=8, t=2, h=16, w=16,
+                    n_head=2, n_layer=2, d_model=16, d_feature=32).eval()
+        with torch.no_grad():
+            net.positional_embedding.normal_()
+        stream = StreamingViViT(net, stride=4)
+        x = torch.rand(2, 3, 20, 32, 32)
+        outputs = []
+        for start in range(0, x.size(2), 3):  # chunks are not aligned with tubelets
+            outputs += stream.push(x[:, :, start:start + 3])
+        self.assertEqual([end for end, _ in outputs], [8, 12, 16, 20])
+        with torch.no_grad():
+            for end, logits in outputs:
+                torch.testing.assert_close(logits, net(x[:, :, end - 8:end]), rtol=1e-4, atol=1e-5)
+
+    def test_resample_positional_embedding(self):
+        small = dict(t=2, h=16, w=16, n_head=2, n_layer=1, d_model=16, d_feature=32)
+        net = ViViT(10, size=(32, 32), frame_per_clip=8, **small).eval()
+        # other clip length and resolution than the positional embedding
+        with torch.no_grad():
+            self.assertEqual(net(torch.rand(1, 3, 4, 64, 48)).shape, (1, 10))
+        # checkpoint of another shape
+        larger = ViViT(10, size=(64, 64), frame_per_clip=16, **small)
+        state_dict = net.adapt_state_dict(larger.state_dict())
+        self.assertEqual(state_dict["positional_embedding"].shape, net.positional_embedding.shape)
+        net.load_state_dict(state_dict)
+
+    def test_early_exit(self):
+        torch.manual_seed(0)
+        net = ViViT(10, size=(32, 32), frame_per_clip=4, t=2, h=16, w=16, n_head=2, n_layer=3,
+                    d_model=16, d_feature=32, exit_layers=(1, 2))
+        x = torch.rand(4, 3, 4, 32, 32)
+        outputs = net(x)
+        self.assertEqual(len(outputs), 3)
+        EarlyExitLoss(nn.CrossEntropyLoss())(outputs, torch.arange(4)).backward()
+        EarlyExitLoss(nn.CrossEntropyLoss(), mode="distill")(net(x), torch.arange(4)).backward()
+
+        net.eval()
+        exits = net.forward_early_exit(x)
+        # threshold above any confidence: all layers, same as the final head
+        logits, depth = net.forward_adaptive(x, threshold=1.1)
+        self.assertTrue(torch.allclose(logits, exits[-1], atol=1e-5))
+        self.assertEqual(depth.tolist(), [3] * 4)
+        # every sample exits at the first head
+        logits, depth = net.forward_adaptive(x, threshold=0.0)
+        self.assertTrue(torch.allclose(logits, exits[0], atol=1e-5))
+        self.assertEqual(depth.tolist(), [1] * 4)
+        # mixed exits keep the batch order
+        confidence = torch.softmax(exits[0], dim=-1).max(dim=-1)[0]
+        threshold = confidence.median().item()
+        logits, depth = net.forward_adaptive(x, threshold=threshold)
+        for i in range(4):
+            self.assertTrue(torch.allclose(logits[i], exits[depth[i].item() - 1][i], atol=1e-5))
@@ -0,0 +1,56 @@
+import os
+import re
+import sys
+import time
+import shlex
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules only some modes need, importing run.py should not load them
+LAZY_MODULES = ("tqdm", "torchsummary", "torch.utils.tensorboard", "torchvision", "einops",
+                "model.vivit", "model.slowfast", "data")
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        code = f"import sys, run; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "")
+
+    def test_import_time(self):
+        # run.py against an eager import of the modules it defers, best of 3 subprocesses each
+        def import_time(modules):
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-c", f"import {modules}"], cwd=ROOT, check=True)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        lazy = import_time("run")
+        eager = import_time(", ".join(("run",) + LAZY_MODULES))
+        # wall-clock times are only reported, test_lazy_imports checks that the modules are deferred
+        print(f"import run: {lazy:.3f} s, with the lazy modules: {eager:.3f} s")
+
+    @unittest.skipUnless(os.environ.get("STARTUP_BENCH_ARGS"),
+                         "set STARTUP_BENCH_ARGS to '<config> <dataset> --video ...' to measure time to first batch")
+    def test_time_to_first_batch(self):
+        args = shlex.split(os.environ["STARTUP_BENCH_ARGS"])
+        pattern = re.compile(r"time to first batch \((\S+)\) ([\d.]+) s")
+        results = {}
+        for mode in ("train", "eval", "heatmap"):
+            process = subprocess.Popen([sys.executable, "run.py", mode, *args], cwd=ROOT,
+                                       stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+            try:
+                for line in process.stderr:
+                    match = pattern.search(line)
+                    if match:
+                        results[mode] = float(match.group(2))
+                        break
+            finally:
+                process.kill()
+                process.wait()
+        for mode, seconds in results.items():
+            print(f"{mode}: {seconds:.3f} s to first batch")
+        self.assertEqual(set(results), {"train", "eval", "heatmap"}, "a mode did not reach its first batch")
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+import torch
+from torchvision.io import write_video, read_video
+from transcode import *
+
+
+class TestTranscode(unittest.TestCase):
+    def test_resample(self):
+        frames = [SimpleFrame(i / 10) for i in range(10)]  # 1 s at 10 fps
+        self.assertEqual([index for index, _ in resample(frames, 5)], list(range(5)))
+        self.assertEqual(len(list(resample(frames, 20))), 20)
+
+    def test_transcode(self):
+        with tempfile.TemporaryDirectory() as root:
+            source, target = os.path.join(root, "source"), os.path.join(root, "target")
+            os.makedirs(os.path.join(source, "train", "class_a"))
+            write_video(os.path.join(source, "train", "class_a", "video.mp4"),
+                        torch.randint(0, 255, (20, 96, 128, 3), dtype=torch.uint8), fps=10)
+            open(os.path.join(source, "train", "metadata_cache.pt"), "w").close()
+
+            self.assertEqual(transcode(source, target, short_side=48, fps=5), [])
+            video, _, info = read_video(os.path.join(target, "train", "class_a", "video.mp4"), pts_unit="sec")
+            self.assertEqual(tuple(video.shape), (10, 48, 64, 3))
+            self.assertAlmostEqual(info["video_fps"], 5)
+            self.assertFalse(os.path.exists(os.path.join(target, "train", "metadata_cache.pt")))
+
+            # finished videos are skipped, other settings are refused
+            open(os.path.join(target, "train", "metadata_cache.pt"), "w").close()
+            self.assertEqual(transcode(source, target, short_side=48, fps=5), [])
+            self.assertTrue(os.path.exists(os.path.join(target, "train", "metadata_cache.pt")))
+            with self.assertRaises(ValueError):
+                transcode(source, target, short_side=32)
+
+
+class SimpleFrame:
+    def __init__(self, time):
+        self.time = time
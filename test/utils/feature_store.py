@@ -0,0 +1,52 @@
+import tempfile
+import unittest
+from utils.feature_store import *
+
+
+class ClipDataset(data.Dataset):
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, idx):
+        return torch.full((4, 3, 2, 2), idx, dtype=torch.uint8), torch.zeros(1, 0), idx % 3
+
+
+class MeanFeatures(torch.nn.Module):
+    def forward_features(self, x):
+        return x.flatten(2).mean(dim=2)
+
+
+class TestFeatureStore(unittest.TestCase):
+    def test_clip_ids(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = FeatureStore.create(root, 4, 2, dtype="float32")
+            store.write(np.ones((2, 2)), np.array([1, 2]), np.array([7, 8]))
+            store.flush()
+            store = FeatureStore(root)
+            self.assertEqual(store.count, 2)
+            self.assertEqual(store.clip_ids[:2].tolist(), [7, 8])
+            self.assertFalse(FeatureStore.is_complete(root))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "the prefetcher needs cuda")
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as root:
+            dataset = ClipDataset()
+            # a partially written store, rows after the last flush are written again
+            store = FeatureStore.create(root, len(dataset), 4, dtype="float32")
+            store.write(np.zeros((4, 4)), np.zeros(4), np.arange(4))
+            store.flush()
+            store.write(np.full((2, 4), -1), np.zeros(2), np.arange(4, 6))
+
+            store = extract_features(dataset, MeanFeatures(), root, batch_size=3, dtype="float32", flush_freq=1)
+            self.assertTrue(FeatureStore.is_complete(root))
+            self.assertEqual(store.clip_ids.tolist(), list(range(10)))
+            self.assertEqual(store.labels[4:].tolist(), [i % 3 for i in range(4, 10)])
+            expected = np.arange(4, 10)[:, None] / 225
+            self.assertTrue(np.allclose(store.features[4:], expected))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "the prefetcher needs cuda")
+    def test_empty(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = extract_features(data.Subset(ClipDataset(), []), MeanFeatures(), root, dtype="float32")
+            self.assertTrue(FeatureStore.is_complete(root))
+            self.assertEqual(store.features.shape, (0, 0))
@@ -0,0 +1,47 @@
+import unittest
+from config import default_cfg
+from model.vivit import ViViT
+from utils.optim import *
+
+
+def small_vivit():
+    return ViViT(10, size=(32, 32), frame_per_clip=4, t=2, h=16, w=16, n_head=2, n_layer=1, d_model=16, d_feature=32)
+
+
+def optimizer_config(**options):
+    config = default_cfg.clone()
+    config.defrost()
+    for key, value in options.items():
+        config.TRAIN.OPTIMIZER[key] = value
+    config.freeze()
+    return config
+
+
+class TestOptim(unittest.TestCase):
+    def test_param_groups(self):
+        net = small_vivit()
+        decay, no_decay = param_groups(net, 0.05)
+        names = {id(p): n for n, p in net.named_parameters()}
+        no_decay_names = [names[id(p)] for p in no_decay["params"]]
+        self.assertIn("positional_embedding", no_decay_names)
+        self.assertTrue(all(names[id(p)].endswith("weight") for p in decay["params"]))
+        self.assertTrue(all(p.dim() > 1 for p in decay["params"]))
+        self.assertEqual(len(decay["params"]) + len(no_decay["params"]), len(list(net.parameters())))
+
+    def test_build_and_resume(self):
+        net = small_vivit()
+        for name in ("adam", "adamw", "sgd"):
+            optimizer = build_optimizer(net, optimizer_config(NAME=name, IMPL="foreach", WEIGHT_DECAY=0.05))
+            net(torch.rand(2, 3, 4, 32, 32)).sum().backward()
+            optimizer.step()
+
+            resumed = build_optimizer(net, optimizer_config(NAME=name, IMPL="foreach", WEIGHT_DECAY=0.05))
+            self.assertTrue(load_optimizer_state_dict(resumed, optimizer_state_dict(optimizer)))
+            self.assertEqual(len(resumed.state), len(optimizer.state))
+
+        # checkpoint of a single group optimizer: hyper-parameters only
+        single = torch.optim.Adam(net.parameters(), lr=0.5)
+        resumed = build_optimizer(net, optimizer_config(WEIGHT_DECAY=0.05))
+        self.assertFalse(load_optimizer_state_dict(resumed, single.state_dict()))
+        self.assertEqual([g["lr"] for g in resumed.param_groups], [0.5, 0.5])
+        self.assertEqual([g["weight_decay"] for g in resumed.param_groups], [0.05, 0.0])
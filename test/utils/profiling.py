@@ -0,0 +1,26 @@
+import time
+import unittest
+from utils.profiling import *
+
+
+class TestProfiling(unittest.TestCase):
+    def test_stage_timer(self):
+        timer = StageTimer(device="cpu")
+        timer.start()
+        time.sleep(0.02)
+        timer("load_data")
+        time.sleep(0.01)
+        timer("forward")
+        time_log = timer.elapsed()
+        self.assertGreaterEqual(time_log["load_data"], 20)
+        self.assertGreaterEqual(time_log["forward"], 10)
+        self.assertAlmostEqual(time_log["total"], time_log["load_data"] + time_log["forward"])
+
+    def test_data_wait(self):
+        meter = DataWaitMeter()
+        time.sleep(0.02)
+        meter.batch_ready()
+        time.sleep(0.02)
+        meter.step_done()
+        self.assertGreater(meter.ratio, 0.3)
+        self.assertLess(meter.ratio, 0.7)
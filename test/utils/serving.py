@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+from model.vivit import ViViT
+from utils.serving import *
+
+
+def small_vivit():
+    torch.manual_seed(0)
+    return ViViT(10, size=(32, 32), frame_per_clip=4, t=2, h=16, w=16, n_head=2, n_layer=1, d_model=16, d_feature=32)
+
+
+class TestServing(unittest.TestCase):
+    def test_dynamic_batching(self):
+        net = small_vivit()
+        clips = [torch.randint(0, 255, (3, 4, 32, 32), dtype=torch.uint8) for _ in range(10)]
+
+        async def serve():
+            batcher = DynamicBatcher(net, max_batch_size=4, max_delay_ms=50)
+            await batcher.start()
+            try:
+                outputs = await asyncio.gather(*[batcher.infer(clip) for clip in clips])
+                return outputs, batcher.stats()
+            finally:
+                await batcher.close()
+
+        outputs, stats = asyncio.run(serve())
+        with torch.no_grad():
+            expected = net.eval()(torch.stack(clips) / 225)
+        self.assertTrue(torch.allclose(torch.stack(outputs), expected, atol=1e-5))
+        self.assertEqual(stats["requests"], 10)
+        self.assertLessEqual(stats["batches"], 4)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    def test_close_inflight(self):
+        net = small_vivit()
+        clip = torch.randint(0, 255, (3, 4, 32, 32), dtype=torch.uint8)
+
+        async def serve():
+            batcher = DynamicBatcher(net, max_batch_size=4, max_delay_ms=1000)
+            await batcher.start()
+            requests = [asyncio.ensure_future(batcher.infer(clip)) for _ in range(2)]
+            await asyncio.sleep(0.1)  # the requests are taken off the queue, the batch is still collected
+            await batcher.close()
+            return await asyncio.wait_for(asyncio.gather(*requests, return_exceptions=True), timeout=5)
+
+        results = asyncio.run(serve())
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
@@ -0,0 +1,27 @@
+import tempfile
+import unittest
+from utils.sharded_eval import *
+
+
+class TestShardedEval(unittest.TestCase):
+    def test_shard_ranges(self):
+        ranges = shard_ranges(10, 3)
+        self.assertEqual(ranges, [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(shard_ranges(2, 3), [(0, 0), (0, 1), (1, 2)])
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as root:
+            # 4 clips of 2 videos, written out of order by two shards
+            logits = np.array([[2, 0, 0], [0, 1, 0], [0, 3, 0], [0, 0, 1]], dtype=np.float32)
+            labels = np.array([0, 0, 1, 2])
+            video_ids = np.array([0, 0, 1, 1])
+            for shard, clips in enumerate(([2, 3], [0, 1])):
+                np.savez(shard_path(root, shard), logits=logits[clips], labels=labels[clips],
+                         clip_ids=np.array(clips), video_ids=video_ids[clips])
+            results = merge_shards(root, 2)
+            self.assertEqual(results["num_clips"], 4)
+            self.assertEqual(results["num_videos"], 2)
+            self.assertAlmostEqual(results["clip_top1"], 50.0)
+            self.assertAlmostEqual(results["video_top1"], 50.0)
+            merged = np.load(os.path.join(root, "merged.npz"))
+            self.assertEqual(merged["clip_ids"].tolist(), [0, 1, 2, 3])
@@ -0,0 +1,32 @@
+import unittest
+from config import default_cfg
+from utils.sweep import *
+
+
+class TestSweep(unittest.TestCase):
+    def test_grid(self):
+        space = [["TRAIN.LR_BASE", [1e-4, 1e-3]], ["TRAIN.ACCUMULATION_STEP", [1, 2, 4]]]
+        trials = expand_space(space)
+        self.assertEqual(len(trials), 6)
+        self.assertEqual(trials[-1], {"TRAIN.LR_BASE": 1e-3, "TRAIN.ACCUMULATION_STEP": 4})
+        config = trial_config(default_cfg, trials[-1])
+        self.assertEqual((config.TRAIN.LR_BASE, config.TRAIN.ACCUMULATION_STEP), (1e-3, 4))
+        with self.assertRaises(AssertionError):  # the data pipeline is shared
+            expand_space([["DATA.BATCH_SIZE", [1, 2]]])
+
+    def test_random(self):
+        space = [["TRAIN.LR_BASE", "loguniform", 1e-5, 1e-2], ["TRAIN.LR_SCHEDULER.DECAY_EPOCH", "randint", 5, 10]]
+        trials = expand_space(space, "random", num_trial=5, seed=1)
+        self.assertEqual(trials, expand_space(space, "random", num_trial=5, seed=1))
+        for trial in trials:
+            self.assertTrue(1e-5 <= trial["TRAIN.LR_BASE"] <= 1e-2)
+            self.assertIn(trial["TRAIN.LR_SCHEDULER.DECAY_EPOCH"], range(5, 11))
+
+    def test_weak_trials(self):
+        self.assertEqual(weak_trials({0: 10.0}, 0.5), [])
+        self.assertEqual(sorted(weak_trials({0: 10.0, 1: 40.0, 2: 30.0, 3: 20.0}, 0.5)), [0, 3])
+        self.assertEqual(weak_trials({0: 10.0, 1: 10.0}, 0.9), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+transcode a Kinetics400 or HMDB51 video folder to the training resolution, so that the loaders do not decode
+full resolution frames every epoch only to downscale them
+the directory and label layout is kept, finished videos are skipped when the command is run again
+
+    python transcode.py /data/kinetics400 /data/kinetics400_256 --short-side 256 --fps 30 --num-worker 32
+"""
+import os
+import json
+import shutil
+import argparse
+import logging
+import multiprocessing as mp
+from fractions import Fraction
+
+import av
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+parser = argparse.ArgumentParser(description="Parallel offline transcoding")
+
+parser.add_argument("source", type=str, help="dataset folder, e.g. the kinetics root or the hmdb51 video folder")
+parser.add_argument("target", type=str, help="output folder, created with the same layout")
+parser.add_argument("--short-side", type=int, default=256, help="length of the short side after resizing")
+parser.add_argument("--fps", type=float, default=None, help="fixed output frame rate, keep the source rate if not set")
+parser.add_argument("--crf", type=int, default=23, help="quality of the h264 encoder")
+parser.add_argument("--num-worker", type=int, default=os.cpu_count())
+parser.add_argument("--extensions", type=str, nargs="+", default=["mp4", "avi"])
+
+METADATA_CACHE = "metadata_cache.pt"
+SETTINGS = "transcode.json"
+# encoder of each container, avi is kept for the hmdb51 annotations which refer to the file names
+CODECS = {"mp4": "libx264", "avi": "mpeg4"}
+
+
+def output_size(width, height, short_side):
+    # never upscale, even sides for yuv420p
+    scale = min(1.0, short_side / min(width, height))
+    return max(2, int(round(width * scale / 2)) * 2), max(2, int(round(height * scale / 2)) * 2)
+
+
+def resample(frames, fps):
+    """
+    repeat or drop decoded frames to a constant frame rate, each output frame is the last input frame before it
+    :return: iterator of (output index, frame)
+    """
+    index = 0
+    previous, previous_time, start, duration = None, 0.0, None, 0.0
+    for frame in frames:
+        if frame.time is None:
+            continue
+        if start is None:
+            start = frame.time
+        time = frame.time - start
+        while previous is not None and index / fps < time:
+            yield index, previous
+            index += 1
+        duration = time - previous_time if previous is not None else 0.0
+        previous, previous_time = frame, time
+    if previous is not None:
+        # the last frame lasts as long as the frame before it
+        while index / fps < previous_time + max(duration, 1 / fps) - 1e-6:
+            yield index, previous
+            index += 1
+
+
+def transcode_video(task):
+    """
+    executed in worker processes, the video is written to a temporary file and renamed when complete
+    :return: (source path, error message or None)
+    """
+    source, target, short_side, fps, crf = task
+    extension = os.path.splitext(target)[1][1:].lower()
+    partial = target + ".part"  # not matched by the dataset extensions
+    try:
+        with av.open(source) as input_container, av.open(partial, "w", format=extension) as output_container:
+            input_stream = input_container.streams.video[0]
+            input_stream.thread_type = "AUTO"
+            width, height = output_size(input_stream.codec_context.width, input_stream.codec_context.height,
+                                        short_side)
+            rate = Fraction(fps).limit_denominator(1001) if fps else (input_stream.average_rate or Fraction(30))
+
+            output_stream = output_container.add_stream(CODECS.get(extension, "libx264"), rate=rate)
+            output_stream.width, output_stream.height = width, height
+            output_stream.pix_fmt = "yuv420p"
+            output_stream.thread_count = 1  # parallelism comes from the process pool
+            if output_stream.codec_context.name == "libx264":
+                output_stream.options = {"crf": str(crf), "preset": "veryfast"}
+            output_stream.time_base = Fraction(1) / rate
+
+            frames = input_container.decode(input_stream)
+            indexed = resample(frames, float(rate)) if fps else enumerate(frames)
+            for index, frame in indexed:
+                frame = frame.reformat(width=width, height=height, format="yuv420p")
+                frame.pts, frame.time_base = index, output_stream.time_base
+                output_container.mux(output_stream.encode(frame))
+            output_container.mux(output_stream.encode())
+        os.replace(partial, target)
+        return source, None
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return source, f"{type(e).__name__}: {e}"
+
+
+def scan(source, target, extensions):
+    """
+    :return: (videos to transcode, other files to copy) as (source, target) path pairs
+    """
+    videos, others = [], []
+    for folder, _, files in os.walk(source):
+        for name in sorted(files):
+            src = os.path.join(folder, name)
+            dst = os.path.join(target, os.path.relpath(src, source))
+            if name == METADATA_CACHE or name.endswith(".part"):
+                continue
+            if os.path.splitext(name)[1][1:].lower() in extensions:
+                videos.append((src, dst))
+            else:
+                others.append((src, dst))
+    return videos, others
+
+
+def check_settings(target, settings):
+    # finished videos are only reused when they were transcoded with the same settings
+    path = os.path.join(target, SETTINGS)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            previous = json.load(f)
+        if previous != settings:
+            raise ValueError(f"{target} was transcoded with {previous}, use another target folder for {settings}")
+    else:
+        os.makedirs(target, exist_ok=True)
+        with open(path + ".part", "w") as f:
+            json.dump(settings, f, indent=2)
+        os.replace(path + ".part", path)
+
+
+def invalidate_metadata(target):
+    # the cached clip index of the loaders refers to the frames of the previous files
+    for folder, _, files in os.walk(target):
+        if METADATA_CACHE in files:
+            os.remove(os.path.join(folder, METADATA_CACHE))
+            logger.info("Removed %s", os.path.join(folder, METADATA_CACHE))
+
+
+def transcode(source, target, short_side, fps=None, crf=23, num_worker=1, extensions=("mp4", "avi")):
+    source, target = os.path.abspath(source), os.path.abspath(target)
+    assert source != target and not target.startswith(source + os.sep), "target must be outside of the source"
+    check_settings(target, {"short_side": short_side, "fps": fps, "crf": crf})
+
+    videos, others = scan(source, target, extensions)
+    for src, dst in others:
+        if not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(src, dst)
+    pending = [(src, dst) for src, dst in videos if not os.path.exists(dst)]
+    logger.info("%d videos, %d already transcoded", len(videos), len(videos) - len(pending))
+    if not pending:
+        return []
+
+    for _, dst in pending:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+    invalidate_metadata(target)
+    tasks = [(src, dst, short_side, fps, crf) for src, dst in pending]
+    failed = []
+    with mp.Pool(num_worker) as pool:
+        for src, error in tqdm(pool.imap_unordered(transcode_video, tasks), total=len(tasks), desc="Transcode"):
+            if error is not None:
+                failed.append(src)
+                logger.warning("Failed to transcode %s: %s", src, error)
+    logger.info("Transcoded %d videos, %d failed", len(tasks) - len(failed), len(failed))
+    return failed
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    transcode(args.source, args.target, args.short_side, args.fps, args.crf, args.num_worker,
+              tuple(e.lower() for e in args.extensions))
@@ -0,0 +1,123 @@
+import time
+import torch
+from collections import OrderedDict
+from torch.utils.flop_counter import FlopCounterMode
+
+
+def tensor_bytes(x):
+    if isinstance(x, torch.Tensor):
+        return x.numel() * x.element_size()
+    if isinstance(x, (tuple, list)):
+        return sum(tensor_bytes(v) for v in x)
+    return 0
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+class ModuleProfiler:
+    """
+    per-module forward statistics, values of a module include its children
+        flops: forward FLOPs
+        output_bytes: bytes of the outputs
+        saved_bytes: bytes of the activations saved for backward, each storage is counted once,
+            in the innermost module saving it, parameters are excluded
+        forward_ms: wall time of the forward
+    """
+
+    def __init__(self, net: torch.nn.Module, device="cpu"):
+        self.net = net
+        self.device = device
+        self.stats = OrderedDict((name, {"flops": 0, "output_bytes": 0, "saved_bytes": 0, "forward_ms": 0.0})
+                                 for name, _ in net.named_modules())
+        self.stack = []
+        self.start = {}
+        self.saved = set()
+        self.params = {p.data_ptr() for p in net.parameters()}
+        self.counter = None
+
+    def _pre_hook(self, name):
+        def hook(module, inputs):
+            synchronize(self.device)
+            self.stack.append(name)
+            self.start[name] = (self.counter.get_total_flops(), time.perf_counter())
+
+        return hook
+
+    def _post_hook(self, name):
+        def hook(module, inputs, outputs):
+            synchronize(self.device)
+            flops, start = self.start.pop(name)
+            self.stats[name]["flops"] += self.counter.get_total_flops() - flops
+            self.stats[name]["forward_ms"] += (time.perf_counter() - start) * 1000
+            self.stats[name]["output_bytes"] += tensor_bytes(outputs)
+            self.stack.pop()
+
+        return hook
+
+    def _pack(self, x):
+        ptr = x.untyped_storage().data_ptr()
+        if ptr not in self.params and ptr not in self.saved and self.stack:
+            self.saved.add(ptr)
+            self.stats[self.stack[-1]]["saved_bytes"] += x.untyped_storage().nbytes()
+        return x
+
+    def __call__(self, *inputs):
+        handles = []
+        for name, module in self.net.named_modules():
+            handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            handles.append(module.register_forward_hook(self._post_hook(name)))
+        try:
+            with FlopCounterMode(display=False) as self.counter, \
+                    torch.autograd.graph.saved_tensors_hooks(self._pack, lambda x: x):
+                output = self.net(*inputs)
+        finally:
+            for handle in handles:
+                handle.remove()
+        return output
+
+
+def time_forward_backward(net, inputs, device="cpu", warmup=1, repeat=3):
+    """
+    :return: mean forward and forward+backward time in ms, peak memory in bytes (cuda only)
+    """
+    def run(backward):
+        output = net(*inputs)
+        if backward:
+            output.float().sum().backward()
+            net.zero_grad(set_to_none=True)
+
+    result = {}
+    for name, backward in (("forward_ms", False), ("forward_backward_ms", True)):
+        with torch.set_grad_enabled(backward):
+            for _ in range(warmup):
+                run(backward)
+            if torch.device(device).type == "cuda":
+                torch.cuda.reset_peak_memory_stats(device)
+            synchronize(device)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                run(backward)
+            synchronize(device)
+            result[name] = (time.perf_counter() - start) / repeat * 1000
+    if torch.device(device).type == "cuda":
+        result["peak_memory_bytes"] = torch.cuda.max_memory_allocated(device)
+    return result
+
+
+def format_table(stats, depth=2):
+    rows = [("module", "GFLOPs", "output MB", "saved MB", "forward ms")]
+    for name, stat in stats.items():
+        level = 0 if name == "" else name.count(".") + 1
+        if level > depth:
+            continue
+        rows.append((name or "(total)",
+                     f"{stat['flops'] / 1e9:.3f}",
+                     f"{stat['output_bytes'] / 2 ** 20:.2f}",
+                     f"{stat['saved_bytes'] / 2 ** 20:.2f}",
+                     f"{stat['forward_ms']:.2f}"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in
+                               enumerate(zip(row, widths))) for row in rows)
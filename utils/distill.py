@@ -0,0 +1,152 @@
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from .train_utils import accuracy_metric
+
+
+class DistillLoss(nn.Module):
+    """
+    alpha * T^2 * KL(teacher || student) at temperature T + (1 - alpha) * cross entropy with the labels
+    """
+
+    def __init__(self, temperature=4.0, alpha=0.9):
+        super(DistillLoss, self).__init__()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def forward(self, logits, teacher_logits, target):
+        t = self.temperature
+        soft = F.kl_div(F.log_softmax(logits / t, dim=-1), F.softmax(teacher_logits.float() / t, dim=-1),
+                        reduction="batchmean") * t * t
+        return self.alpha * soft + (1 - self.alpha) * F.cross_entropy(logits, target)
+
+
+class DistillCriterion(nn.Module):
+    """
+    DistillLoss as a criterion of run.train, the target is the (2,B) labels and clip indices of collate_indexed
+    teacher logits are outputs of DistillModel, or rows of the cached logits at the clip indices
+    """
+
+    def __init__(self, loss: DistillLoss, cached_logits=None):
+        super(DistillCriterion, self).__init__()
+        self.loss = loss
+        self.cached_logits = cached_logits
+
+    def forward(self, outputs, target):
+        if isinstance(outputs, (tuple, list)):
+            teacher_logits, logits = outputs
+        else:
+            logits, teacher_logits = outputs, self.cached_logits[target[1]]
+        return self.loss(logits, teacher_logits, target[0])
+
+
+class DistillModel(nn.Module):
+    """
+    student with the teacher alongside, training outputs are [teacher logits, student logits]
+    the teacher stays in eval mode, it is not run when its logits are cached (teacher is None)
+    """
+
+    def __init__(self, student, teacher=None):
+        super(DistillModel, self).__init__()
+        self.student = student
+        self.teacher = teacher
+
+    def train(self, mode=True):
+        super(DistillModel, self).train(mode)
+        if self.teacher is not None:
+            self.teacher.eval()
+        return self
+
+    def forward(self, x):
+        logits = self.student(x)
+        if not self.training or self.teacher is None:
+            return logits
+        with torch.no_grad():
+            teacher_logits = self.teacher(x)
+        return [teacher_logits, logits]
+
+
+def indexed_accuracy(logits, target, topk=(1,)):
+    # accuracy_metric of the (2,B) labels and clip indices
+    return accuracy_metric(logits, target[0], topk)
+
+
+class TeacherLogits(nn.Module):
+    """
+    logits of the teacher in eval mode, also as forward_features so that extract_features caches them
+    """
+
+    def __init__(self, teacher, arch):
+        super(TeacherLogits, self).__init__()
+        self.teacher = teacher
+        self.arch = arch
+
+    def forward(self, x):
+        from .sharded_eval import clip_logits
+
+        return clip_logits(self.teacher, x, self.arch)
+
+    def forward_features(self, x):
+        return self(x)
+
+
+def build_teacher(config):
+    """
+    teacher of DISTILL.TEACHER_CONFIG with the weights of DISTILL.TEACHER_CHECKPOINT, in eval mode
+    the model section of the teacher config is used, the data section of the student config
+    """
+    from config import default_cfg
+    from model import build_model
+
+    teacher_config = default_cfg.clone()
+    teacher_config.defrost()
+    teacher_config.merge_from_file(config.DISTILL.TEACHER_CONFIG)
+    teacher_config.DATA = config.DATA.clone()
+    teacher_config.freeze()
+    assert teacher_config.MODEL.NUM_CLASSES == config.MODEL.NUM_CLASSES, "teacher and student classes not match"
+
+    teacher = build_model(teacher_config)
+    state_dict = torch.load(config.DISTILL.TEACHER_CHECKPOINT, map_location="cpu")
+    state_dict = state_dict.get("model", state_dict)
+    if hasattr(teacher, "adapt_state_dict"):
+        state_dict = teacher.adapt_state_dict(state_dict)
+    teacher.load_state_dict(state_dict)
+    return TeacherLogits(teacher, teacher_config.MODEL.ARCH).eval()
+
+
+@torch.no_grad()
+def clip_latency(net, video, warmup=2, repeat=10):
+    """
+    :return: forward time per clip in ms of a batch
+    """
+    first = video[0] if isinstance(video, (tuple, list)) else video  # (slow, fast) pair
+
+    def synchronize():
+        if first.is_cuda:
+            torch.cuda.synchronize(first.device)
+
+    net.eval()
+    for _ in range(warmup):
+        net(video)
+    synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        net(video)
+    synchronize()
+    return (time.perf_counter() - start) / repeat / first.size(0) * 1000
+
+
+def num_parameters(net):
+    return sum(p.numel() for p in net.parameters())
+
+
+def format_report(rows):
+    header = ("model", "params M", "top1", "top5", "ms/clip b1", "ms/clip bN", "speedup")
+    table = [header] + [(row["model"], f"{row['params'] / 1e6:.2f}", f"{row['top1']:.2f}", f"{row['top5']:.2f}",
+                         f"{row['latency_b1']:.2f}", f"{row['latency_batch']:.2f}", f"x{row['speedup']:.1f}")
+                        for row in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in
+                               enumerate(zip(row, widths))) for row in table)
+
@@ -0,0 +1,190 @@
+import os
+import json
+import logging
+import queue
+import threading
+import numpy as np
+import torch
+import tqdm
+from numpy.lib.format import open_memmap
+from torch.utils import data
+from .train_utils import PreFetcher, apply_video
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureStore:
+    """
+    features and labels of one split in memory-mapped .npy files
+        <root>/features.npy  (N,D)
+        <root>/labels.npy    (N,)
+        <root>/clip_ids.npy  (N,) dataset index of each row
+        <root>/meta.json     rows written so far
+    """
+
+    def __init__(self, root, mode="r"):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.features = np.load(os.path.join(root, "features.npy"), mmap_mode=mode)
+        self.labels = np.load(os.path.join(root, "labels.npy"), mmap_mode=mode)
+        clip_ids_path = os.path.join(root, "clip_ids.npy")
+        self.clip_ids = np.load(clip_ids_path, mmap_mode=mode) if os.path.exists(clip_ids_path) else None
+
+    @classmethod
+    def create(cls, root, num, dim, dtype="float16"):
+        os.makedirs(root, exist_ok=True)
+        open_memmap(os.path.join(root, "features.npy"), mode="w+", dtype=dtype, shape=(num, dim)).flush()
+        open_memmap(os.path.join(root, "labels.npy"), mode="w+", dtype=np.int64, shape=(num,)).flush()
+        open_memmap(os.path.join(root, "clip_ids.npy"), mode="w+", dtype=np.int64, shape=(num,)).flush()
+        cls._dump_meta(root, {"num": num, "dim": dim, "count": 0, "complete": False})
+        return cls(root, mode="r+")
+
+    @staticmethod
+    def _dump_meta(root, meta):
+        # atomic, a crash never leaves a count ahead of the flushed rows
+        tmp = os.path.join(root, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(root, "meta.json"))
+
+    @staticmethod
+    def exists(root):
+        return os.path.exists(os.path.join(root, "meta.json"))
+
+    @staticmethod
+    def is_complete(root):
+        meta_path = os.path.join(root, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            return json.load(f)["complete"]
+
+    @property
+    def count(self):
+        return self.meta["count"]
+
+    def __len__(self):
+        return self.count
+
+    def write(self, features, labels, clip_ids=None):
+        start, end = self.count, self.count + len(labels)
+        self.features[start:end] = features
+        self.labels[start:end] = labels
+        if self.clip_ids is not None:
+            self.clip_ids[start:end] = np.arange(start, end) if clip_ids is None else clip_ids
+        self.meta["count"] = end
+
+    def flush(self, complete=False):
+        self.features.flush()
+        self.labels.flush()
+        if self.clip_ids is not None:
+            self.clip_ids.flush()
+        self.meta["complete"] = complete
+        self._dump_meta(self.root, self.meta)
+
+    def batches(self, batch_size, shuffle=True, device="cpu"):
+        """
+        :return: iterator of (features, labels) tensors, features are float32
+        """
+        index = torch.randperm(self.count) if shuffle else torch.arange(self.count)
+        for batch in index.split(batch_size):
+            batch = np.sort(batch.numpy())  # sequential reads within a batch
+            features = torch.from_numpy(np.ascontiguousarray(self.features[batch])).to(device).float()
+            labels = torch.from_numpy(np.ascontiguousarray(self.labels[batch])).to(device)
+            yield features, labels
+
+
+class _AsyncWriter(threading.Thread):
+    """
+    writes (event, features, labels, clip_ids) batches to a store in order, after the device to host copy
+    recorded by event is done, so that writing overlaps with the inference of the next batches
+    """
+
+    def __init__(self, store, flush_freq, queue_size=4):
+        super(_AsyncWriter, self).__init__(daemon=True)
+        self.store = store
+        self.flush_freq = flush_freq
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def run(self):
+        step = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                event, features, labels, clip_ids = item
+                if event is not None:
+                    event.synchronize()
+                self.store.write(features.numpy(), labels.numpy(), clip_ids.numpy())
+                step += 1
+                if step % self.flush_freq == 0:
+                    self.store.flush()
+            except Exception as e:
+                self.error = e
+
+    def put(self, features, labels, clip_ids):
+        if self.error is not None:
+            raise self.error
+        tensors = [features, labels, clip_ids]
+        event = None
+        if any(tensor.is_cuda for tensor in tensors):
+            for i, tensor in enumerate(tensors):
+                host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+                tensors[i] = host.copy_(tensor, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+        self.queue.put((event, *tensors))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+@torch.no_grad()
+def extract_features(dataset, net, root, batch_size=64, num_workers=0, dtype="float16", device="cuda:0",
+                     flush_freq=50, queue_size=4):
+    """
+    run net.forward_features over a dataset in order and store the pooled features, labels and clip ids
+    a partially written store is resumed after its last flushed row
+    decoding (loader workers), inference and writing (a background thread) overlap
+    :param dataset: clips in their deterministic eval transforms, e.g. data.build_dataset with augment=False
+    """
+    net.to(device).eval()  # the batches are prefetched to device
+    store = FeatureStore(root, mode="r+") if FeatureStore.exists(root) else None
+    start = store.count if store is not None else 0
+    if store is not None and store.meta["complete"]:
+        return store
+    from data.sampler import IndexedSubset, collate_indexed
+
+    loader = data.DataLoader(IndexedSubset(dataset, start), batch_size, shuffle=False, num_workers=num_workers,
+                             pin_memory=True, collate_fn=collate_indexed)
+    if start > 0:
+        logger.info("resume feature extraction from row %s/%s", start, len(dataset))
+
+    writer = None
+    loader = tqdm.tqdm(loader)
+    loader.set_description("Extract")
+    try:
+        for video, target in PreFetcher(loader, device=device):
+            video = apply_video(lambda v: v / 225, video)
+            features = net.forward_features(video).to(getattr(torch, dtype))
+            if store is None:
+                store = FeatureStore.create(root, len(dataset), features.size(1), dtype=dtype)
+            if writer is None:
+                writer = _AsyncWriter(store, flush_freq, queue_size)
+                writer.start()
+            writer.put(features, target[0], target[1])
+    finally:
+        if writer is not None:
+            writer.close()
+    if store is None:  # empty dataset, no batch to size the features
+        store = FeatureStore.create(root, 0, 0, dtype=dtype)
+    store.flush(complete=True)
+    return store
@@ -0,0 +1,98 @@
+import os
+import einops
+import torch
+import torch.multiprocessing as mp
+
+
+def jet_colormap(x):
+    # x: (...) in [0, 1] -> (..., 3) rgb in [0, 1]
+    r = torch.clamp(1.5 - torch.abs(4 * x - 3), 0, 1)
+    g = torch.clamp(1.5 - torch.abs(4 * x - 2), 0, 1)
+    b = torch.clamp(1.5 - torch.abs(4 * x - 1), 0, 1)
+    return torch.stack([r, g, b], dim=-1)
+
+
+def overlay_heatmap(video, cam, alpha=0.5):
+    """
+    blend class activation maps onto the input clips, on the device of the inputs
+    :param video: (B,C,T,H,W) in [0, 1]
+    :param cam: (B,T,H,W) class activation maps
+    :return: (B,T,H,W,C) uint8 tensor on cpu
+    """
+    # normalize each sample to [0, 1]
+    cam_min = cam.flatten(1).min(dim=1)[0].view(-1, 1, 1, 1)
+    cam_max = cam.flatten(1).max(dim=1)[0].view(-1, 1, 1, 1)
+    cam = (cam - cam_min) / (cam_max - cam_min).clamp(min=1e-6)
+
+    video = einops.rearrange(video, "b c t h w -> b t h w c")
+    vis = (1 - alpha) * video + alpha * jet_colormap(cam)
+    vis = (vis.clamp(0, 1) * 255).to(torch.uint8)
+    return vis.cpu()
+
+
+def _write_heatmap(path, frames, fmt, fps):
+    # executed in writer processes
+    import torchvision
+
+    frames = torch.from_numpy(frames)
+    if fmt == "image":
+        t = frames.size(0)
+        cols = 4 if t % 4 == 0 else t
+        grid = einops.rearrange(frames, "(t1 t2) h w c -> c (t1 h) (t2 w)", t2=cols)
+        torchvision.io.write_png(grid.contiguous(), path)
+    elif fmt == "video":
+        torchvision.io.write_video(path, frames, fps=fps)
+    else:
+        raise ValueError(f"heatmap format {fmt} is not supported")
+    return path
+
+
+class HeatmapWriter:
+    """
+    encode heatmap overlays to disk with a pool of writer processes, in the calling process if num_workers is 0
+    """
+
+    def __init__(self, output_dir, fmt="image", num_workers=4, fps=8, max_pending=None):
+        assert fmt in ("image", "video"), f"heatmap format {fmt} is not supported"
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.fps = fps
+        self.max_pending = max_pending if max_pending is not None else 4 * num_workers
+        self.pool = mp.get_context("spawn").Pool(num_workers) if num_workers > 0 else None
+        self.pending = []
+        self.count = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def submit(self, frames, name):
+        """
+        :param frames: (T,H,W,C) uint8 tensor
+        :param name: output file name without extension
+        """
+        # bound the number of clips waiting in the pool
+        while len(self.pending) >= self.max_pending:
+            self.pending.pop(0).get()
+        ext = "png" if self.fmt == "image" else "mp4"
+        path = os.path.join(self.output_dir, f"{name}.{ext}")
+        self.count += 1
+        if self.pool is None:
+            _write_heatmap(path, frames.numpy(), self.fmt, self.fps)
+            return
+        self.pending.append(self.pool.apply_async(_write_heatmap, (path, frames.numpy(), self.fmt, self.fps)))
+
+    def close(self):
+        for result in self.pending:
+            result.get()
+        self.pending = []
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self.pool is not None:
+            self.pool.terminate()
+        return False
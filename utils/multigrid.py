@@ -0,0 +1,132 @@
+import torch
+from torch.utils import data
+from .train_utils import apply_video
+
+
+def shape_multiple(config):
+    """
+    :return: multiple of DATA.FRAME_PER_CLIP and of each side of DATA.IMG_SIZE accepted by the model
+    """
+    if config.MODEL.ARCH == "vivit":
+        return config.DATA.SKIP_FRAME * config.MODEL.VIVIT.T, (config.MODEL.VIVIT.H, config.MODEL.VIVIT.W)
+    elif config.MODEL.ARCH == "slowfast":
+        # stem and res stages downsample 32x spatially
+        return config.DATA.SKIP_FRAME * config.MODEL.SLOWFAST.SLOW_STRIDE, (32, 32)
+    else:
+        return config.DATA.SKIP_FRAME, (1, 1)
+
+
+def round_to(x, multiple):
+    return max(multiple, int(round(x / multiple)) * multiple)
+
+
+class ShortCycleDataset(data.Dataset):
+    """
+    samples are indexed by (index, size), clips are resized to size after the dataset transforms
+    """
+
+    def __init__(self, dataset, size):
+        self.dataset = dataset
+        self.size = tuple(size)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, key):
+        from torchvision.transforms.functional import resize
+
+        index, size = key
+        sample = self.dataset[index]
+        if tuple(size) != self.size:
+            sample = (apply_video(lambda v: resize(v, list(size)), sample[0]), *sample[1:])
+        return sample
+
+
+class ShortCycleBatchSampler(data.Sampler):
+    """
+    consecutive batches cycle through the spatial sizes of a short cycle, smaller sizes get larger batches
+    """
+
+    def __init__(self, num_samples, shapes):
+        """
+        :param shapes: [(size, batch_size), ...] of the steps in a cycle
+        """
+        super(ShortCycleBatchSampler, self).__init__(None)
+        self.num_samples = num_samples
+        self.shapes = shapes
+
+    def __iter__(self):
+        index = torch.randperm(self.num_samples).tolist()
+        start = step = 0
+        while start < self.num_samples:
+            size, batch_size = self.shapes[step % len(self.shapes)]
+            yield [(i, size) for i in index[start:start + batch_size]]
+            start += batch_size
+            step += 1
+
+    def __len__(self):
+        start = step = 0
+        while start < self.num_samples:
+            start += self.shapes[step % len(self.shapes)][1]
+            step += 1
+        return step
+
+
+class MultigridSchedule:
+    """
+    long cycle: clip length and spatial size change every EPOCH_PER_PHASE epochs
+    short cycle: spatial size changes every step inside an epoch
+    the batch size is scaled so that batch * frames * pixels, i.e. per-step compute, stays roughly constant
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.cfg = config.TRAIN.MULTIGRID
+        self.frame_multiple, self.size_multiple = shape_multiple(config)
+
+    def scale_batch(self, batch_size, frames, size, base_frames, base_size):
+        cost = frames * size[0] * size[1] / (base_frames * base_size[0] * base_size[1])
+        return max(1, int(round(batch_size / cost)))
+
+    def shape(self, epoch):
+        """
+        :return: (frame per clip, image size, batch size) of the train loader at this epoch
+        """
+        base_frames, base_size = self.config.DATA.FRAME_PER_CLIP, tuple(self.config.DATA.IMG_SIZE)
+        t_scale = s_scale = 1.0
+        if self.cfg.LONG_CYCLE and epoch < self.config.TRAIN.EPOCH - self.cfg.FINAL_EPOCH:
+            factors = self.cfg.LONG_CYCLE_FACTORS
+            t_scale, s_scale = factors[(epoch // self.cfg.EPOCH_PER_PHASE) % len(factors)]
+        frames = round_to(base_frames * t_scale, self.frame_multiple)
+        size = tuple(round_to(s * s_scale, m) for s, m in zip(base_size, self.size_multiple))
+        batch_size = self.scale_batch(self.config.DATA.BATCH_SIZE, frames, size, base_frames, base_size)
+        return frames, size, batch_size
+
+    def short_cycle(self, size, batch_size):
+        shapes = []
+        for factor in self.cfg.SHORT_CYCLE_FACTORS:
+            short_size = tuple(round_to(s * factor, m) for s, m in zip(size, self.size_multiple))
+            shapes.append((short_size, self.scale_batch(batch_size, 1, short_size, 1, size)))
+        return shapes + [(size, batch_size)]
+
+    def build_train_loader(self, epoch):
+        from data import build_loader
+
+        frames, size, batch_size = self.shape(epoch)
+        config = self.config.clone()
+        config.defrost()
+        config.DATA.FRAME_PER_CLIP = frames
+        config.DATA.IMG_SIZE = size
+        config.DATA.BATCH_SIZE = batch_size
+        config.freeze()
+        loader = build_loader(config, splits=("train",))[0]
+        if not self.cfg.SHORT_CYCLE:
+            return loader
+
+        return data.DataLoader(ShortCycleDataset(loader.dataset, size),
+                               batch_sampler=ShortCycleBatchSampler(len(loader.dataset),
+                                                                    self.short_cycle(size, batch_size)),
+                               num_workers=loader.num_workers,
+                               persistent_workers=loader.persistent_workers,
+                               pin_memory=loader.pin_memory,
+                               collate_fn=loader.collate_fn)
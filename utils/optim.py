@@ -0,0 +1,104 @@
+import torch
+import torch.distributed as dist
+
+# parameters matching these names are excluded from weight decay, in addition to norm weights and biases
+NO_DECAY_KEYWORDS = ("positional_embedding", "cls_token")
+
+
+def param_groups(model: torch.nn.Module, weight_decay):
+    """
+    :return: [decay group, no decay group], norm weights, biases and positional embeddings are not decayed
+    """
+    norm_types = (torch.nn.modules.batchnorm._NormBase, torch.nn.LayerNorm, torch.nn.GroupNorm)
+    no_decay_ids = set()
+    for module_name, module in model.named_modules():
+        for name, param in module.named_parameters(recurse=False):
+            full_name = f"{module_name}.{name}" if module_name else name
+            if isinstance(module, norm_types) or name.endswith("bias") or \
+                    any(keyword in full_name for keyword in NO_DECAY_KEYWORDS):
+                no_decay_ids.add(id(param))
+
+    decay, no_decay = [], []
+    for param in model.parameters():
+        if param.requires_grad:
+            (no_decay if id(param) in no_decay_ids else decay).append(param)
+    return [{"params": decay, "weight_decay": weight_decay},
+            {"params": no_decay, "weight_decay": 0.0}]
+
+
+def build_optimizer(model: torch.nn.Module, config, lr=None) -> torch.optim.Optimizer:
+    """
+    optimizer of TRAIN.OPTIMIZER, the state is sharded across ranks with ZeroRedundancyOptimizer
+    when TRAIN.OPTIMIZER.ZERO is set and the process group is initialized
+    """
+    cfg = config.TRAIN.OPTIMIZER
+    lr = config.TRAIN.LR_BASE if lr is None else lr
+    if cfg.NAME == "adam":
+        optimizer_class = torch.optim.Adam
+        kwargs = {"betas": tuple(cfg.BETAS), "eps": cfg.EPS}
+    elif cfg.NAME == "adamw":
+        optimizer_class = torch.optim.AdamW
+        kwargs = {"betas": tuple(cfg.BETAS), "eps": cfg.EPS}
+    elif cfg.NAME == "sgd":
+        optimizer_class = torch.optim.SGD
+        kwargs = {"momentum": cfg.MOMENTUM, "nesterov": cfg.NESTEROV}
+    else:
+        raise NotImplementedError(f"optimizer {cfg.NAME}")
+
+    if cfg.IMPL == "foreach":
+        kwargs["foreach"] = True
+    elif cfg.IMPL == "fused":
+        # cuda parameters only, e.g. the model stays on cpu in the quantize and export modes
+        if all(param.is_cuda for param in model.parameters()):
+            kwargs["fused"] = True
+        else:
+            kwargs["foreach"] = True
+    elif cfg.IMPL != "default":
+        raise NotImplementedError(f"optimizer implementation {cfg.IMPL}")
+
+    groups = param_groups(model, cfg.WEIGHT_DECAY)
+    if cfg.ZERO and dist.is_available() and dist.is_initialized():
+        from torch.distributed.optim import ZeroRedundancyOptimizer
+
+        optimizer = ZeroRedundancyOptimizer(groups[0]["params"], optimizer_class=optimizer_class, lr=lr,
+                                            weight_decay=groups[0]["weight_decay"], **kwargs)
+        optimizer.add_param_group(groups[1])
+        return optimizer
+    return optimizer_class(groups, lr=lr, **kwargs)
+
+
+def is_sharded(optimizer):
+    return type(optimizer).__name__ == "ZeroRedundancyOptimizer"
+
+
+def optimizer_state_dict(optimizer):
+    """
+    full state dict of the optimizer, the shards of a ZeroRedundancyOptimizer are gathered to rank 0
+    (collective, call it on every rank), other ranks get None
+    """
+    if is_sharded(optimizer):
+        optimizer.consolidate_state_dict(to=0)
+        return optimizer.state_dict() if dist.get_rank() == 0 else None
+    return optimizer.state_dict()
+
+
+def load_optimizer_state_dict(optimizer, state_dict):
+    """
+    load a full state dict, a ZeroRedundancyOptimizer keeps the shard of this rank, so the state is resharded
+    when the world size changed
+    the state is only restored when the parameter groups match, otherwise only the hyper-parameters are
+    :return: True if the state is restored
+    """
+    saved_groups = state_dict["param_groups"]
+    # param_groups of a ZeroRedundancyOptimizer hold the parameters of all ranks
+    groups = optimizer.param_groups
+    if len(saved_groups) == len(groups) and \
+            all(len(saved["params"]) == len(group["params"]) for saved, group in zip(saved_groups, groups)):
+        optimizer.load_state_dict(state_dict)
+        return True
+
+    # e.g. a checkpoint of a single group optimizer, weight decay is kept per group
+    for i, group in enumerate(groups):
+        saved = saved_groups[min(i, len(saved_groups) - 1)]
+        group.update({k: v for k, v in saved.items() if k not in ("params", "weight_decay")})
+    return False
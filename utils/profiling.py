@@ -0,0 +1,119 @@
+import os
+import time
+import logging
+import contextlib
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    durations of the stages of a step, from cuda events recorded on the current stream, so that the time
+    of the kernels is measured instead of the time to launch them
+    falls back to the host clock without cuda
+    """
+
+    def __init__(self, device="cuda"):
+        self.cuda = torch.cuda.is_available() and str(device).startswith("cuda")
+        self.marks = []
+
+    def _mark(self):
+        if self.cuda:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def start(self):
+        self.marks = [(None, self._mark())]
+
+    def __call__(self, stage):
+        """
+        end of a stage, which started at the end of the previous one
+        """
+        self.marks.append((stage, self._mark()))
+
+    def elapsed(self):
+        """
+        waits for the last stage to finish on the device
+        :return: {stage: ms, ..., "total": ms}
+        """
+        if len(self.marks) < 2:
+            return {}
+        if self.cuda:
+            self.marks[-1][1].synchronize()
+        time_log = {}
+        for (_, begin), (stage, end) in zip(self.marks, self.marks[1:]):
+            time_log[stage] = time_log.get(stage, 0.0) + (begin.elapsed_time(end) if self.cuda
+                                                          else (end - begin) * 1000)
+        time_log["total"] = sum(time_log.values())
+        return time_log
+
+
+class DataWaitMeter:
+    """
+    host time spent waiting for batches against the wall time of the loop
+    """
+
+    def __init__(self):
+        self.wait = 0.0
+        self.start = self.last = time.perf_counter()
+
+    def batch_ready(self):
+        now = time.perf_counter()
+        self.wait += now - self.last
+        return now
+
+    def step_done(self):
+        self.last = time.perf_counter()
+
+    @property
+    def ratio(self):
+        elapsed = time.perf_counter() - self.start
+        return self.wait / elapsed if elapsed > 0 else 0.0
+
+
+def build_profiler(config, output_dir, name):
+    """
+    torch.profiler over the steps chosen by PROFILER.{SKIP_FIRST,WAIT,WARMUP,ACTIVE,REPEAT},
+    traces are exported for chrome://tracing and/or the TensorBoard profiler plugin
+    :return: profiler context, call .step() after each step, None if disabled
+    """
+    cfg = config.PROFILER
+    if not cfg.ENABLE:
+        return None
+    from torch.profiler import profile, schedule, ProfilerActivity, tensorboard_trace_handler
+
+    trace_dir = os.path.join(output_dir, "profiler")
+    os.makedirs(trace_dir, exist_ok=True)
+    tensorboard_handler = tensorboard_trace_handler(trace_dir, worker_name=name) if cfg.TENSORBOARD else None
+
+    def on_trace_ready(prof):
+        if tensorboard_handler is not None:
+            tensorboard_handler(prof)
+        if cfg.CHROME_TRACE:
+            prof.export_chrome_trace(os.path.join(trace_dir, f"{name}_step{prof.step_num}.json"))
+        sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        logger.info("profile of %s until step %s:\n%s", name, prof.step_num,
+                    prof.key_averages().table(sort_by=sort_by, row_limit=cfg.ROW_LIMIT))
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    return profile(activities=activities,
+                   schedule=schedule(skip_first=cfg.SKIP_FIRST, wait=cfg.WAIT, warmup=cfg.WARMUP,
+                                     active=cfg.ACTIVE, repeat=cfg.REPEAT),
+                   on_trace_ready=on_trace_ready,
+                   record_shapes=cfg.RECORD_SHAPES,
+                   profile_memory=cfg.PROFILE_MEMORY,
+                   with_stack=cfg.WITH_STACK)
+
+
+def profiler_context(profiler):
+    return profiler if profiler is not None else contextlib.nullcontext()
+
+
+def profiler_step(profiler):
+    if profiler is not None:
+        profiler.step()
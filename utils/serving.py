@@ -0,0 +1,178 @@
+import time
+import random
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from .train_utils import apply_video
+
+
+class LatencyStats:
+    """
+    latency percentiles over the last window requests
+    """
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+
+    def add(self, ms):
+        self.latencies.append(ms)
+
+    def percentiles(self, ps=(50, 90, 99)):
+        if not self.latencies:
+            return {f"p{p}": 0.0 for p in ps}
+        values = np.percentile(np.asarray(self.latencies), ps)
+        return {f"p{p}": float(v) for p, v in zip(ps, values)}
+
+
+class DynamicBatcher:
+    """
+    asyncio front end of a model: clips of concurrent requests are queued and run as one batch, formed when
+    max_batch_size clips are queued or max_delay_ms after the first clip of the batch arrived
+    batches run on a dedicated inference thread, so the event loop keeps accepting requests meanwhile
+
+        batcher = DynamicBatcher(build_model(config), device="cuda:0")
+        await batcher.start()
+        probabilities = await batcher.infer(clip)  # (C,T,H,W) uint8 clip or (slow, fast) pair
+    """
+
+    def __init__(self, net: torch.nn.Module, max_batch_size=16, max_delay_ms=10.0, device="cpu", max_queue=1024):
+        self.net = net.to(device).eval()
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.device = device
+        self.max_queue = max_queue
+        self.latency = LatencyStats()
+        self.num_batches = self.num_requests = 0
+        self.queue = self.task = self.executor = None
+        self.inflight = []  # items taken from the queue whose futures are not resolved yet
+        self.closed = False
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def infer(self, clip):
+        """
+        :return: model output of the clip, on cpu
+        """
+        if self.closed:
+            raise RuntimeError("server is closed")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((clip, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self):
+        items = self.inflight = [await self.queue.get()]
+        deadline = items[0][2] + self.max_delay
+        while len(items) < self.max_batch_size:
+            if not self.queue.empty():
+                items.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    @staticmethod
+    def _fail(items, error):
+        for _, future, _ in items:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                items = await self._next_batch()
+                items = [item for item in items if not item[1].cancelled()]
+                if not items:
+                    continue
+                try:
+                    outputs = await loop.run_in_executor(self.executor, self._run, [clip for clip, _, _ in items])
+                except Exception as e:
+                    self._fail(items, e)
+                    continue
+                now = time.perf_counter()
+                for (_, future, arrival), output in zip(items, outputs):
+                    if not future.done():
+                        future.set_result(output)
+                    self.latency.add((now - arrival) * 1000)
+                self.num_batches += 1
+                self.num_requests += len(items)
+                self.inflight = []
+        except asyncio.CancelledError:
+            # closed while a batch was collected or running, its requests are off the queue
+            self._fail(self.inflight, RuntimeError("server is closed"))
+            self.inflight = []
+            raise
+
+    def _run(self, clips):
+        # executed on the inference thread
+        if isinstance(clips[0], (tuple, list)):
+            video = tuple(torch.stack([clip[i] for clip in clips]) for i in range(len(clips[0])))
+        else:
+            video = torch.stack(clips)
+        with torch.inference_mode():
+            video = apply_video(lambda v: v.to(self.device, non_blocking=True) / 225, video)
+            return self.net(video).float().cpu().unbind(0)
+
+    def stats(self):
+        return {"queue_depth": self.queue.qsize() if self.queue is not None else 0,
+                "batches": self.num_batches,
+                "requests": self.num_requests,
+                "mean_batch_size": self.num_requests / max(1, self.num_batches),
+                "latency_ms": self.latency.percentiles()}
+
+    async def close(self):
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        while self.queue is not None and not self.queue.empty():
+            self._fail([self.queue.get_nowait()], RuntimeError("server is closed"))
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+async def generate_load(batcher, make_clip, num_requests, rate=None, concurrency=8, seed=0):
+    """
+    local load generator
+    :param make_clip: i -> clip of the i-th request
+    :param rate: open loop with poisson arrivals at rate requests/s, closed loop with concurrency clients if None
+    :return: throughput in requests/s, latency percentiles in ms as seen by the clients
+    """
+    rng = random.Random(seed)
+    latency = LatencyStats(window=num_requests)
+
+    async def request(i):
+        start = time.perf_counter()
+        await batcher.infer(make_clip(i))
+        latency.add((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    if rate is not None:
+        tasks = []
+        for i in range(num_requests):
+            tasks.append(asyncio.ensure_future(request(i)))
+            await asyncio.sleep(rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+    else:
+        counter = iter(range(num_requests))
+
+        async def client():
+            for i in counter:
+                await request(i)
+
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {"throughput": num_requests / elapsed, "latency_ms": latency.percentiles()}
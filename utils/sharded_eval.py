@@ -0,0 +1,166 @@
+import os
+import json
+import logging
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.utils import data
+
+logger = logging.getLogger(__name__)
+
+
+def shard_ranges(num_samples, num_shards):
+    """
+    contiguous [start, end) ranges of the dataset index, clips of a video stay together for decode locality
+    """
+    bounds = [num_samples * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def shard_path(output_dir, shard):
+    return os.path.join(output_dir, f"shard_{shard:05d}.npz")
+
+
+def clip_logits(net, video, arch):
+    # slowfast applies softmax in eval mode, its logits are the output of fc
+    if arch == "slowfast":
+        return net.fc(net.forward_features(video))
+    return net(video)
+
+
+def _evaluate_shards(worker_id, config, state_dict, dataset, shards, output_dir, devices, num_workers):
+    # executed in spawned processes, shards is a shared queue of (shard, start, end)
+    from model import build_model, optimize_model
+    from data.sampler import IndexedSubset, collate_indexed, clip_video_ids
+    from .train_utils import to_device, apply_video
+
+    device = torch.device(devices[worker_id % len(devices)])
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    net = build_model(config)
+    net.load_state_dict(state_dict)
+    net = optimize_model(net.to(device).eval(), config)
+    video_ids = clip_video_ids(dataset)
+
+    while True:
+        task = shards.get()
+        if task is None:
+            break
+        shard, start, end = task
+        shard_loader = data.DataLoader(IndexedSubset(dataset, start, end), config.DATA.BATCH_SIZE, shuffle=False,
+                                       num_workers=num_workers, pin_memory=device.type == "cuda",
+                                       collate_fn=collate_indexed)
+        logits, labels, clip_ids = [], [], []
+        with torch.no_grad():
+            for video, target in shard_loader:
+                video = apply_video(lambda v: v / 225, to_device(video, device))
+                logits.append(clip_logits(net, video, config.MODEL.ARCH).float().cpu())
+                labels.append(target[0])
+                clip_ids.append(target[1])
+        if not logits:  # empty shard
+            logits = [torch.zeros(0, config.MODEL.NUM_CLASSES)]
+            labels = clip_ids = [torch.zeros(0, dtype=torch.long)]
+        clip_ids = torch.cat(clip_ids).numpy()
+        path = shard_path(output_dir, shard)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, logits=torch.cat(logits).numpy().astype(config.EVAL.DTYPE), labels=torch.cat(labels).numpy(),
+                 clip_ids=clip_ids, video_ids=video_ids[clip_ids])
+        os.replace(tmp, path)  # a shard file is complete or absent
+        print(f"worker {worker_id} ({device}): shard {shard} [{start}, {end}) done", flush=True)
+
+
+def topk_accuracy(scores, labels, k):
+    topk = np.argsort(-scores, axis=1)[:, :k]
+    return float((topk == labels[:, None]).any(axis=1).mean() * 100) if len(labels) else 0.0
+
+
+def merge_shards(output_dir, num_shards):
+    """
+    :return: clip and video level top1/top5, video scores are the mean softmax of their clips
+    """
+    shards = [np.load(shard_path(output_dir, shard)) for shard in range(num_shards)]
+    logits = np.concatenate([shard["logits"] for shard in shards]).astype(np.float32)
+    labels = np.concatenate([shard["labels"] for shard in shards])
+    clip_ids = np.concatenate([shard["clip_ids"] for shard in shards])
+    video_ids = np.concatenate([shard["video_ids"] for shard in shards])
+    order = np.argsort(clip_ids, kind="stable")
+    logits, labels, clip_ids, video_ids = logits[order], labels[order], clip_ids[order], video_ids[order]
+
+    probabilities = torch.softmax(torch.from_numpy(logits), dim=-1).numpy()
+    videos, inverse, counts = np.unique(video_ids, return_inverse=True, return_counts=True)
+    video_scores = np.zeros((len(videos), logits.shape[1]), dtype=np.float64)
+    np.add.at(video_scores, inverse, probabilities)
+    video_scores /= counts[:, None]
+    video_labels = np.zeros(len(videos), dtype=labels.dtype)
+    video_labels[inverse] = labels
+
+    np.savez(os.path.join(output_dir, "merged.npz"), logits=logits, labels=labels, clip_ids=clip_ids,
+             video_ids=video_ids, video_scores=video_scores, videos=videos)
+    return {"num_clips": int(len(labels)), "num_videos": int(len(videos)),
+            "clip_top1": topk_accuracy(logits, labels, 1), "clip_top5": topk_accuracy(logits, labels, 5),
+            "video_top1": topk_accuracy(video_scores, video_labels, 1),
+            "video_top5": topk_accuracy(video_scores, video_labels, 5)}
+
+
+def check_partition(output_dir, partition):
+    # shards of another partition of the split are not mixed
+    path = os.path.join(output_dir, "partition.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != partition:
+            raise ValueError(f"{output_dir} holds shards of {previous}, not of {partition}")
+    else:
+        with open(path, "w") as f:
+            json.dump(partition, f)
+
+
+def sharded_eval(net: torch.nn.Module, dataset, output_dir, config):
+    """
+    evaluate the test split in EVAL.NUM_SHARD deterministic shards with EVAL.NUM_PROCESS processes,
+    finished shards are skipped, so an interrupted evaluation resumes by shard
+    EVAL.SHARDS restricts this run to some shards, e.g. to split the evaluation across machines sharing output_dir,
+    the results are merged once every shard is written
+    :param dataset: test split of data.build_dataset, indexed once and sent to the evaluation processes
+    :return: merged metrics, None if shards are missing
+    """
+    cfg = config.EVAL
+    num_samples = len(dataset)
+    os.makedirs(output_dir, exist_ok=True)
+    check_partition(output_dir, {"num_samples": num_samples, "num_shard": cfg.NUM_SHARD})
+    ranges = shard_ranges(num_samples, cfg.NUM_SHARD)
+    selected = list(cfg.SHARDS) or list(range(cfg.NUM_SHARD))
+    pending = [shard for shard in selected if not os.path.exists(shard_path(output_dir, shard))]
+    logger.info("%s of %s shards to evaluate", len(pending), len(selected))
+
+    if pending:
+        ctx = mp.get_context("spawn")
+        shards = ctx.Queue()
+        num_process = min(cfg.NUM_PROCESS, len(pending))
+        for shard in pending:
+            shards.put((shard, *ranges[shard]))
+        for _ in range(num_process):
+            shards.put(None)
+        state_dict = {k: v.cpu() for k, v in net.state_dict().items()}
+        num_workers = max(0, config.DATA.NUM_WORKER // num_process)
+        processes = [ctx.Process(target=_evaluate_shards,
+                                 args=(worker_id, config, state_dict, dataset, shards, output_dir,
+                                       list(cfg.DEVICES), num_workers))
+                     for worker_id in range(num_process)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        failed = [shard for shard in pending if not os.path.exists(shard_path(output_dir, shard))]
+        if failed:
+            raise RuntimeError(f"shards {failed} failed, run again to resume")
+
+    missing = [shard for shard in range(cfg.NUM_SHARD) if not os.path.exists(shard_path(output_dir, shard))]
+    if missing:
+        logger.info("shards %s are not evaluated yet, results are merged once all shards are written", missing)
+        return None
+    results = merge_shards(output_dir, cfg.NUM_SHARD)
+    with open(os.path.join(output_dir, "results.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info("sharded eval: %s", results)
+    return results
@@ -0,0 +1,300 @@
+import os
+import csv
+import json
+import math
+import time
+import queue
+import random
+import logging
+import itertools
+import traceback
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from .train_utils import apply_video
+
+logger = logging.getLogger(__name__)
+
+# keys of the shared data pipeline, the same for every trial
+SHARED_KEYS = ("DATA.", "SEED")
+DISTRIBUTIONS = {"uniform": random.Random.uniform,
+                 "loguniform": lambda rng, low, high: math.exp(rng.uniform(math.log(low), math.log(high))),
+                 "randint": random.Random.randint}
+
+
+def expand_space(space, search="grid", num_trial=0, seed=0):
+    """
+    :param space: [key, [choices]] items, or [key, "uniform" | "loguniform" | "randint", low, high] for random search
+    :return: list of {key: value} overrides, one per trial
+    """
+    for item in space:
+        key = item[0]
+        assert not key.startswith(SHARED_KEYS), f"{key} is shared by the trials and can not be swept"
+        if search == "grid":
+            assert isinstance(item[1], (list, tuple)), f"grid search needs a list of values for {key}"
+    if search == "grid":
+        keys = [item[0] for item in space]
+        return [dict(zip(keys, values)) for values in itertools.product(*[item[1] for item in space])]
+    elif search == "random":
+        rng = random.Random(seed)
+        trials = []
+        for _ in range(num_trial):
+            overrides = {}
+            for item in space:
+                if isinstance(item[1], (list, tuple)):
+                    overrides[item[0]] = rng.choice(list(item[1]))
+                else:
+                    overrides[item[0]] = DISTRIBUTIONS[item[1]](rng, item[2], item[3])
+            trials.append(overrides)
+        return trials
+    raise NotImplementedError(f"search {search}")
+
+
+def trial_config(config, overrides):
+    config = config.clone()
+    config.defrost()
+    config.merge_from_list([v for key, value in overrides.items() for v in (key, value)])
+    config.freeze()
+    return config
+
+
+def weak_trials(top1, quantile):
+    """
+    :param top1: trial -> eval top1 of the trials still running at an epoch
+    :return: trials below the quantile, the best trial is never stopped
+    """
+    if len(top1) < 2:
+        return []
+    threshold = np.quantile(list(top1.values()), quantile)
+    return [trial for trial, acc in top1.items() if acc < threshold]
+
+
+def _run_trial(trial_id, config, batches, results, device, budget):
+    # executed in spawned processes, batches is fed by the producer of the sweep
+    from model import build_model, build_criterion
+    from .optim import build_optimizer
+    from .train_utils import accuracy_metric, to_device, load_checkpoint
+
+    try:
+        device = torch.device(device)
+        if device.type == "cuda":
+            torch.cuda.set_device(device)
+            if budget["memory_fraction"] > 0:
+                torch.cuda.set_per_process_memory_fraction(budget["memory_fraction"], device)
+        if budget["num_thread"] > 0:
+            torch.set_num_threads(budget["num_thread"])
+        torch.manual_seed(config.SEED)
+        net = build_model(config)
+        if config.MODEL.RESUME:  # pretrained weights of the fine-tune, as in run.py
+            load_checkpoint(ckpt_file=config.MODEL.RESUME, model=net, optimizer=None, scheduler=None,
+                            restart_train=True)
+        net = net.to(device)
+        criterion = build_criterion(config)
+        optimizer = build_optimizer(net, config)
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer,
+                                                    step_size=config.TRAIN.LR_SCHEDULER.DECAY_EPOCH,
+                                                    gamma=config.TRAIN.LR_SCHEDULER.DECAY_RATE)
+        start = time.perf_counter()
+        step = 0
+        totals = torch.zeros(4, dtype=torch.float64)  # loss, top1, top5 sums, samples
+        optimizer.zero_grad()
+        while True:
+            message = batches.get()
+            if message is None:  # stopped by the sweep
+                return
+            kind = message[0]
+            if kind in ("train", "eval"):
+                video = apply_video(lambda v: v / 225, to_device(message[1], device))
+                label = message[2].to(device, non_blocking=True)
+            if kind == "train":
+                net.train()
+                outputs = net(video)
+                loss = criterion(outputs, label)
+                loss.backward()
+                if step % config.TRAIN.ACCUMULATION_STEP == 0:
+                    optimizer.step()
+                    optimizer.zero_grad()
+                step += 1
+            elif kind == "eval":
+                net.eval()
+                with torch.no_grad():
+                    logits = net(video)
+                    acc1, acc5 = accuracy_metric(logits, label, topk=(1, 5))
+                    n = label.size(0)
+                    totals += torch.tensor([criterion(logits, label).item() * n, acc1.item() * n, acc5.item() * n, n],
+                                           dtype=torch.float64)
+            elif kind == "epoch":
+                epoch = message[1]
+                scheduler.step()
+                metrics = None
+                if totals[3] > 0:
+                    loss, top1, top5 = (totals[:3] / totals[3]).tolist()
+                    metrics = {"loss": loss, "top1": top1, "top5": top5}
+                totals.zero_()
+                minutes = (time.perf_counter() - start) / 60
+                status = "running"
+                if epoch + 1 >= config.TRAIN.EPOCH:
+                    status = "done"
+                elif 0 < budget["minutes"] <= minutes:
+                    status = "budget"
+                results.put((trial_id, status, epoch, metrics, minutes))
+                if status != "running":
+                    return
+    except Exception:
+        results.put((trial_id, "failed", None, traceback.format_exc(), None))
+
+
+class _Trial:
+    def __init__(self, trial_id, overrides, config):
+        self.id = trial_id
+        self.overrides = overrides
+        self.config = config
+        self.status = "pending"
+        self.history = []  # (epoch, metrics)
+        self.minutes = 0.0
+        self.process = self.batches = None
+
+    def send(self, message):
+        # a failed trial does not block the producer
+        while self.process.is_alive():
+            try:
+                self.batches.put(message, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        if self.status == "running":
+            self.status = "failed"
+        return False
+
+    def row(self):
+        evaluated = [metrics for _, metrics in self.history if metrics is not None]
+        best = max(evaluated, key=lambda m: m["top1"]) if evaluated else {}
+        return {"trial": self.id, **self.overrides,
+                "status": self.status, "epochs": len(self.history),
+                "best_top1": best.get("top1", float("nan")), "best_top5": best.get("top5", float("nan")),
+                "last_top1": evaluated[-1]["top1"] if evaluated else float("nan"),
+                "minutes": self.minutes}
+
+
+def format_summary(rows):
+    if not rows:
+        return ""
+    header = list(rows[0].keys())
+    table = [header] + [[f"{v:.4g}" if isinstance(v, float) else str(v) for v in row.values()] for row in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(w) for cell, w in zip(row, widths)) for row in table)
+
+
+def _broadcast(trials, message):
+    for trial in trials:
+        if trial.status == "running":
+            trial.send(message)
+
+
+def _share(video, label):
+    # shared once, every trial process maps the same memory
+    return apply_video(lambda v: v.share_memory_(), video), label.share_memory_()
+
+
+def _run_wave(trials, train_loader, val_loader, results, config):
+    cfg = config.SWEEP
+    max_epoch = max(trial.config.TRAIN.EPOCH for trial in trials)
+    for epoch in range(max_epoch):
+        running = [trial for trial in trials if trial.status == "running"]
+        if not running:
+            break
+        for video, label in train_loader:
+            _broadcast(running, ("train", *_share(video, label)))
+        evaluated = (epoch + 1) % cfg.EVAL_FREQ == 0 or epoch + 1 == max_epoch
+        if evaluated:
+            for video, label in val_loader:
+                _broadcast(running, ("eval", *_share(video, label)))
+        _broadcast(running, ("epoch", epoch))
+
+        # epoch reports of the running trials
+        pending = {trial.id: trial for trial in running if trial.status == "running"}
+        while pending:
+            try:
+                trial_id, status, _, metrics, minutes = results.get(timeout=1)
+            except queue.Empty:
+                for trial in list(pending.values()):
+                    if not trial.process.is_alive():
+                        trial.status = "failed"
+                        del pending[trial.id]
+                continue
+            if status == "failed":
+                logger.error("trial %s failed:\n%s", trial_id, metrics)
+            trial = pending.pop(trial_id, None)
+            if trial is None:
+                continue
+            if status == "failed":
+                trial.status = status
+                continue
+            trial.history.append((epoch, metrics))
+            trial.minutes = minutes
+            trial.status = status
+            if metrics is not None:
+                logger.info("sweep epoch %s, trial %s: top1 %.2f top5 %.2f loss %.4f", epoch + 1, trial_id,
+                            metrics["top1"], metrics["top5"], metrics["loss"])
+
+        # early stopping from the eval metrics of this epoch
+        if evaluated and cfg.EARLY_STOP and epoch + 1 >= cfg.GRACE_EPOCH:
+            top1 = {trial.id: trial.history[-1][1]["top1"] for trial in trials
+                    if trial.status == "running" and trial.history and trial.history[-1][1] is not None}
+            for trial in trials:
+                if trial.id in weak_trials(top1, cfg.STOP_QUANTILE):
+                    logger.info("trial %s is stopped early at epoch %s (top1 %.2f)", trial.id, epoch + 1,
+                                top1[trial.id])
+                    trial.send(None)
+                    trial.status = "stopped"
+
+
+def sweep(build_split_loader, output_dir, config):
+    """
+    run the trials of SWEEP.SPACE around config, SWEEP.NUM_PARALLEL at a time in spawned processes
+    the batches are decoded once by the train and val loaders of this process and broadcast to all running trials
+    through shared memory, trials advance epoch by epoch together, weak trials are stopped after the eval epochs
+    :param build_split_loader: split name -> data loader
+    :return: summary rows, best trial first
+    """
+    cfg = config.SWEEP
+    space = expand_space(cfg.SPACE, cfg.SEARCH, cfg.NUM_TRIAL, config.SEED)
+    trials = [_Trial(i, overrides, trial_config(config, overrides)) for i, overrides in enumerate(space)]
+    logger.info("sweep: %s trials, %s in parallel", len(trials), cfg.NUM_PARALLEL)
+    os.makedirs(output_dir, exist_ok=True)
+    train_loader, val_loader = build_split_loader("train"), build_split_loader("val")
+    budget = {"minutes": cfg.TIME_BUDGET_MIN, "memory_fraction": cfg.MEMORY_FRACTION, "num_thread": cfg.NUM_THREAD}
+
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    for start in range(0, len(trials), cfg.NUM_PARALLEL):
+        wave = trials[start:start + cfg.NUM_PARALLEL]
+        for i, trial in enumerate(wave):
+            trial.batches = ctx.Queue(maxsize=cfg.QUEUE_SIZE)
+            trial.process = ctx.Process(target=_run_trial,
+                                        args=(trial.id, trial.config, trial.batches, results,
+                                              cfg.DEVICES[i % len(cfg.DEVICES)], budget))
+            trial.process.start()
+            trial.status = "running"
+        try:
+            _run_wave(wave, train_loader, val_loader, results, config)
+        finally:
+            for trial in wave:
+                if trial.process.is_alive():
+                    trial.send(None)
+                trial.process.join()
+        for trial in wave:
+            with open(os.path.join(output_dir, f"trial_{trial.id:03d}.json"), "w") as f:
+                json.dump({"overrides": trial.overrides, "status": trial.status,
+                           "history": [{"epoch": epoch + 1, **(metrics or {})} for epoch, metrics in trial.history]},
+                          f, indent=2)
+
+    rows = sorted((trial.row() for trial in trials),
+                  key=lambda row: -row["best_top1"] if not math.isnan(row["best_top1"]) else math.inf)
+    if rows:
+        with open(os.path.join(output_dir, "summary.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    logger.info("sweep summary:\n%s", format_summary(rows))
+    return rows
@@ -1,8 +1,11 @@
 import time
 import os
 import torch
-from torch.utils.tensorboard import SummaryWriter
 from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # tensorboard is only imported by the modes writing summaries
+    from torch.utils.tensorboard import SummaryWriter
 
 
 def accuracy_metric(logits, target, topk=(1,)):
@@ -41,7 +44,7 @@ class AvgMeter:
         return format_str.format(**self.__dict__)
 
 
-def summary_graph(dummy_shape: tuple, net: torch.nn.Module, summary_writer: SummaryWriter):
+def summary_graph(dummy_shape: tuple, net: torch.nn.Module, summary_writer: "SummaryWriter"):
     x = torch.randn(dummy_shape)
     summary_writer.add_graph(net, x)
 
@@ -70,6 +73,21 @@ class ResetTimer:
         return (after - pre) * 1000
 
 
+def to_device(sample, device, non_blocking=True):
+    if isinstance(sample, (tuple, list)):
+        return type(sample)(to_device(s, device, non_blocking) for s in sample)
+    return sample.to(device, non_blocking=non_blocking)
+
+
+def apply_video(fn, video):
+    """
+    apply fn to a clip, or to each pathway of a (slow, fast) clip pair
+    """
+    if isinstance(video, (tuple, list)):
+        return type(video)(fn(v) for v in video)
+    return fn(video)
+
+
 class PreFetcher:
     def __init__(self, data_loader, device):
         self.loader = iter(data_loader)
@@ -85,7 +103,7 @@ class PreFetcher:
             self.batch = None
             return
         with torch.cuda.stream(self.stream):
-            self.batch = [sample.to(self.device, non_blocking=True) for sample in self.batch]
+            self.batch = to_device(self.batch, self.device)
 
     def __next__(self):
         torch.cuda.current_stream().wait_stream(self.stream)
@@ -107,22 +125,37 @@ def auto_resume(ckpt_folder):
         return None
 
 
-def save_checkpoint(ckpt_folder, epoch, model, optimizer, scheduler, config, prefix=""):
+def save_checkpoint(ckpt_folder, epoch, model, optimizer, scheduler, config, prefix="", step=None):
+    """
+    a sharded optimizer state is consolidated first, call it on every rank, only rank 0 writes the file
+    :param step: global train step, the tensorboard step of a resumed run
+    """
+    from .optim import optimizer_state_dict
+
+    optimizer_state = optimizer_state_dict(optimizer)
+    ckpt_path = os.path.join(ckpt_folder, f"checkpoint{prefix}_{epoch}.pth")
+    if optimizer_state is None:  # not rank 0
+        return ckpt_path
     stat_dict = {
         "epoch": epoch,
         "model": model.state_dict(),
-        "optimizer": optimizer.state_dict(),
+        "optimizer": optimizer_state,
         "scheduler": scheduler.state_dict(),
-        "config": config
+        "config": config,
+        "step": step
     }
-    ckpt_path = os.path.join(ckpt_folder, f"checkpoint{prefix}_{epoch}.pth")
     torch.save(stat_dict, ckpt_path)
     return ckpt_path
 
 
 def load_checkpoint(ckpt_file, model: torch.nn.Module, optimizer: torch.optim.Optimizer, scheduler,
-                    restart_train=False):
+                    restart_train=False, with_step=False):
+    """
+    :param with_step: also return the global train step of the checkpoint, None if it is not recorded
+    """
     state_dict = torch.load(ckpt_file, map_location="cpu")
+    if hasattr(model, "adapt_state_dict"):  # e.g. resample positional embedding to the model's input shape
+        state_dict["model"] = model.adapt_state_dict(state_dict["model"])
     try:
         missing = model.load_state_dict(state_dict["model"], strict=False)
         if missing:
@@ -131,6 +164,9 @@ def load_checkpoint(ckpt_file, model: torch.nn.Module, optimizer: torch.optim.Op
         print("fail to directly recover from checkpoint, try to match each layers...")
         net_dict = model.state_dict()
         print("find %s layers", len(state_dict["model"].items()))
+        dropped = [k for k, v in state_dict["model"].items() if k in net_dict and net_dict[k].shape != v.shape]
+        if dropped:
+            print(f"shape mismatch, layers are not resumed: {dropped}")
         state_dict["model"] = {k: v for k, v in state_dict["model"].items() if
                                (k in net_dict and net_dict[k].shape == v.shape)}
         print("resume %s layers from checkpoint", len(state_dict["model"].items()))
@@ -138,19 +174,20 @@ def load_checkpoint(ckpt_file, model: torch.nn.Module, optimizer: torch.optim.Op
         model.load_state_dict(OrderedDict(net_dict))
 
     if not restart_train:
-        # remove optimizer state
-        state_dict["optimizer"]["state"] = optimizer.state
-        state_dict["optimizer"]["param_groups"][0]["params"] = optimizer.param_groups[0]["params"]
-        optimizer.load_state_dict(state_dict["optimizer"])
+        from .optim import load_optimizer_state_dict
+
+        if not load_optimizer_state_dict(optimizer, state_dict["optimizer"]):
+            print("optimizer parameter groups changed, only the hyper-parameters are resumed")
         scheduler.load_state_dict(state_dict["scheduler"])
         epoch = state_dict["epoch"]
+        step = state_dict.get("step")
     else:
         print("restart train, optimizer and scheduler will not be resumed")
-        epoch = 0
+        epoch = step = 0
 
     del state_dict
     torch.cuda.empty_cache()
-    return epoch  # start epoch
+    return (epoch, step) if with_step else epoch  # start epoch
 
 
 class TrainErrorHelper: